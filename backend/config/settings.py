@@ -21,6 +21,13 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 load_dotenv(BASE_DIR / ".env")
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+# Override to use the local stand-in (`manage.py fakegemini`), e.g. http://127.0.0.1:8765/
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+# Shared Gemini HTTP client (services/gemini_client.py)
+GEMINI_POOL_SIZE = int(os.getenv("GEMINI_POOL_SIZE", 10))
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", 60))  # seconds per request
+GEMINI_KEEPALIVE_EXPIRY = 60  # seconds an idle connection is kept open
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/6.0/howto/deployment/checklist/
@@ -122,6 +129,8 @@ TEMPLATES = [
     },
 ]
 
+# The SSE endpoint (templates/generate/stream/) only streams when served through
+# config.asgi.application; under WSGI its events are buffered until the end.
 WSGI_APPLICATION = 'config.wsgi.application'
 
 
@@ -136,6 +145,141 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# 'shared' must be visible to every worker process (run `manage.py createcachetable`,
+# or point it at Redis/Memcached in production).
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'shared_cache',
+    },
+}
+
+# Template generation single-flight (seconds)
+SINGLEFLIGHT_CACHE_ALIAS = 'shared'
+SINGLEFLIGHT_LEASE_TIMEOUT = 120
+SINGLEFLIGHT_WAIT_TIMEOUT = 90
+
+# Token-bucket throttling of the AI-backed endpoints (services/throttling.py), in cost units.
+# A user can burst 5 generations and then gets one a minute; stored-template fetches cost 1
+# and hot-cache hits are free (no bucket round trip).
+AI_THROTTLE_CACHE_ALIAS = 'shared'
+AI_THROTTLE_BUCKETS = {
+    # Capacity covers the largest request (VERIFICATION_BATCH_MAX_ITEMS * the 'verify' cost); larger ones are refused
+    'ai_user': {'capacity': 250, 'refill_per_minute': 20},
+    'ai_global': {'capacity': 1000, 'refill_per_minute': 300},
+}
+AI_THROTTLE_COSTS = {
+    'cached': 0,  # template in the per-process cache
+    'fetch': 1,  # template stored in the database, no model call
+    'generate': 20,  # template generation
+    'verify': 5,  # per certificate in a verification batch
+}
+
+# Async template generation jobs
+TEMPLATE_JOB_WORKERS = int(os.getenv("TEMPLATE_JOB_WORKERS", 4))
+TEMPLATE_JOB_STALE_AFTER = 300  # seconds without progress before a job counts as lost
+TEMPLATE_JOBS_EAGER = False  # run jobs inline (tests)
+
+# Resolved-template cache: per-process LRU in front of the shared cache
+TEMPLATE_CACHE_ALIAS = 'shared'
+TEMPLATE_CACHE_SIZE = 2048
+TEMPLATE_CACHE_LOCAL_TTL = 60  # bounds staleness in other processes after an edit
+TEMPLATE_CACHE_SHARED_TTL = 3600
+
+# Compiled render plans for Template.content_html (documents/rendering.py)
+TEMPLATE_RENDER_CACHE_SIZE = 512
+
+# Compiled form_schema validators for UserDocument.form_data (documents/validation.py)
+FORM_VALIDATOR_CACHE_SIZE = 512
+
+# Decoded content-addressed Template bodies kept per process (documents.models.TemplateBody)
+TEMPLATE_BODY_CACHE_SIZE = 256
+
+# Per-model change versions behind catalog ETags (services/versioning.py); must be shared by all workers
+CATALOG_VERSION_CACHE_ALIAS = 'shared'
+CATALOG_VERSION_LOCAL_TTL = 2  # seconds a process trusts its own copy (304s, state codes, prompts)
+
+# Resilience for every model call (services/resilience.py). GEMINI_TIMEOUT bounds each attempt.
+LLM_CALL_DEADLINE = float(os.getenv("LLM_CALL_DEADLINE", 90))  # seconds for a call, retries included
+LLM_RETRY_ATTEMPTS = 3  # transient errors only: timeouts, connection errors, 408/429, 5xx
+LLM_RETRY_BASE_DELAY = 0.5  # full-jitter exponential backoff, seconds
+LLM_RETRY_MAX_DELAY = 8
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))  # in-flight model calls per process
+LLM_BULKHEAD_WAIT = 5  # seconds to wait for a slot before failing fast
+LLM_BREAKER_FAILURES = 5  # consecutive transient failures that open the circuit
+LLM_BREAKER_RESET = 30  # seconds open before a probe call is let through
+LLM_SERVE_STALE = True  # answer from an older prompt version's cache entry while Gemini is failing
+
+# Model call metrics (GET /api/metrics/, staff only) and a JSON line per call on the
+# 'llm.calls' logger (services/metrics.py)
+LLM_CALL_LOG = os.getenv("LLM_CALL_LOG", "1") == "1"
+# Each worker process writes its metric values here and a scrape sums them all (files of
+# exited workers are folded into one). Must be shared by the workers of one server.
+# Set to "" to keep metrics per process.
+LLM_METRICS_DIR = os.getenv("LLM_METRICS_DIR", str(BASE_DIR / 'var' / 'metrics'))
+LLM_METRICS_PUBLISH_INTERVAL = 1  # seconds; a worker writes its file at most this often
+
+# manage.py test keeps metrics per process (config/test_runner.py)
+TEST_RUNNER = 'config.test_runner.TestRunner'
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json_line': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'llm_calls': {'class': 'logging.StreamHandler', 'formatter': 'json_line'},
+    },
+    'loggers': {
+        'llm.calls': {'handlers': ['llm_calls'], 'level': os.getenv("LLM_CALL_LOG_LEVEL", "INFO"), 'propagate': False},
+    },
+}
+
+# Persistent, content-addressed caches of model responses (services/llm_cache.py)
+LLM_CACHES = {
+    'default': {
+        'ENABLED': os.getenv("LLM_CACHE_ENABLED", "1") == "1",
+        'PATH': BASE_DIR / 'var' / 'llm_cache.sqlite3',
+        'MAX_BYTES': 256 * 1024 * 1024,
+    },
+    # Certificate verification results by (file hash, expected data); prompt version is the namespace
+    'verification': {
+        'ENABLED': os.getenv("LLM_CACHE_ENABLED", "1") == "1",
+        'PATH': BASE_DIR / 'var' / 'verification_cache.sqlite3',
+        'MAX_BYTES': 64 * 1024 * 1024,
+    },
+}
+
+# Order fees (order_management/fees.py); stamp duty comes from masters.DutyRule (masters/duty.py)
+ORDER_SERVICE_FEE = 50
+ORDER_SHIPPING_FEE = 100  # physical delivery
+DUTY_QUOTE_MAX_VALUES = 10000  # consideration values per bulk quote call
+
+# Batch certificate verification (services/verification.py)
+VERIFICATION_BATCH_WORKERS = int(os.getenv("VERIFICATION_BATCH_WORKERS", 4))  # shared by all batches
+VERIFICATION_ITEM_TIMEOUT = 90  # seconds per certificate, from when it starts
+VERIFICATION_BATCH_MAX_ITEMS = 50
+VERIFICATION_TEXT_PRECHECK = True  # confirm text-layer PDFs locally (needs pypdf) before asking the model
+# Payload reduction before upload (services/payloads.py; needs pypdf / Pillow)
+VERIFICATION_PAYLOAD_REDUCTION = True
+VERIFICATION_MAX_PAGES = 2  # PDF pages sent; scans without a text layer keep the first ones
+VERIFICATION_IMAGE_MAX_SIDE = 1600  # px
+VERIFICATION_IMAGE_QUALITY = 85  # JPEG
+VERIFICATION_PAYLOAD_CACHE_SIZE = 32
+VERIFICATION_INLINE_MAX_BYTES = 8 * 1024 * 1024  # larger files go through the Gemini Files API
+
+# Uploads are spooled to disk and hashed as they arrive (services/uploads.py)
+FILE_UPLOAD_HANDLERS = ['services.uploads.HashingUploadHandler']
+FILE_UPLOAD_MAX_SIZE = 25 * 1024 * 1024  # per file
+FILE_UPLOAD_MAX_REQUEST_SIZE = 200 * 1024 * 1024  # whole multipart body, e.g. a verification batch
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -171,3 +315,13 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/6.0/howto/static-files/
 
 STATIC_URL = 'static/'
+
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# PDF generation for paid documents (`manage.py process_documents`)
+PDF_PIPELINE_BATCH_SIZE = 20
+PDF_PIPELINE_WORKERS = None  # defaults to the CPU count
+PDF_PIPELINE_TIMEOUT = 120  # seconds per document
+PDF_PIPELINE_MAX_ATTEMPTS = 3  # then the document is FAILED
+PDF_PIPELINE_STALE_AFTER = 600  # seconds before a PROCESSING document is assumed abandoned
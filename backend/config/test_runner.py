@@ -0,0 +1,21 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    The default runner, with settings that must never leak out of a test run
+    applied to the whole suite. Metrics stay per process (tests that need the
+    shared directory point LLM_METRICS_DIR at a temporary one), so a run never
+    leaves files in var/metrics/ for a real scrape to add up.
+    """
+
+    test_settings = override_settings(LLM_METRICS_DIR='')
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        super().teardown_test_environment(**kwargs)
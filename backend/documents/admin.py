@@ -1,6 +1,8 @@
 from django.contrib import admin
 from simple_history.admin import SimpleHistoryAdmin
-from .models import DocumentCategory, DocumentType, Template, UserDocument, Prompt
+from services.versioning import bump
+from .cache import invalidate_template
+from .models import DocumentCategory, DocumentType, Template, TemplateGenerationJob, UserDocument, Prompt
 
 @admin.register(DocumentCategory)
 class DocumentCategoryAdmin(admin.ModelAdmin):
@@ -15,9 +17,37 @@ class DocumentTypeAdmin(admin.ModelAdmin):
 
 @admin.register(Template)
 class TemplateAdmin(admin.ModelAdmin):
-    list_display = ('document_type', 'state', 'status', 'is_active', 'updated_at')
-    list_filter = ('status', 'is_active', 'state', 'document_type')
+    list_display = ('document_type', 'state', 'state_key', 'status', 'is_active', 'prompt_version', 'updated_at')
+    list_filter = ('status', 'is_active', 'needs_regeneration', 'state', 'document_type')
     search_fields = ('document_type__name', 'state')
+    actions = ('mark_verified', 'mark_rejected', 'deactivate')
+
+    def _set(self, request, queryset, **changes):
+        # queryset.update() skips post_save, so drop the cached payloads here.
+        keys = list(queryset.values_list('document_type_id', 'state'))
+        updated = queryset.update(**changes)
+        for doc_type_id, state in keys:
+            invalidate_template(doc_type_id, state)
+        bump('documents.Template')
+        self.message_user(request, f"{updated} template(s) updated.")
+
+    @admin.action(description="Mark selected templates as verified")
+    def mark_verified(self, request, queryset):
+        self._set(request, queryset, status=Template.Status.VERIFIED)
+
+    @admin.action(description="Mark selected templates as rejected")
+    def mark_rejected(self, request, queryset):
+        self._set(request, queryset, status=Template.Status.REJECTED)
+
+    @admin.action(description="Deactivate selected templates")
+    def deactivate(self, request, queryset):
+        self._set(request, queryset, is_active=False)
+
+@admin.register(TemplateGenerationJob)
+class TemplateGenerationJobAdmin(admin.ModelAdmin):
+    list_display = ('document_type', 'state', 'status', 'requested_by', 'created_at', 'updated_at')
+    list_filter = ('status',)
+    readonly_fields = ('template', 'error', 'created_at', 'updated_at')
 
 @admin.register(UserDocument)
 class UserDocumentAdmin(admin.ModelAdmin):
@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.core.cache import caches
+
+from masters.utils import normalize_state_key
+from services.caching import LRUCache
+from .serializers import TemplateSerializer
+
+# Tier 1: per-process, bounded by size and TTL. Other processes' copies are
+# only dropped by the TTL, so keep it short.
+_local = LRUCache(
+    maxsize=getattr(settings, 'TEMPLATE_CACHE_SIZE', 2048),
+    ttl=getattr(settings, 'TEMPLATE_CACHE_LOCAL_TTL', 60)
+)
+
+
+def _shared():
+    # Tier 2: shared across workers; any Django cache backend.
+    return caches[getattr(settings, 'TEMPLATE_CACHE_ALIAS', 'shared')]
+
+
+def template_key(doc_type_id, state):
+    return f"{doc_type_id}:{normalize_state_key(state)}"
+
+
+def _shared_key(key):
+    return f"template:{key}"
+
+
+def get_cached_template(doc_type_id, state):
+    """Serialized TemplateSerializer payload for the active template, or None."""
+    key = template_key(doc_type_id, state)
+    payload = _local.get(key)
+    if payload is None:
+        payload = _shared().get(_shared_key(key))
+        if payload is not None:
+            _local.set(key, payload)
+    return payload
+
+
+def cache_template(template):
+    """
+    Stores the template's payload in both tiers and returns it. Templates that
+    need regenerating are not cached, so requests keep reaching the generator.
+    """
+    payload = dict(TemplateSerializer(template).data)
+    if template.is_active and not template.needs_regeneration:
+        key = template_key(template.document_type_id, template.state_key or template.state)
+        _local.set(key, payload)
+        _shared().set(_shared_key(key), payload, getattr(settings, 'TEMPLATE_CACHE_SHARED_TTL', 3600))
+    return payload
+
+
+def invalidate_template(doc_type_id, state):
+    key = template_key(doc_type_id, state)
+    _local.delete(key)
+    _shared().delete(_shared_key(key))
+
+
+def clear_local():
+    _local.clear()
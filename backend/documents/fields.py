@@ -0,0 +1,47 @@
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+
+class BodyBackedDescriptor(DeferredAttribute):
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if not value and instance.body_id is not None:
+            # Loaded rows carry '' in the column; resolve the body once per instance.
+            body = instance._state.fields_cache.get('body')  # set by select_related('body')
+            if body is not None:
+                value = body.html
+            else:
+                value = instance._meta.get_field('body').related_model.html_for(instance.body_id)
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        # Defined so this is a data descriptor and __get__ runs even once the value is in __dict__.
+        instance.__dict__[self.field.attname] = value
+        # Assigning other content (including '') detaches the body, so the new value reads back and
+        # save() interns it. Rows being loaded assign the column before body_id, so keep their link.
+        body_id = instance.__dict__.get('body_id')
+        if body_id is not None and body_id != instance._meta.get_field('body').related_model.digest(value or ''):
+            instance.body_id = None
+
+
+class BodyBackedTextField(models.TextField):
+    """
+    A TextField whose content lives in the model's `body` (a content-addressed
+    TemplateBody). The model sets `body` before saving; the column itself is
+    then written empty, and reads fall through to the body. Rows without a body
+    (e.g. from bulk_create) keep the text inline.
+
+    Only model instances resolve the body: .values()/.values_list() and
+    queryset.update() see the raw column, which is '' for body-backed rows.
+    Load instances (e.g. .only('content_html', 'body')) to read the HTML.
+    """
+
+    descriptor_class = BodyBackedDescriptor
+
+    def pre_save(self, model_instance, add):
+        if model_instance.body_id is not None:
+            return ''
+        return super().pre_save(model_instance, add)
@@ -0,0 +1,94 @@
+from django.db import IntegrityError
+
+from services.gemini import GeminiService
+from services.singleflight import SingleFlight
+from .cache import cache_template, template_key
+from .models import Template
+from masters.utils import normalize_state_key
+
+template_flight = SingleFlight('template-generation')
+
+
+def find_template(doc_type, state):
+    return Template.objects.filter(
+        document_type=doc_type,
+        state_key=normalize_state_key(state),
+        is_active=True
+    ).first()
+
+
+def template_exists(doc_type_id, state):
+    """True when an active template is stored and does not need regenerating."""
+    return Template.objects.filter(
+        document_type_id=doc_type_id,
+        state_key=normalize_state_key(state),
+        is_active=True,
+        needs_regeneration=False
+    ).exists()
+
+
+def fresh_template(doc_type, state):
+    """find_template(), but None for a template saved from a stale answer (so it is generated again)."""
+    template = find_template(doc_type, state)
+    return None if template is None or template.needs_regeneration else template
+
+
+def _generate(doc_type, state):
+    ai_service = GeminiService()
+    generated_data = ai_service.generate_template(doc_type.name, state)
+
+    if not generated_data:
+        return None
+    return save_generated(doc_type, state, generated_data)
+
+
+def save_generated(doc_type, state, generated_data):
+    """
+    Persists AI output as a Pending Review template and primes the template cache.
+    A stale answer ('stale': True, served from the response cache while Gemini
+    was failing) is saved with needs_regeneration; the next fresh answer
+    replaces it in place, and another stale one leaves it as it is.
+    """
+    stale = bool(generated_data.get('stale'))
+    fields = {
+        'content_html': generated_data.get('html_content', ''),
+        'form_schema': generated_data.get('form_schema', []),
+        'prompt_version': generated_data.get('prompt_version'),
+        'needs_regeneration': stale,
+    }
+    current = find_template(doc_type, state)
+    if current is not None and current.needs_regeneration:
+        if not stale:
+            for name, value in fields.items():
+                setattr(current, name, value)
+            current.status = Template.Status.PENDING_REVIEW
+            current.save()
+            cache_template(current)
+        return current
+    try:
+        template = Template.objects.create(
+            document_type=doc_type,
+            state=state,
+            status=Template.Status.PENDING_REVIEW,
+            is_active=True, # Allow immediate use as per requirement
+            **fields
+        )
+        cache_template(template)
+        return template
+    except IntegrityError:
+        # Lost a race with a writer outside the single-flight (e.g. admin); keep theirs.
+        return Template.objects.filter(document_type=doc_type, state_key=normalize_state_key(state)).first()
+
+
+def generate_template(doc_type, state):
+    """
+    Generates the template for (doc_type, state) with at most one Gemini call in
+    flight per key across threads and worker processes. Concurrent callers all
+    receive the same Template, or None if generation failed. A stored
+    template that needs_regeneration is regenerated in place.
+    """
+    return template_flight.do(
+        template_key(doc_type.id, state),
+        lambda: _generate(doc_type, state),
+        lookup=lambda: fresh_template(doc_type, state),
+    )
@@ -0,0 +1,98 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .generation import generate_template
+from .models import TemplateGenerationJob
+
+_executor = None
+_executor_lock = threading.Lock()
+
+ACTIVE_STATUSES = (TemplateGenerationJob.Status.PENDING, TemplateGenerationJob.Status.RUNNING)
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'TEMPLATE_JOB_WORKERS', 4),
+                    thread_name_prefix='template-job'
+                )
+    return _executor
+
+
+def stale_cutoff():
+    return timezone.now() - timedelta(seconds=getattr(settings, 'TEMPLATE_JOB_STALE_AFTER', 300))
+
+
+def enqueue_generation(doc_type, state, user=None):
+    """
+    Returns a job that will produce the template for (doc_type, state).
+    The user's in-progress job for the same key is reused instead of starting
+    another; jobs of different users share the generation itself through the
+    single-flight in generate_template().
+    """
+    requested_by = user if user and user.is_authenticated else None
+    job = TemplateGenerationJob.objects.filter(
+        document_type=doc_type,
+        state__iexact=state,
+        requested_by=requested_by,
+        status__in=ACTIVE_STATUSES,
+        updated_at__gte=stale_cutoff()
+    ).order_by('-created_at').first()
+    if job:
+        return job
+
+    job = TemplateGenerationJob.objects.create(
+        document_type=doc_type,
+        state=state,
+        requested_by=requested_by
+    )
+
+    if getattr(settings, 'TEMPLATE_JOBS_EAGER', False):
+        run_job(job.pk)
+        job.refresh_from_db()
+    else:
+        # Only hand the job to a worker once its row is visible outside this transaction.
+        transaction.on_commit(lambda: get_executor().submit(run_job, job.pk))
+    return job
+
+
+def run_job(job_id):
+    """Executes one generation job. Runs on a pool thread, never on a request worker."""
+    try:
+        job = TemplateGenerationJob.objects.select_related('document_type').get(pk=job_id)
+        job.status = TemplateGenerationJob.Status.RUNNING
+        job.save(update_fields=['status', 'updated_at'])
+
+        try:
+            template = generate_template(job.document_type, job.state)
+        except Exception as e:
+            template = None
+            job.error = str(e)
+
+        if template:
+            job.template = template
+            job.status = TemplateGenerationJob.Status.SUCCEEDED
+        else:
+            job.status = TemplateGenerationJob.Status.FAILED
+            job.error = job.error or 'Failed to generate template.'
+        job.save(update_fields=['status', 'template', 'error', 'updated_at'])
+    finally:
+        if not getattr(settings, 'TEMPLATE_JOBS_EAGER', False):
+            close_old_connections()
+
+
+def expire_if_stale(job):
+    """Marks a job whose worker disappeared (e.g. process restart) as failed."""
+    if job.status in ACTIVE_STATUSES and job.updated_at < stale_cutoff():
+        job.status = TemplateGenerationJob.Status.FAILED
+        job.error = 'Generation was interrupted. Please try again.'
+        job.save(update_fields=['status', 'error', 'updated_at'])
+    return job
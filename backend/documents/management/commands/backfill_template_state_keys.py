@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from documents.state_keys import rekey_templates
+
+
+class Command(BaseCommand):
+    help = "Maps free-text Template.state values onto the canonical, indexed state_key."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Recompute keys for every template, not only missing ones")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        updated, conflicts = rekey_templates(recompute_all=options['all'], dry_run=options['dry_run'])
+        for (doc_type_id, key), rows in conflicts.items():
+            self.stderr.write(f"Conflict for document_type={doc_type_id} state_key={key}: {rows}")
+        skipped = {pk for rows in conflicts.values() for pk in rows if pk != 'existing'}
+
+        verb = "Would update" if options['dry_run'] else "Updated"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {updated} template(s); {len(skipped)} left for manual review."))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from services.fake_gemini import FakeGeminiServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs a local stand-in for the Gemini API. Point the app at it with "
+        "GEMINI_BASE_URL=http://127.0.0.1:<port>/ to load-test the AI paths offline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every call")
+        parser.add_argument('--jitter', type=float, default=0.0, help="+/- seconds of random latency")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of calls answered with a 503")
+        parser.add_argument('--cassette', help="JSON-lines file of recorded responses to replay")
+        parser.add_argument('--record', metavar='UPSTREAM', nargs='?', const='https://generativelanguage.googleapis.com',
+                            help="Forward cassette misses to the real API and append them to --cassette")
+
+    def handle(self, *args, **options):
+        if options['record'] and not options['cassette']:
+            self.stderr.write("--record needs --cassette to write to.")
+            return
+
+        server = FakeGeminiServer(
+            (options['host'], options['port']),
+            latency=options['latency'],
+            jitter=options['jitter'],
+            error_rate=options['error_rate'],
+            cassette=options['cassette'],
+            upstream=options['record'],
+        )
+        mode = f"recording to {options['cassette']}" if options['record'] else (
+            f"replaying {len(server.cassette)} recorded responses" if server.cassette is not None else "serving canned responses")
+        self.stdout.write(self.style.SUCCESS(f"Fake Gemini on {server.base_url} ({mode}). Ctrl-C to stop."))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Stats: {server.stats}")
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from documents.models import Template, TemplateBody
+from services.versioning import bump
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves inline Template.content_html into deduplicated, compressed TemplateBody rows. "
+        "With --prune, also deletes bodies no template references any more."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prune', action='store_true', help="Delete unreferenced bodies")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        pending = Template.objects.filter(body__isnull=True).exclude(content_html='').only('id', 'body', 'content_html')
+        moved = 0
+        inline_bytes = 0
+        for template in pending.iterator():
+            moved += 1
+            inline_bytes += len(template.content_html.encode('utf-8'))
+            if options['dry_run']:
+                continue
+            with transaction.atomic():
+                body = TemplateBody.intern(template.content_html)
+                Template.objects.filter(pk=template.pk, body__isnull=True).update(body=body, content_html='')
+
+        if moved and not options['dry_run']:
+            bump('documents.Template')  # payloads gain content_hash
+
+        verb = "Would move" if options['dry_run'] else "Moved"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {moved} template(s) ({inline_bytes} bytes inline) into content-addressed bodies."))
+
+        if options['prune']:
+            orphans = TemplateBody.objects.filter(templates__isnull=True)
+            count = orphans.count()
+            if not options['dry_run']:
+                orphans.delete()
+            verb = "Would delete" if options['dry_run'] else "Deleted"
+            self.stdout.write(f"{verb} {count} unreferenced bod{'y' if count == 1 else 'ies'}.")
+
+        bodies = TemplateBody.objects.count()
+        templates = Template.objects.filter(body__isnull=False).count()
+        self.stdout.write(f"{templates} template(s) now share {bodies} distinct bod{'y' if bodies == 1 else 'ies'}.")
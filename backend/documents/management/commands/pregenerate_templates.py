@@ -0,0 +1,104 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from documents.generation import generate_template
+from documents.models import DocumentType, Template
+from masters.models import State
+
+
+class RateLimiter:
+    """Spaces call starts evenly so at most `per_minute` begin in any minute."""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(max(0, start - now))
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates missing templates for every DocumentType x enabled State. "
+        "Pairs that already have a Template are skipped, so an interrupted run can simply be restarted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help="Generations in flight at once")
+        parser.add_argument('--rate', type=float, default=30, help="Max generations started per minute (0 = unlimited)")
+        parser.add_argument('--document-type', action='append', dest='document_types', metavar='SLUG', help="Limit to these document type slugs")
+        parser.add_argument('--state', action='append', dest='states', metavar='CODE', help="Limit to these state codes")
+        parser.add_argument('--dry-run', action='store_true', help="Only list the missing pairs")
+
+    def handle(self, *args, **options):
+        doc_types = DocumentType.objects.order_by('name')
+        if options['document_types']:
+            doc_types = doc_types.filter(slug__in=options['document_types'])
+        states = State.objects.filter(is_enabled=True).order_by('name')
+        if options['states']:
+            states = states.filter(code__in=[code.upper() for code in options['states']])
+
+        existing = set(Template.objects.values_list('document_type_id', 'state_key'))
+        pending = [
+            (doc_type, state)
+            for doc_type in doc_types
+            for state in states
+            if (doc_type.id, state.code.upper()) not in existing
+        ]
+        total_pairs = len(doc_types) * len(states)
+        self.stdout.write(f"{total_pairs - len(pending)} of {total_pairs} pairs already have a template; {len(pending)} to generate.")
+
+        if options['dry_run']:
+            for doc_type, state in pending:
+                self.stdout.write(f"  {doc_type.name} / {state.name}")
+            return
+        if not pending:
+            return
+
+        limiter = RateLimiter(options['rate'])
+        created = failed = 0
+        started_at = time.monotonic()
+
+        def run(doc_type, state):
+            limiter.wait()
+            t0 = time.monotonic()
+            try:
+                return generate_template(doc_type, state.name), time.monotonic() - t0, None
+            except Exception as e:
+                return None, time.monotonic() - t0, e
+            finally:
+                close_old_connections()
+
+        executor = ThreadPoolExecutor(max_workers=max(1, options['concurrency']), thread_name_prefix='pregenerate')
+        try:
+            futures = {executor.submit(run, doc_type, state): (doc_type, state) for doc_type, state in pending}
+            for done, future in enumerate(as_completed(futures), start=1):
+                doc_type, state = futures[future]
+                template, elapsed, error = future.result()
+                if template:
+                    created += 1
+                    outcome = self.style.SUCCESS("ok")
+                else:
+                    failed += 1
+                    outcome = self.style.ERROR(f"failed{f': {error}' if error else ''}")
+                self.stdout.write(f"[{done}/{len(pending)}] {doc_type.name} / {state.name}: {outcome} ({elapsed:.1f}s)")
+        except KeyboardInterrupt:
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.stderr.write("Interrupted; re-run to continue with the remaining pairs.")
+            raise
+        executor.shutdown(wait=True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done in {time.monotonic() - started_at:.0f}s: {created} generated, {failed} failed."
+        ))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from documents.pdf import pipeline_from_settings
+
+
+class Command(BaseCommand):
+    help = "Generates PDFs for PAID user documents (PAID -> PROCESSING -> COMPLETED) using a process pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Process what is queued, then exit")
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--workers', type=int, help="Converter processes (default: CPU count)")
+        parser.add_argument('--timeout', type=float, help="Seconds allowed per document")
+        parser.add_argument('--interval', type=float, default=5, help="Seconds to sleep when the queue is empty")
+
+    def handle(self, *args, **options):
+        pipeline = pipeline_from_settings(
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            timeout=options['timeout'],
+        )
+        self.stdout.write(f"PDF pipeline started with {pipeline.workers} worker process(es).")
+        try:
+            while True:
+                claimed = pipeline.run_once()
+                if claimed:
+                    self.stdout.write(f"Batch of {claimed}: {pipeline.completed} completed, {pipeline.failed} failed so far.")
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            pipeline.close()
+            for stage, stats in pipeline.timings.summary().items():
+                self.stdout.write(f"  {stage}: {stats}")
+            self.stdout.write(self.style.SUCCESS(f"Done: {pipeline.completed} completed, {pipeline.failed} failed."))
@@ -1,7 +1,14 @@
-from django.db import models
+import hashlib
+import gzip
+import uuid
+from django.db import IntegrityError, models, transaction
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from simple_history.models import HistoricalRecords
+from masters.utils import normalize_state_key
+from services.caching import LRUCache
+from services.compression import brotli_bytes, gzip_bytes
+from .fields import BodyBackedTextField
 
 class DocumentCategory(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -21,6 +28,60 @@ class DocumentType(models.Model):
     def __str__(self):
         return self.name
 
+# Decoded TemplateBody HTML by hash. Bodies are immutable, so entries never go stale.
+_body_html = LRUCache(maxsize=getattr(settings, 'TEMPLATE_BODY_CACHE_SIZE', 256))
+
+class TemplateBody(models.Model):
+    """
+    Template HTML stored once per distinct content, keyed by its SHA-256.
+    Rows are immutable: the gzip (and, with the brotli package, brotli)
+    encodings are computed on insert and served as-is.
+    """
+    sha256 = models.CharField(max_length=64, primary_key=True, editable=False)
+    size = models.PositiveIntegerField(help_text="Uncompressed size in bytes")
+    gzip_data = models.BinaryField()
+    brotli_data = models.BinaryField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def html(self):
+        html = _body_html.get(self.sha256)
+        if html is None:
+            html = gzip.decompress(bytes(self.gzip_data)).decode('utf-8')
+            _body_html.set(self.sha256, html)
+        return html
+
+    @classmethod
+    def html_for(cls, sha256):
+        html = _body_html.get(sha256)
+        if html is None:
+            html = cls.objects.get(pk=sha256).html
+        return html
+
+    @staticmethod
+    def digest(html):
+        return hashlib.sha256(html.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def intern(cls, html):
+        """The body for this HTML, created on first use."""
+        data = html.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        body = cls.objects.filter(pk=digest).first()
+        if body is None:
+            try:
+                with transaction.atomic():
+                    body = cls.objects.create(
+                        sha256=digest, size=len(data), gzip_data=gzip_bytes(data), brotli_data=brotli_bytes(data)
+                    )
+            except IntegrityError:
+                body = cls.objects.get(pk=digest)  # inserted concurrently
+        _body_html.set(digest, html)
+        return body
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.size} bytes)"
+
 class Template(models.Model):
     class Status(models.TextChoices):
         VERIFIED = 'VERIFIED', _('Verified')
@@ -29,10 +90,14 @@ class Template(models.Model):
 
     document_type = models.ForeignKey(DocumentType, on_delete=models.CASCADE, related_name='templates')
     state = models.CharField(max_length=100, help_text="State Name or 'All India'")
+    # Canonical lookup key derived from `state` on save (masters.State code or slug, e.g. 'BR', 'ALL-INDIA').
+    # Nullable only until `manage.py backfill_template_state_keys` has run on existing rows.
+    state_key = models.CharField(max_length=100, null=True, editable=False)
     
     # The actual legal content with placeholders like {{landlord_name}}
-    # HTML format for easy printing/PDF generation
-    content_html = models.TextField(help_text="HTML content with {{variables}}")
+    # HTML format for easy printing/PDF generation. Stored deduplicated and compressed in `body`.
+    content_html = BodyBackedTextField(help_text="HTML content with {{variables}}")
+    body = models.ForeignKey(TemplateBody, on_delete=models.PROTECT, null=True, blank=True, editable=False, related_name='templates')
     
     # JSON Schema to dynamically render the form on Frontend
     # Structure: [{"key": "landlord_name", "label": "Name", "type": "text", "placeholder": "..."}]
@@ -40,11 +105,60 @@ class Template(models.Model):
     
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING_REVIEW)
     is_active = models.BooleanField(default=True)
+    # Prompt.history id of the GENERATE_DOCUMENT prompt that produced this template (null if hand-written)
+    prompt_version = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    # Saved from a stale cached answer while Gemini was failing; replaced by the next successful generation.
+    needs_regeneration = models.BooleanField(default=False, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ('document_type', 'state')
+        constraints = [
+            models.UniqueConstraint(fields=['document_type', 'state_key'], name='unique_template_state_key'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.state_key = normalize_state_key(self.state)
+        html = self.content_html
+        if not html:
+            self.body = None
+        elif self.body_id != TemplateBody.digest(html):
+            self.body = TemplateBody.intern(html)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'content_html' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'body'}
+        super().save(*args, **kwargs)
+
+    @property
+    def content_hash(self):
+        return self.body_id
+
+    def __str__(self):
+        return f"{self.document_type.name} - {self.state} ({self.status})"
+
+class TemplateGenerationJob(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', _('Pending')
+        RUNNING = 'RUNNING', _('Running')
+        SUCCEEDED = 'SUCCEEDED', _('Succeeded')
+        FAILED = 'FAILED', _('Failed')
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    document_type = models.ForeignKey(DocumentType, on_delete=models.CASCADE, related_name='generation_jobs')
+    state = models.CharField(max_length=100)
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    template = models.ForeignKey(Template, on_delete=models.SET_NULL, null=True, blank=True, related_name='generation_jobs')
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def is_finished(self):
+        return self.status in (self.Status.SUCCEEDED, self.Status.FAILED)
 
     def __str__(self):
         return f"{self.document_type.name} - {self.state} ({self.status})"
@@ -56,6 +170,7 @@ class UserDocument(models.Model):
         PROCESSING = 'PROCESSING', _('Processing')
         COMPLETED = 'COMPLETED', _('Completed')
         DELIVERED = 'DELIVERED', _('Delivered')
+        FAILED = 'FAILED', _('Failed')  # PDF generation gave up after PDF_PIPELINE_MAX_ATTEMPTS
 
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='documents')
     template = models.ForeignKey(Template, on_delete=models.SET_NULL, null=True)
@@ -65,6 +180,11 @@ class UserDocument(models.Model):
     
     generated_file = models.FileField(upload_to='documents/generated/', blank=True, null=True)
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.DRAFT)
+
+    # PDF pipeline bookkeeping (documents/pdf.py)
+    processing_attempts = models.PositiveSmallIntegerField(default=0)
+    processing_started_at = models.DateTimeField(null=True, blank=True)
+    processing_error = models.TextField(blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
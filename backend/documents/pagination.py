@@ -0,0 +1,9 @@
+from rest_framework.pagination import CursorPagination
+
+
+class TemplateCursorPagination(CursorPagination):
+    # Newest first by id: stable under edits, unlike updated_at.
+    ordering = '-id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
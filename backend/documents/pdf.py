@@ -0,0 +1,211 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, BrokenExecutor, ProcessPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.db.models import F
+from django.utils import timezone
+
+from .models import UserDocument
+from .rendering import render_template
+
+PAGE = '<!DOCTYPE html><html><head><meta charset="utf-8"></head><body>{}</body></html>'
+
+
+def html_to_pdf(html):
+    """
+    Converts one rendered document to PDF bytes. Runs inside a pool process,
+    so it must stay a plain module-level function with no DB access.
+    """
+    try:
+        from weasyprint import HTML
+    except ImportError:
+        raise ImproperlyConfigured("PDF generation requires WeasyPrint (pip install weasyprint).")
+    return HTML(string=html).write_pdf()
+
+
+class StageTimings:
+    """Count, total and max seconds per pipeline stage."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        count, total, worst = self.stages.get(stage, (0, 0.0, 0.0))
+        self.stages[stage] = (count + 1, total + seconds, max(worst, seconds))
+
+    def summary(self):
+        return {
+            stage: {'count': count, 'total': round(total, 3), 'avg': round(total / count, 3), 'max': round(worst, 3)}
+            for stage, (count, total, worst) in self.stages.items()
+        }
+
+
+class DocumentPipeline:
+    """
+    Turns PAID UserDocuments into PDFs: claim -> render HTML -> convert in a
+    process pool -> store -> COMPLETED.
+
+    Claims are conditional updates (PAID -> PROCESSING), so several pipeline
+    processes can run side by side. A document left in PROCESSING by a crash is
+    returned to PAID after `stale_after` seconds and retried until it has used
+    `max_attempts`; after that it is FAILED.
+
+    At most `workers` conversions are in flight, so each one starts as soon as
+    it is submitted and `timeout` measures the conversion alone, not time spent
+    queued behind the rest of the batch.
+    """
+
+    def __init__(self, batch_size=20, workers=None, timeout=120, max_attempts=3, stale_after=600,
+                 converter=html_to_pdf, executor=None):
+        self.batch_size = batch_size
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.stale_after = stale_after
+        self.converter = converter
+        self._executor = executor
+        self._owns_executor = executor is None
+        self.timings = StageTimings()
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def close(self):
+        if self._executor is not None and self._owns_executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _recycle_executor(self):
+        # A timed-out conversion keeps its worker busy (or the pool is broken); replace the pool.
+        if not self._owns_executor or self._executor is None:
+            return
+        for process in list(getattr(self._executor, '_processes', {}).values()):
+            process.terminate()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    def requeue_stale(self):
+        cutoff = timezone.now() - timedelta(seconds=self.stale_after)
+        abandoned = UserDocument.objects.filter(status=UserDocument.Status.PROCESSING, processing_started_at__lt=cutoff)
+        abandoned.filter(processing_attempts__gte=self.max_attempts).update(
+            status=UserDocument.Status.FAILED,
+            processing_error="PDF processing was abandoned and no attempts are left."
+        )
+        return abandoned.update(status=UserDocument.Status.PAID)
+
+    def claim_batch(self):
+        started = time.monotonic()
+        candidates = list(
+            UserDocument.objects.filter(status=UserDocument.Status.PAID, processing_attempts__lt=self.max_attempts)
+            .order_by('updated_at')
+            .values_list('pk', flat=True)[:self.batch_size]
+        )
+        claimed = []
+        for pk in candidates:
+            won = UserDocument.objects.filter(pk=pk, status=UserDocument.Status.PAID).update(
+                status=UserDocument.Status.PROCESSING,
+                processing_started_at=timezone.now(),
+                processing_attempts=F('processing_attempts') + 1,
+            )
+            if won:
+                claimed.append(pk)
+        documents = list(UserDocument.objects.select_related('template').filter(pk__in=claimed))
+        self.timings.add('claim', time.monotonic() - started)
+        return documents
+
+    def run_once(self):
+        """Processes one batch. Returns the number of documents claimed."""
+        self.requeue_stale()
+        documents = self.claim_batch()
+        if not documents:
+            return 0
+
+        queue = deque(documents)
+        in_flight = {}  # future -> (document, submitted)
+        recycle = False
+        while queue or in_flight:
+            # A timed-out conversion still occupies its worker, so nothing new is
+            # submitted until the rest have finished and the pool is replaced.
+            while queue and not recycle and len(in_flight) < self.workers:
+                document = queue.popleft()
+                if document.template is None:
+                    self._fail(document, "Document has no template.", final=True)
+                    continue
+                started = time.monotonic()
+                html = PAGE.format(render_template(document.template, document.form_data))
+                self.timings.add('render', time.monotonic() - started)
+                in_flight[self.executor.submit(self.converter, html)] = (document, time.monotonic())
+
+            if not in_flight:
+                if recycle:
+                    self._recycle_executor()
+                    recycle = False
+                    continue
+                break
+
+            first_deadline = min(submitted for _, submitted in in_flight.values()) + self.timeout
+            done, _ = wait(in_flight, timeout=max(0, first_deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            for future in done:
+                document, submitted = in_flight.pop(future)
+                try:
+                    pdf = future.result()
+                except BrokenExecutor as e:
+                    recycle = True  # a worker died (e.g. OOM); the pool cannot be reused
+                    self._fail(document, f"PDF worker crashed: {e}")
+                    continue
+                except Exception as e:
+                    self._fail(document, f"PDF conversion failed: {e}")
+                    continue
+                self.timings.add('convert', time.monotonic() - submitted)
+                self._store(document, pdf)
+
+            now = time.monotonic()
+            for future, (document, submitted) in list(in_flight.items()):
+                if now - submitted >= self.timeout:
+                    del in_flight[future]
+                    future.cancel()
+                    recycle = True
+                    self._fail(document, f"PDF conversion timed out after {self.timeout}s.")
+
+        return len(documents)
+
+    def _store(self, document, pdf):
+        started = time.monotonic()
+        document.generated_file.save(f"{document.pk}.pdf", ContentFile(pdf), save=False)
+        document.status = UserDocument.Status.COMPLETED
+        document.processing_error = ''
+        document.save(update_fields=['generated_file', 'status', 'processing_error', 'updated_at'])
+        self.timings.add('store', time.monotonic() - started)
+        self.completed += 1
+
+    def _fail(self, document, error, final=False):
+        # Back to PAID for a retry while attempts are left (claim_batch counts them); FAILED after that.
+        if final or document.processing_attempts >= self.max_attempts:
+            document.status = UserDocument.Status.FAILED
+        else:
+            document.status = UserDocument.Status.PAID
+        document.processing_error = error
+        document.save(update_fields=['status', 'processing_error', 'updated_at'])
+        self.failed += 1
+
+
+def pipeline_from_settings(**overrides):
+    options = {
+        'batch_size': getattr(settings, 'PDF_PIPELINE_BATCH_SIZE', 20),
+        'workers': getattr(settings, 'PDF_PIPELINE_WORKERS', None),
+        'timeout': getattr(settings, 'PDF_PIPELINE_TIMEOUT', 120),
+        'max_attempts': getattr(settings, 'PDF_PIPELINE_MAX_ATTEMPTS', 3),
+        'stale_after': getattr(settings, 'PDF_PIPELINE_STALE_AFTER', 600),
+    }
+    options.update({key: value for key, value in overrides.items() if value is not None})
+    return DocumentPipeline(**options)
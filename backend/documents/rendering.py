@@ -0,0 +1,93 @@
+import re
+from collections import namedtuple
+from html import escape
+
+from django.conf import settings
+
+from services.caching import LRUCache
+
+PLACEHOLDER = re.compile(r'\{\{\s*([A-Za-z_][\w.-]*)\s*\}\}')
+
+# missing: placeholders with no value in form_data
+# extra: form_data keys that form_schema does not define
+# undeclared: placeholders that form_schema does not define
+KeyReport = namedtuple('KeyReport', ['missing', 'extra', 'undeclared'])
+
+_plans = LRUCache(maxsize=getattr(settings, 'TEMPLATE_RENDER_CACHE_SIZE', 512))
+
+
+def format_value(value):
+    """Escapes a form value for HTML; newlines become <br>."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        value = 'Yes' if value else 'No'
+    elif isinstance(value, (list, tuple)):
+        value = ', '.join(str(v) for v in value)
+    return escape(str(value)).replace('\r\n', '\n').replace('\n', '<br>')
+
+
+class RenderPlan:
+    """
+    A template's content_html split once into static segments and slots.
+    Rendering fills the slots and joins; each distinct key is escaped once.
+    """
+
+    def __init__(self, html):
+        pieces = PLACEHOLDER.split(html)
+        slots = pieces[1::2]
+        self.keys = tuple(dict.fromkeys(slots))
+        index = {key: i for i, key in enumerate(self.keys)}
+        self._buffer = pieces  # statics at even positions; odd positions are overwritten per render
+        self._slots = tuple((pos, index[key]) for pos, key in zip(range(1, len(pieces), 2), slots))
+
+    def render(self, form_data):
+        values = [format_value(form_data.get(key)) for key in self.keys]
+        out = self._buffer[:]
+        for pos, key_index in self._slots:
+            out[pos] = values[key_index]
+        return ''.join(out)
+
+
+def get_plan(template):
+    """Cached RenderPlan for a Template, rebuilt whenever the template is saved."""
+    cache_key = (template.pk, template.updated_at)
+    plan = _plans.get(cache_key)
+    if plan is None:
+        plan = RenderPlan(template.content_html)
+        _plans.set(cache_key, plan)
+    return plan
+
+
+def schema_keys(form_schema):
+    return {field['key'] for field in form_schema or [] if isinstance(field, dict) and field.get('key')}
+
+
+def check_keys(template, form_data):
+    """KeyReport of form_data against the template's placeholders and form_schema."""
+    placeholders = set(get_plan(template).keys)
+    declared = schema_keys(template.form_schema)
+    provided = {key for key, value in form_data.items() if value not in (None, '')}
+    return KeyReport(
+        missing=sorted(placeholders - provided),
+        extra=sorted(set(form_data) - declared),
+        undeclared=sorted(placeholders - declared),
+    )
+
+
+def render_template(template, form_data):
+    return get_plan(template).render(form_data or {})
+
+
+def render_documents(user_documents):
+    """
+    Renders many UserDocuments, e.g. a batch delivery. Returns {document id: html};
+    documents without a template are skipped. Pass a queryset with
+    select_related('template') to keep it to one query.
+    """
+    rendered = {}
+    for document in user_documents:
+        if document.template is None:
+            continue
+        rendered[document.pk] = get_plan(document.template).render(document.form_data or {})
+    return rendered
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import DocumentCategory, DocumentType, Template
+from .models import DocumentCategory, DocumentType, Template, TemplateGenerationJob
 
 class DocumentCategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -13,15 +13,58 @@ class DocumentTypeSerializer(serializers.ModelSerializer):
         model = DocumentType
         fields = ['id', 'name', 'slug', 'description', 'category', 'category_name']
 
-class TemplateSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """Keeps only the fields named in the `fields` kwarg (e.g. from ?fields=id,state)."""
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields:
+            unknown = set(fields) - set(self.fields)
+            if unknown:
+                raise serializers.ValidationError({'fields': f"Unknown field(s): {', '.join(sorted(unknown))}"})
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+class TemplateSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # SHA-256 of content_html; the body is also served compressed at templates/bodies/<hash>/
+    content_hash = serializers.CharField(read_only=True)
+
     class Meta:
         model = Template
-        fields = ['id', 'document_type', 'state', 'content_html', 'form_schema', 'status', 'is_active']
+        fields = ['id', 'document_type', 'state', 'content_html', 'content_hash', 'form_schema', 'status', 'is_active', 'needs_regeneration']
+
+class TemplateListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """List projection without content_html/form_schema; those come from the detail endpoint."""
+    content_hash = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = Template
+        fields = ['id', 'document_type', 'state', 'content_hash', 'status', 'is_active', 'updated_at']
+
+class TemplateGenerationJobSerializer(serializers.ModelSerializer):
+    template = TemplateSerializer(read_only=True)
+
+    class Meta:
+        model = TemplateGenerationJob
+        fields = ['id', 'document_type', 'state', 'status', 'template', 'error', 'created_at', 'updated_at']
 
 from .models import UserDocument
+from .validation import get_validator
 
 class UserDocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserDocument
         fields = '__all__'
 
+    def validate(self, attrs):
+        template = attrs.get('template', getattr(self.instance, 'template', None))
+        if template is not None and ('form_data' in attrs or 'template' in attrs or 'status' in attrs):
+            form_data = attrs.get('form_data', getattr(self.instance, 'form_data', None) or {})
+            status = attrs.get('status', getattr(self.instance, 'status', UserDocument.Status.DRAFT))
+            # Drafts are saved while the user is still typing; required fields are enforced from PAID on.
+            cleaned, errors = get_validator(template).validate(form_data, partial=status == UserDocument.Status.DRAFT)
+            if errors:
+                raise serializers.ValidationError({'form_data': errors})
+            attrs['form_data'] = cleaned
+        return attrs
+
@@ -0,0 +1,58 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from masters.models import State
+from services.prompts import prompt_registry
+from services.versioning import bump
+from .cache import invalidate_template
+from .models import DocumentCategory, DocumentType, Prompt, Template
+from .state_keys import rekey_templates
+
+
+@receiver(pre_save, sender=Template)
+def remember_previous_key(sender, instance, **kwargs):
+    # A save can move the template to another key; the old entry must go too.
+    instance._previous_key = None
+    if instance.pk:
+        instance._previous_key = Template.objects.filter(pk=instance.pk).values_list('document_type_id', 'state_key').first()
+
+
+@receiver(post_save, sender=Template)
+def invalidate_on_save(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_key', None)
+    if previous and previous[1]:
+        invalidate_template(*previous)
+    invalidate_template(instance.document_type_id, instance.state_key)
+    bump('documents.Template')
+
+
+@receiver(post_delete, sender=Template)
+def invalidate_on_delete(sender, instance, **kwargs):
+    invalidate_template(instance.document_type_id, instance.state_key or instance.state)
+    bump('documents.Template')
+
+
+@receiver(post_save, sender=State)
+@receiver(post_delete, sender=State)
+def rekey_on_state_change(sender, **kwargs):
+    # state_key is derived from the State rows; adding or renaming one moves existing templates.
+    updated, conflicts = rekey_templates()
+    for (doc_type_id, key), rows in conflicts.items():
+        print(f"Template state_key conflict for document_type={doc_type_id} state_key={key}: {rows}")
+
+
+@receiver(post_save, sender=DocumentCategory)
+@receiver(post_delete, sender=DocumentCategory)
+@receiver(post_save, sender=DocumentType)
+@receiver(post_delete, sender=DocumentType)
+def bump_catalog_version(sender, **kwargs):
+    bump(sender._meta.label)
+
+
+@receiver(post_save, sender=Prompt)
+@receiver(post_delete, sender=Prompt)
+def reload_prompt(sender, instance, **kwargs):
+    # simple_history reverts go through save(), so they land here too. The bump
+    # makes other processes' registries reload (services.prompts).
+    prompt_registry.invalidate(instance.prompt_type)
+    bump('documents.Prompt')
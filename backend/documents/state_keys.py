@@ -0,0 +1,52 @@
+from collections import defaultdict
+
+from django.db import transaction
+
+from masters.utils import clear_state_codes, normalize_state_key
+from services.versioning import bump
+from .cache import invalidate_template
+from .models import Template
+
+
+def rekey_templates(recompute_all=True, dry_run=False):
+    """
+    Recomputes Template.state_key from the current masters.State rows, e.g.
+    after a State is added or renamed ('Bihar' moves from 'BIHAR' to 'BR').
+    With recompute_all=False only rows without a key are mapped.
+
+    Rows that would collapse onto a key another row of the same document type
+    already has (e.g. 'Bihar' and 'BR') are left alone and reported: those have
+    to be resolved by hand before the unique constraint can hold.
+    Returns (number of rows updated, {(document_type_id, state_key): rows}).
+    """
+    clear_state_codes()
+    templates = Template.objects.only('id', 'document_type_id', 'state', 'state_key')
+    if not recompute_all:
+        templates = templates.filter(state_key__isnull=True)
+
+    planned = {}
+    for template in templates.iterator():
+        key = normalize_state_key(template.state)
+        if key != template.state_key:
+            planned[template.pk] = (template.document_type_id, template.state_key, key)
+
+    taken = defaultdict(list)
+    for doc_type_id, key in Template.objects.exclude(pk__in=planned).exclude(state_key__isnull=True).values_list('document_type_id', 'state_key'):
+        taken[(doc_type_id, key)].append('existing')
+    for pk, (doc_type_id, _, key) in planned.items():
+        taken[(doc_type_id, key)].append(pk)
+    conflicts = {k: v for k, v in taken.items() if len(v) > 1}
+    skipped = {pk for rows in conflicts.values() for pk in rows}
+
+    moves = {pk: plan for pk, plan in planned.items() if pk not in skipped}
+    if moves and not dry_run:
+        with transaction.atomic():
+            # bulk_update bypasses save()/signals, so the cached payloads are dropped below.
+            Template.objects.bulk_update([Template(pk=pk, state_key=key) for pk, (_, _, key) in moves.items()],
+                                         ['state_key'], batch_size=500)
+        for doc_type_id, old_key, key in moves.values():
+            if old_key:
+                invalidate_template(doc_type_id, old_key)
+            invalidate_template(doc_type_id, key)
+        bump('documents.Template')
+    return len(moves), conflicts
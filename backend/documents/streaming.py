@@ -0,0 +1,142 @@
+import json
+
+from asgiref.sync import sync_to_async
+
+from services.gemini import GeminiService
+from .cache import cache_template, template_key
+from .generation import fresh_template, generate_template, save_generated, template_flight
+
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class JsonStringFieldExtractor:
+    """
+    Pulls the value of one top-level string field (e.g. "html_content") out of
+    a JSON document that arrives in arbitrary chunks, returning the newly
+    decoded text after each feed() so it can be forwarded before the document
+    is complete.
+    """
+
+    def __init__(self, field):
+        self._marker = f'"{field}"'
+        self._buffer = ''
+        self._pos = None  # index of the next undecoded char inside the value
+        self.done = False
+
+    def feed(self, text):
+        self._buffer += text
+        if self.done:
+            return ''
+        if self._pos is None:
+            self._pos = self._find_value_start()
+            if self._pos is None:
+                return ''
+        return self._decode()
+
+    def _find_value_start(self):
+        at = self._buffer.find(self._marker)
+        while at != -1:
+            i = at + len(self._marker)
+            while i < len(self._buffer) and self._buffer[i] in ' \t\r\n':
+                i += 1
+            if i < len(self._buffer) and self._buffer[i] == ':':
+                i += 1
+                while i < len(self._buffer) and self._buffer[i] in ' \t\r\n':
+                    i += 1
+                if i < len(self._buffer) and self._buffer[i] == '"':
+                    return i + 1
+                if i >= len(self._buffer):
+                    return None  # value not here yet; keep the marker for the next feed
+            elif i >= len(self._buffer):
+                return None
+            at = self._buffer.find(self._marker, at + 1)
+        return None
+
+    def _decode(self):
+        buf, i, out = self._buffer, self._pos, []
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self.done = True
+                i += 1
+                break
+            if ch != '\\':
+                out.append(ch)
+                i += 1
+                continue
+            if i + 1 >= len(buf):
+                break  # escape split across chunks
+            esc = buf[i + 1]
+            if esc != 'u':
+                out.append(_ESCAPES.get(esc, esc))
+                i += 2
+                continue
+            if i + 6 > len(buf):
+                break
+            code = int(buf[i + 2:i + 6], 16)
+            if 0xD800 <= code < 0xDC00:
+                # Surrogate pair: wait for the low half.
+                if i + 12 > len(buf):
+                    break
+                low = int(buf[i + 8:i + 12], 16)
+                out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                i += 12
+            else:
+                out.append(chr(code))
+                i += 6
+        self._pos = i
+        return ''.join(out)
+
+
+async def stream_generation(doc_type, state):
+    """
+    Generates the template for (doc_type, state) and yields (event, data)
+    pairs: 'chunk' events carry html_content as it is produced, and the final
+    'template' event carries the saved template payload ('error' on failure).
+    If another worker is already generating this key, waits for its result
+    instead of starting a second generation.
+    """
+    key = template_key(doc_type.id, state)
+    token = await sync_to_async(template_flight.acquire)(key)
+    try:
+        if token is None:
+            yield 'status', {'message': 'Generation already in progress'}
+            template = await sync_to_async(generate_template)(doc_type, state)
+            if template:
+                yield 'template', await sync_to_async(cache_template)(template)
+            else:
+                yield 'error', {'error': 'Failed to generate template. Please try again.'}
+            return
+
+        # Another leader may have finished between the caller's lookup and our lease.
+        template = await sync_to_async(fresh_template)(doc_type, state)
+        if template:
+            yield 'template', await sync_to_async(cache_template)(template)
+            return
+
+        service = GeminiService()
+        if not service.api_key:
+            yield 'error', {'error': 'Failed to generate template. Please try again.'}
+            return
+
+        req = await sync_to_async(service.template_request)(doc_type.name, state)
+        extractor = JsonStringFieldExtractor('html_content')
+        parts = []
+        async for text in service.stream_template(req):
+            parts.append(text)
+            html = extractor.feed(text)
+            if html:
+                yield 'chunk', {'html': html}
+
+        generated_data = json.loads(''.join(parts))
+        generated_data['prompt_version'] = req.stale_version if req.stale else req.prompt_version
+        generated_data['stale'] = req.stale
+        template = await sync_to_async(save_generated)(doc_type, state, generated_data)
+        yield 'template', await sync_to_async(cache_template)(template)
+    except Exception as e:
+        # Includes SingleFlightTimeout while following another worker's generation.
+        print(f"Gemini Streaming Error: {e}")
+        yield 'error', {'error': 'Failed to generate template. Please try again.'}
+    finally:
+        if token is not None:
+            await sync_to_async(template_flight.release)(key, token)
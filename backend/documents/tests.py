@@ -1,10 +1,47 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+import time
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.contrib.auth import get_user_model
-from .models import DocumentCategory, DocumentType, Template, Prompt, PromptType
+from .models import DocumentCategory, DocumentType, Template, TemplateBody, TemplateGenerationJob, UserDocument, Prompt, PromptType
 from unittest.mock import patch, MagicMock
+from google.genai import errors as genai_errors, types as genai_types
+from services import gemini_client, metrics, resilience, versioning
+from services.fake_gemini import CANNED_TEMPLATE, FakeGeminiServer
 from services.gemini import GeminiService
+from services.verification import VerificationService
+from services.llm_cache import ResponseCache, make_key
+from services.prompts import prompt_registry
+from services.singleflight import SingleFlight, SingleFlightTimeout
+from services.throttling import TokenBucket
+from .cache import clear_local, get_cached_template
+from .pdf import DocumentPipeline
+from .rendering import check_keys, render_documents, render_template
+from .serializers import UserDocumentSerializer
+from .streaming import JsonStringFieldExtractor
+from .validation import get_validator
+from rest_framework_simplejwt.tokens import RefreshToken
+from .generation import find_template, template_flight
+from masters.models import State
+from masters.utils import clear_state_codes
 
 User = get_user_model()
 
@@ -13,6 +50,7 @@ class DocumentServiceTests(TestCase):
         self.client = APIClient()
         self.user = User.objects.create_user(phone_number='+919876543210')
         self.client.force_authenticate(user=self.user)
+        clear_local()
         
         self.category = DocumentCategory.objects.create(name="Business", slug="business")
         self.doc_type = DocumentType.objects.create(name="Partnership Deed", slug="partnership-deed", category=self.category)
@@ -63,3 +101,1073 @@ class DocumentServiceTests(TestCase):
         
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(response.data['status'], "PENDING_REVIEW")
+
+    @patch('services.gemini.GeminiService.generate_template')
+    def test_stale_answer_is_regenerated_after_recovery(self, mock_generate):
+        """Test that a template saved from a stale answer is served, marked, and replaced once Gemini answers again"""
+        mock_generate.return_value = {"html_content": "<p>old</p>", "form_schema": [], "prompt_version": 2, "stale": True}
+        data = {'document_type_id': self.doc_type.id, 'state': 'Bihar'}
+
+        response = self.client.post('/api/documents/templates/generate/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(response.data['needs_regeneration'])
+        template_id = response.data['id']
+
+        response = self.client.post('/api/documents/templates/generate/', data, format='json')
+        self.assertEqual(response.data['content_html'], "<p>old</p>")
+        self.assertEqual(mock_generate.call_count, 2)
+
+        mock_generate.return_value = {"html_content": "<p>new</p>", "form_schema": [], "prompt_version": 3}
+        response = self.client.post('/api/documents/templates/generate/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['id'], response.data['content_html']), (template_id, "<p>new</p>"))
+        self.assertFalse(response.data['needs_regeneration'])
+        self.assertEqual(Template.objects.get(pk=template_id).prompt_version, 3)
+
+        self.client.post('/api/documents/templates/generate/', data, format='json')
+        self.assertEqual(mock_generate.call_count, 3)
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_concurrent_calls_share_one_execution(self):
+        """Test that concurrent callers for one key trigger a single generation"""
+        flight = SingleFlight('test', cache_alias='default')
+        calls = []
+        started = threading.Event()
+
+        def work():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)
+            return "template"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('1:bihar', work))) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["template"] * 5)
+
+    def test_waits_for_other_process_lease(self):
+        """Test that a lease held elsewhere is honoured and its result picked up via lookup"""
+        flight = SingleFlight('test', cache_alias='default', poll_interval=0.01)
+        caches['default'].add('singleflight:test:1:bihar', 'other-process', 60)
+        found = iter([None, None, "from-db"])
+
+        result = flight.do('1:bihar', lambda: self.fail("should not generate"), lookup=lambda: next(found))
+        self.assertEqual(result, "from-db")
+
+@override_settings(TEMPLATE_JOBS_EAGER=True)
+class TemplateGenerationJobTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(phone_number='+919876543210')
+        self.client.force_authenticate(user=self.user)
+        clear_local()
+
+        category = DocumentCategory.objects.create(name="Business", slug="business")
+        self.doc_type = DocumentType.objects.create(name="Partnership Deed", slug="partnership-deed", category=category)
+
+    @patch('services.gemini.GeminiService.generate_template')
+    def test_async_generation_returns_job(self, mock_generate):
+        """Test that async mode answers 202 and the job endpoint returns the template"""
+        mock_generate.return_value = {"html_content": "<h1>Deed</h1>", "form_schema": []}
+
+        response = self.client.post('/api/documents/templates/generate/', {
+            'document_type_id': self.doc_type.id, 'state': 'Bihar', 'async': True
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertIn('/api/documents/templates/jobs/', response.data['status_url'])
+
+        response = self.client.get(f"/api/documents/templates/jobs/{response.data['id']}/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], TemplateGenerationJob.Status.SUCCEEDED)
+        self.assertEqual(response.data['template']['content_html'], "<h1>Deed</h1>")
+
+    def test_job_status_is_private_and_validates_id(self):
+        """Test that other users get 404 for a job, and malformed ids are 404 rather than 500"""
+        job = TemplateGenerationJob.objects.create(document_type=self.doc_type, state="Bihar", requested_by=self.user)
+        self.assertEqual(self.client.get(f"/api/documents/templates/jobs/{job.pk}/").status_code, status.HTTP_200_OK)
+
+        other = APIClient()
+        other.force_authenticate(user=User.objects.create_user(phone_number='+919876543211'))
+        self.assertEqual(other.get(f"/api/documents/templates/jobs/{job.pk}/").status_code, status.HTTP_404_NOT_FOUND)
+        for job_id in ("abc", "-" * 36, str(job.pk)[:-1]):
+            self.assertEqual(self.client.get(f"/api/documents/templates/jobs/{job_id}/").status_code, status.HTTP_404_NOT_FOUND)
+
+    @patch('services.gemini.GeminiService.generate_template')
+    def test_failed_generation_marks_job_failed(self, mock_generate):
+        """Test that a failed AI call is reported on the job"""
+        mock_generate.return_value = None
+
+        response = self.client.post('/api/documents/templates/generate/?async=1', {
+            'document_type_id': self.doc_type.id, 'state': 'Bihar'
+        }, format='json')
+        job = TemplateGenerationJob.objects.get(pk=response.data['id'])
+        self.assertEqual(job.status, TemplateGenerationJob.Status.FAILED)
+        self.assertIsNone(job.template)
+
+
+class TemplateCacheTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(phone_number='+919876543210')
+        self.client.force_authenticate(user=self.user)
+        clear_local()
+
+        category = DocumentCategory.objects.create(name="Property", slug="property")
+        self.doc_type = DocumentType.objects.create(name="Rent Agreement", slug="rent-agreement", category=category)
+        self.template = Template.objects.create(document_type=self.doc_type, state="Bihar", content_html="<p>v1</p>")
+
+    def fetch(self, state="Bihar"):
+        return self.client.post('/api/documents/templates/generate/', {
+            'document_type_id': self.doc_type.id, 'state': state
+        }, format='json')
+
+    def test_second_fetch_is_served_from_cache(self):
+        """Test that a resolved template is served without touching the DB"""
+        self.fetch()
+        with self.assertNumQueries(0):
+            response = self.fetch(state=" bihar ")
+        self.assertEqual(response.data['content_html'], "<p>v1</p>")
+
+    def test_save_invalidates_cached_payload(self):
+        """Test that editing a template drops the cached payload in both tiers"""
+        self.fetch()
+        self.template.content_html = "<p>v2</p>"
+        self.template.save()
+
+        self.assertIsNone(get_cached_template(self.doc_type.id, "Bihar"))
+        self.assertEqual(self.fetch().data['content_html'], "<p>v2</p>")
+
+    def test_deactivated_template_is_not_served(self):
+        """Test that deactivating a template removes it from the cache"""
+        self.fetch()
+        self.template.is_active = False
+        self.template.save()
+
+        self.assertIsNone(get_cached_template(self.doc_type.id, "Bihar"))
+
+
+class TemplateStateKeyTests(TestCase):
+    def setUp(self):
+        clear_local()
+        clear_state_codes()
+        State.objects.create(name="BIHAR", code="BR")
+        category = DocumentCategory.objects.create(name="Property", slug="property")
+        self.doc_type = DocumentType.objects.create(name="Rent Agreement", slug="rent-agreement", category=category)
+
+    def test_lookup_uses_canonical_key(self):
+        """Test that state spellings resolve to one template through state_key"""
+        template = Template.objects.create(document_type=self.doc_type, state="Bihar", content_html="<p></p>")
+        self.assertEqual(template.state_key, "BR")
+        self.assertEqual(find_template(self.doc_type, "BR"), template)
+        self.assertEqual(find_template(self.doc_type, " bihar"), template)
+
+    def test_backfill_command(self):
+        """Test that the backfill maps legacy free-text rows onto state_key"""
+        template = Template.objects.create(document_type=self.doc_type, state="Bihar", content_html="<p></p>")
+        Template.objects.filter(pk=template.pk).update(state_key=None)
+
+        call_command('backfill_template_state_keys', stdout=StringIO())
+        template.refresh_from_db()
+        self.assertEqual(template.state_key, "BR")
+
+    def test_state_changes_rekey_templates(self):
+        """Test that adding or renaming a State moves existing templates to the new key"""
+        template = Template.objects.create(document_type=self.doc_type, state="Goa", content_html="<p></p>")
+        self.assertEqual(template.state_key, "GOA")
+
+        goa = State.objects.create(name="GOA", code="GA")
+        template.refresh_from_db()
+        self.assertEqual(template.state_key, "GA")
+        self.assertEqual(find_template(self.doc_type, "Goa"), template)
+
+        goa.code = "GO"
+        goa.save()
+        self.assertEqual(find_template(self.doc_type, "goa"), template)
+        self.assertEqual(Template.objects.get(pk=template.pk).state_key, "GO")
+
+
+@override_settings(GEMINI_API_KEY='test-key')
+class GeminiClientTests(SimpleTestCase):
+    def setUp(self):
+        gemini_client.reset_client()
+
+    def tearDown(self):
+        gemini_client.reset_client()
+
+    def test_services_share_one_client(self):
+        """Test that both AI services draw the same pooled client"""
+        self.assertIs(GeminiService().client, VerificationService().client)
+
+    def test_client_rebuilt_in_forked_child(self):
+        """Test that a forked worker does not inherit the parent's connection pool"""
+        parent = gemini_client.get_client()
+        gemini_client._reset_after_fork()
+        self.assertIsNot(gemini_client.get_client(), parent)
+
+    @override_settings(GEMINI_API_KEY=None)
+    def test_no_client_without_key(self):
+        self.assertIsNone(gemini_client.get_client())
+
+
+class PromptRegistryTests(TestCase):
+    def setUp(self):
+        prompt_registry.invalidate()
+        self.prompt = Prompt.objects.create(
+            prompt_type=PromptType.GENERATE_DOCUMENT,
+            description="Test Prompt",
+            system_instruction="Act as Legal Expert",
+            input_format="Draft a {document_type} for {state}.",
+            output_format='Return JSON like {{"html_content": "..."}}'
+        )
+
+    def test_render_matches_construct_prompt(self):
+        """Test that the precompiled prompt renders exactly like Prompt.construct_prompt"""
+        compiled = prompt_registry.get(PromptType.GENERATE_DOCUMENT)
+        self.assertEqual(compiled.fields, ('document_type', 'state'))
+        self.assertEqual(
+            compiled.render(document_type="Rent Agreement", state="Bihar"),
+            self.prompt.construct_prompt(document_type="Rent Agreement", state="Bihar")
+        )
+
+    def test_cached_until_prompt_changes(self):
+        """Test that the registry skips the DB until the prompt is saved again"""
+        first = prompt_registry.get(PromptType.GENERATE_DOCUMENT)
+        with self.assertNumQueries(0):
+            prompt_registry.get(PromptType.GENERATE_DOCUMENT)
+
+        self.prompt.input_format = "Write a {document_type} ({state})."
+        self.prompt.save()
+        second = prompt_registry.get(PromptType.GENERATE_DOCUMENT)
+        self.assertIn("Write a Deed (Goa).", second.render(document_type="Deed", state="Goa"))
+        self.assertGreater(second.version, first.version)
+
+    def test_edit_in_another_process_is_picked_up(self):
+        """Test that a Prompt edit elsewhere (a version bump, no local signal) reloads the prompt"""
+        prompt_registry.get(PromptType.GENERATE_DOCUMENT)
+        Prompt.objects.filter(pk=self.prompt.pk).update(input_format="Write a {document_type}.")
+        self.assertIn("Draft a Deed", prompt_registry.get(PromptType.GENERATE_DOCUMENT).render(document_type="Deed", state="Goa"))
+
+        caches['shared'].set('catalog-version:documents.prompt', 1, None)  # bumped by the other process
+        versioning.clear_local()  # CATALOG_VERSION_LOCAL_TTL elapsed
+        self.assertIn("Write a Deed.", prompt_registry.get(PromptType.GENERATE_DOCUMENT).render(document_type="Deed", state="Goa"))
+
+    @patch('services.gemini.get_client')
+    @override_settings(GEMINI_API_KEY='test-key', LLM_CACHES={})
+    def test_generation_records_prompt_version(self, mock_get_client):
+        """Test that generated output reports the prompt version that produced it"""
+        mock_get_client.return_value.models.generate_content.return_value.text = '{"html_content": "<p></p>", "form_schema": []}'
+
+        result = GeminiService().generate_template("Rent Agreement", "Bihar")
+        self.assertEqual(result['prompt_version'], self.prompt.history.latest().history_id)
+
+
+class ResponseCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'llm.sqlite3')
+
+    def test_roundtrip_and_namespaces(self):
+        """Test that entries are content-addressed and isolated per prompt version"""
+        cache = ResponseCache(self.path)
+        key = make_key('gemini', 'system', 'user', {'temperature': 0.0})
+        self.assertEqual(key, make_key('gemini', 'system', 'user', {'temperature': 0.0}))
+
+        cache.set('GENERATE_DOCUMENT:v1', key, '{"html_content": "<p></p>"}')
+        self.assertEqual(cache.get('GENERATE_DOCUMENT:v1', key), b'{"html_content": "<p></p>"}')
+        self.assertIsNone(cache.get('GENERATE_DOCUMENT:v2', key))
+
+    def test_evicts_least_recently_used(self):
+        """Test that the cache stays under its byte budget"""
+        cache = ResponseCache(self.path, max_bytes=100)
+        cache.set('ns', 'old', 'x' * 40)
+        cache.set('ns', 'recent', 'y' * 40)
+        cache.get('ns', 'old')
+        cache.set('ns', 'new', 'z' * 40)
+
+        self.assertIsNone(cache.get('ns', 'recent'))
+        self.assertIsNotNone(cache.get('ns', 'old'))
+        self.assertLessEqual(cache.stats()['bytes'], 100)
+
+    @patch('services.gemini.prompt_registry.get', return_value=None)
+    @patch('services.gemini.get_client')
+    def test_generation_replayed_from_cache(self, mock_get_client, mock_prompt):
+        """Test that an identical generation request skips the model call"""
+        generate = mock_get_client.return_value.models.generate_content
+        generate.return_value.text = '{"html_content": "<p>cached</p>", "form_schema": []}'
+        llm_caches = {'default': {'PATH': self.path}}
+
+        with override_settings(GEMINI_API_KEY='test-key', LLM_CACHES=llm_caches):
+            first = GeminiService().generate_template("Rent Agreement", "Bihar")
+            second = GeminiService().generate_template("Rent Agreement", "Bihar")
+
+        self.assertEqual(generate.call_count, 1)
+        self.assertEqual(first, second)
+
+
+class PregenerateTemplatesCommandTests(TestCase):
+    def setUp(self):
+        clear_state_codes()
+        category = DocumentCategory.objects.create(name="Property", slug="property")
+        self.doc_type = DocumentType.objects.create(name="Rent Agreement", slug="rent-agreement", category=category)
+        State.objects.create(name="BIHAR", code="BR")
+        State.objects.create(name="GOA", code="GA")
+        State.objects.create(name="KERALA", code="KL", is_enabled=False)
+        Template.objects.create(document_type=self.doc_type, state="Bihar", content_html="<p></p>")
+
+    @patch('documents.management.commands.pregenerate_templates.generate_template')
+    def test_generates_only_missing_enabled_pairs(self, mock_generate):
+        """Test that existing templates and disabled states are skipped"""
+        mock_generate.return_value = MagicMock()
+        out = StringIO()
+
+        call_command('pregenerate_templates', '--rate=0', stdout=out)
+
+        mock_generate.assert_called_once()
+        self.assertEqual(mock_generate.call_args.args[1], "GOA")
+        self.assertIn("1 generated, 0 failed", out.getvalue())
+
+
+class JsonStringFieldExtractorTests(SimpleTestCase):
+    def test_every_split_point(self):
+        """Test that html_content is decoded correctly however the stream is chunked"""
+        html = '<h1 class="t">Deed — \U0001F4DC</h1>\n<p>{{name}}\\</p>'
+        document = json.dumps({"form_schema": [], "html_content": html})
+        for size in (1, 2, 3, 7, len(document)):
+            extractor = JsonStringFieldExtractor('html_content')
+            out = ''.join(extractor.feed(document[i:i + size]) for i in range(0, len(document), size))
+            self.assertEqual(out, html)
+            self.assertTrue(extractor.done)
+
+
+@override_settings(GEMINI_API_KEY='test-key')
+class StreamTemplateTests(TestCase):
+    def setUp(self):
+        clear_local()
+        self.user = User.objects.create_user(phone_number='+919876543210')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        category = DocumentCategory.objects.create(name="Property", slug="property")
+        self.doc_type = DocumentType.objects.create(name="Rent Agreement", slug="rent-agreement", category=category)
+
+    async def post(self, **headers):
+        response = await self.async_client.post(
+            '/api/documents/templates/generate/stream/',
+            {'document_type_id': self.doc_type.id, 'state': 'Bihar'},
+            content_type='application/json', **headers
+        )
+        if not response.streaming:
+            return response, ''
+        return response, ''.join([chunk.decode() async for chunk in response.streaming_content])
+
+    async def test_requires_token(self):
+        response, _ = await self.post()
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @patch('services.gemini.GeminiService.stream_template')
+    async def test_streams_chunks_then_saves_template(self, mock_stream):
+        """Test that html arrives as chunk events and the template is persisted at the end"""
+        async def fake_stream(req):
+            yield '{"html_content": "<h1>Rent'
+            yield ' Deed</h1>", "form_schema": []}'
+        mock_stream.side_effect = fake_stream
+
+        response, body = await self.post(headers={'Authorization': f'Bearer {self.token}'})
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertIn('event: chunk\ndata: {"html": "<h1>Rent"}', body)
+        self.assertIn('event: chunk\ndata: {"html": " Deed</h1>"}', body)
+        self.assertIn('event: template', body)
+        template = await Template.objects.aget(document_type=self.doc_type)
+        self.assertEqual(template.content_html, "<h1>Rent Deed</h1>")
+
+    @patch('documents.streaming.generate_template', side_effect=SingleFlightTimeout("still generating"))
+    async def test_follower_failure_ends_with_error_event(self, mock_generate):
+        """Test that a follower whose wait fails still gets an error event"""
+        with patch('documents.streaming.template_flight.acquire', return_value=None):
+            response, body = await self.post(headers={'Authorization': f'Bearer {self.token}'})
+        self.assertIn('event: status', body)
+        self.assertIn('event: error', body)
+
+    @patch('services.gemini.GeminiService.stream_template')
+    async def test_leader_serves_template_saved_meanwhile(self, mock_stream):
+        """Test that a leader winning the lease just after another one finished does not regenerate"""
+        acquire = template_flight.acquire
+
+        def acquire_after_other_leader(key):
+            Template.objects.create(document_type=self.doc_type, state="Bihar", content_html="<p>theirs</p>")
+            return acquire(key)
+
+        with patch('documents.streaming.template_flight.acquire', side_effect=acquire_after_other_leader):
+            response, body = await self.post(headers={'Authorization': f'Bearer {self.token}'})
+        self.assertIn('event: template', body)
+        self.assertIn('<p>theirs</p>', body)
+        mock_stream.assert_not_called()
+
+
+@override_settings(LLM_CACHES={})
+class FakeGeminiServerTests(TestCase):
+    def setUp(self):
+        prompt_registry.invalidate()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def serve(self, **kwargs):
+        server = FakeGeminiServer(**kwargs)
+        server.start_in_thread()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        gemini_client.reset_client()
+        self.addCleanup(gemini_client.reset_client)
+        return server
+
+    def test_generation_through_fake_endpoint(self):
+        """Test that GeminiService talks to the stand-in through the real SDK"""
+        server = self.serve()
+        with override_settings(GEMINI_API_KEY='test-key', GEMINI_BASE_URL=server.base_url):
+            result = GeminiService().generate_template("Rent Agreement", "Bihar")
+
+        self.assertEqual(result['form_schema'], CANNED_TEMPLATE['form_schema'])
+        self.assertEqual(server.stats['canned'], 1)
+
+    def test_streams_in_separate_event_loops(self):
+        """Test that consecutive streams, each in its own event loop as under WSGI, all succeed"""
+        server = self.serve()
+
+        async def stream(state):
+            service = GeminiService()
+            req = await sync_to_async(service.template_request)("Rent Agreement", state)
+            return ''.join([part async for part in service.stream_template(req)])
+
+        with override_settings(GEMINI_API_KEY='test-key', GEMINI_BASE_URL=server.base_url):
+            for state in ("Bihar", "Goa", "Kerala"):
+                result = json.loads(async_to_sync(stream)(state))
+                self.assertEqual(result['form_schema'], CANNED_TEMPLATE['form_schema'])
+        self.assertEqual(server.stats['canned'], 3)
+
+    def test_records_then_replays_cassette(self):
+        """Test that responses recorded from an upstream are replayed offline"""
+        path = os.path.join(self.tmp.name, 'cassette.jsonl')
+        upstream = self.serve()
+        recorder = self.serve(cassette=path, upstream=upstream.base_url)
+        with override_settings(GEMINI_API_KEY='test-key', GEMINI_BASE_URL=recorder.base_url):
+            recorded = GeminiService().generate_template("Rent Agreement", "Bihar")
+        self.assertEqual(recorder.stats['recorded'], 1)
+
+        replayer = self.serve(cassette=path)
+        with override_settings(GEMINI_API_KEY='test-key', GEMINI_BASE_URL=replayer.base_url):
+            replayed = GeminiService().generate_template("Rent Agreement", "Bihar")
+        self.assertEqual(replayer.stats['replayed'], 1)
+        self.assertEqual(replayed, recorded)
+
+    def test_injected_errors(self):
+        """Test that the configured error rate surfaces as failed generations, after the retries"""
+        server = self.serve(error_rate=1.0)
+        resilience.gemini.reset()
+        self.addCleanup(resilience.gemini.reset)
+        with override_settings(GEMINI_API_KEY='test-key', GEMINI_BASE_URL=server.base_url, LLM_RETRY_BASE_DELAY=0):
+            self.assertIsNone(GeminiService().generate_template("Rent Agreement", "Bihar"))
+        self.assertEqual(server.stats['errors'], 3)
+
+
+class TemplateRenderingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(phone_number='+919876543210')
+        category = DocumentCategory.objects.create(name="Property", slug="property")
+        doc_type = DocumentType.objects.create(name="Rent Agreement", slug="rent-agreement", category=category)
+        self.template = Template.objects.create(
+            document_type=doc_type,
+            state="Bihar",
+            content_html="<p>{{ landlord_name }} lets to {{tenant_name}}.</p><p>Signed: {{landlord_name}}</p>",
+            form_schema=[{"key": "landlord_name", "label": "Landlord", "type": "text"}, {"key": "rent", "label": "Rent", "type": "number"}]
+        )
+
+    def test_render_fills_and_escapes(self):
+        """Test that placeholders are filled, repeated ones included, and values escaped"""
+        html = render_template(self.template, {"landlord_name": "A & B <Ltd>", "tenant_name": "C\nD"})
+        self.assertEqual(html, "<p>A &amp; B &lt;Ltd&gt; lets to C<br>D.</p><p>Signed: A &amp; B &lt;Ltd&gt;</p>")
+
+    def test_check_keys_against_schema(self):
+        """Test that missing, extra and undeclared keys are reported"""
+        report = check_keys(self.template, {"landlord_name": "A", "deposit": "5000"})
+        self.assertEqual(report.missing, ["tenant_name"])
+        self.assertEqual(report.extra, ["deposit"])
+        self.assertEqual(report.undeclared, ["tenant_name"])
+
+    def test_plan_rebuilt_after_template_change(self):
+        """Test that the cached plan follows template edits"""
+        render_template(self.template, {})
+        self.template.content_html = "<p>{{rent}}</p>"
+        self.template.save()
+        self.assertEqual(render_template(self.template, {"rent": 100}), "<p>100</p>")
+
+    def test_bulk_render(self):
+        """Test rendering a batch of user documents in one pass"""
+        docs = [UserDocument.objects.create(user=self.user, template=self.template, form_data={"landlord_name": f"L{i}"}) for i in range(3)]
+        UserDocument.objects.create(user=self.user, template=None)
+
+        with self.assertNumQueries(1):
+            rendered = render_documents(UserDocument.objects.select_related('template'))
+        self.assertEqual(len(rendered), 3)
+        self.assertIn("Signed: L2", rendered[docs[2].pk])
+
+
+class FormValidationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(phone_number='+919876543210')
+        category = DocumentCategory.objects.create(name="Property", slug="property")
+        doc_type = DocumentType.objects.create(name="Rent Agreement", slug="rent-agreement", category=category)
+        self.template = Template.objects.create(
+            document_type=doc_type,
+            state="Bihar",
+            content_html="<p>{{landlord_name}}</p>",
+            form_schema=[
+                {"key": "landlord_name", "label": "Landlord", "type": "text"},
+                {"key": "rent", "label": "Rent", "type": "number", "min": 0},
+                {"key": "start_date", "label": "Start Date", "type": "date"},
+                {"key": "furnished", "label": "Furnished", "type": "checkbox", "required": False},
+                {"key": "term", "label": "Term", "type": "select", "options": ["11 months", "3 years"]},
+            ]
+        )
+
+    def test_values_are_coerced(self):
+        """Test that form values are coerced to their schema types"""
+        cleaned, errors = get_validator(self.template).validate({
+            "landlord_name": " A ", "rent": "12,500", "start_date": "2025-04-01", "furnished": "on", "term": "11 months"
+        })
+        self.assertEqual(errors, {})
+        self.assertEqual(cleaned, {"landlord_name": "A", "rent": 12500, "start_date": "2025-04-01", "furnished": True, "term": "11 months"})
+
+    def test_per_field_errors(self):
+        """Test that bad, missing and unknown fields each get their own error"""
+        _, errors = get_validator(self.template).validate({"rent": "-5", "start_date": "01/04/2025", "term": "forever", "deposit": 1})
+        self.assertEqual(set(errors), {"landlord_name", "rent", "start_date", "term", "deposit"})
+        self.assertEqual(errors["landlord_name"], "Landlord is required.")
+
+    def test_numbers_keep_precision_and_are_bounded(self):
+        """Test that decimals are stored exactly, and oversized numbers are field errors"""
+        validator = get_validator(self.template)
+        self.assertEqual(validator.validate({"rent": "1234.10"}, partial=True), ({"rent": "1234.10"}, {}))
+        self.assertEqual(validator.validate({"rent": "1.5e3"}, partial=True), ({"rent": 1500}, {}))
+        for value in ("1e5000", "1e-5000", "0.00000000001", "1" * 21):
+            self.assertIn("rent", validator.validate({"rent": value}, partial=True)[1], value)
+
+    def test_draft_skips_required(self):
+        """Test that partial validation (drafts) only checks the fields present"""
+        cleaned, errors = get_validator(self.template).validate({"rent": "900"}, partial=True)
+        self.assertEqual((cleaned, errors), ({"rent": 900}, {}))
+
+    def test_validator_cached_until_template_changes(self):
+        """Test that the compiled validator is reused and rebuilt after a save"""
+        validator = get_validator(self.template)
+        self.assertIs(get_validator(self.template), validator)
+        self.template.form_schema = [{"key": "rent", "type": "number"}]
+        self.template.save()
+        self.assertIsNot(get_validator(self.template), validator)
+        self.assertEqual(get_validator(self.template).validate({"rent": "x"})[1], {"rent": "Enter a number."})
+
+    def test_serializer_rejects_invalid_paid_document(self):
+        """Test that UserDocumentSerializer validates form_data against the template"""
+        data = {"user": self.user.pk, "template": self.template.pk, "form_data": {"rent": "abc"}}
+        serializer = UserDocumentSerializer(data=data)
+        self.assertTrue(serializer.is_valid() is False and "rent" in serializer.errors["form_data"])
+
+        draft = UserDocumentSerializer(data={**data, "form_data": {"rent": "1,000"}})
+        self.assertTrue(draft.is_valid(), draft.errors)
+        self.assertEqual(draft.validated_data["form_data"], {"rent": 1000})
+
+        paid = UserDocumentSerializer(data={**data, "form_data": {"rent": "1000"}, "status": UserDocument.Status.PAID})
+        self.assertFalse(paid.is_valid())
+        self.assertIn("landlord_name", paid.errors["form_data"])
+
+    def test_marking_draft_paid_enforces_required(self):
+        """Test that a PATCH of only the status from DRAFT to PAID still checks required fields"""
+        document = UserDocument.objects.create(user=self.user, template=self.template, form_data={"rent": 900})
+        serializer = UserDocumentSerializer(document, data={"status": UserDocument.Status.PAID}, partial=True)
+        self.assertFalse(serializer.is_valid())
+        self.assertIn("landlord_name", serializer.errors["form_data"])
+
+
+class TemplateBodyTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(phone_number='+919876543210')
+        self.client.force_authenticate(user=self.user)
+        category = DocumentCategory.objects.create(name="Property", slug="property")
+        self.doc_type = DocumentType.objects.create(name="Rent Agreement", slug="rent-agreement", category=category)
+        self.html = "<h1>Rent Agreement</h1>" + "<p>{{landlord_name}} lets the premises.</p>" * 50
+
+    def test_identical_html_is_stored_once(self):
+        """Test that templates with the same HTML share one compressed body and keep an empty column"""
+        first = Template.objects.create(document_type=self.doc_type, state="Bihar", content_html=self.html)
+        second = Template.objects.create(document_type=self.doc_type, state="Goa", content_html=self.html)
+
+        self.assertEqual(TemplateBody.objects.count(), 1)
+        self.assertEqual(first.body_id, second.body_id)
+        self.assertLess(len(first.body.gzip_data), len(self.html))
+        self.assertEqual(set(Template.objects.values_list('content_html', flat=True)), {''})
+        self.assertEqual(Template.objects.get(pk=first.pk).content_html, self.html)
+
+    def test_edit_points_at_new_body(self):
+        """Test that changing content_html interns a new body"""
+        template = Template.objects.create(document_type=self.doc_type, state="Bihar", content_html=self.html)
+        old_hash = template.content_hash
+        template = Template.objects.get(pk=template.pk)
+        template.content_html = "<p>{{tenant_name}}</p>"
+        template.save(update_fields=['content_html'])
+
+        template = Template.objects.get(pk=template.pk)
+        self.assertNotEqual(template.content_hash, old_hash)
+        self.assertEqual(template.content_html, "<p>{{tenant_name}}</p>")
+
+    def test_content_can_be_cleared(self):
+        """Test that assigning '' replaces the body instead of reading it back, and loading keeps the link"""
+        template = Template.objects.create(document_type=self.doc_type, state="Bihar", content_html=self.html)
+        deferred = Template.objects.defer('content_html').get(pk=template.pk)
+        self.assertEqual((deferred.content_html, deferred.content_hash), (self.html, template.content_hash))
+
+        template = Template.objects.get(pk=template.pk)
+        template.content_html = ''
+        self.assertEqual(template.content_html, '')
+        template.save()
+        template = Template.objects.get(pk=template.pk)
+        self.assertEqual((template.content_html, template.body_id), ('', None))
+
+    def test_body_endpoint_serves_gzip_with_etag(self):
+        """Test that the body endpoint sends the precompressed gzip variant and honours If-None-Match"""
+        template = Template.objects.create(document_type=self.doc_type, state="Bihar", content_html=self.html)
+        url = f'/api/documents/templates/bodies/{template.content_hash}/'
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content).decode(), self.html)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(url)
+        self.assertEqual(response.content.decode(), self.html)
+        self.assertEqual(response['ETag'], f'"{template.content_hash}"')
+
+    def test_intern_command_moves_inline_html(self):
+        """Test that intern_template_bodies moves inline rows and prunes orphans"""
+        template = Template.objects.create(document_type=self.doc_type, state="Bihar", content_html=self.html)
+        old_body = template.body_id
+        Template.objects.filter(pk=template.pk).update(body=None, content_html="<p>legacy</p>")
+
+        out = StringIO()
+        call_command('intern_template_bodies', '--prune', stdout=out)
+
+        template = Template.objects.get(pk=template.pk)
+        self.assertEqual(template.content_html, "<p>legacy</p>")
+        self.assertIsNotNone(template.body_id)
+        self.assertFalse(TemplateBody.objects.filter(pk=old_body).exists())
+
+
+class TemplateListTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(phone_number='+919876543210')
+        self.client.force_authenticate(user=self.user)
+        category = DocumentCategory.objects.create(name="Property", slug="property")
+        doc_type = DocumentType.objects.create(name="Rent Agreement", slug="rent-agreement", category=category)
+        self.templates = [
+            Template.objects.create(document_type=doc_type, state=state, content_html=f"<p>{state}</p>", form_schema=[{"key": "a"}])
+            for state in ("Bihar", "Goa", "Kerala")
+        ]
+
+    def test_list_is_slim_and_paginated(self):
+        """Test that the list leaves out heavy columns and pages with a cursor"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/documents/templates/?page_size=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([t['state'] for t in response.data['results']], ["Kerala", "Goa"])
+        self.assertNotIn('content_html', response.data['results'][0])
+        self.assertEqual(response.data['results'][0]['content_hash'], self.templates[2].content_hash)
+        self.assertFalse(any('form_schema' in q['sql'] for q in queries.captured_queries))
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([t['state'] for t in response.data['results']], ["Bihar"])
+        self.assertIsNone(response.data['next'])
+
+    def test_sparse_fieldset(self):
+        """Test that ?fields= narrows the list and detail payloads"""
+        response = self.client.get('/api/documents/templates/?fields=id,state')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'state'})
+
+        response = self.client.get(f'/api/documents/templates/{self.templates[0].pk}/?fields=content_html')
+        self.assertEqual(response.data, {'content_html': "<p>Bihar</p>"})
+
+        response = self.client.get('/api/documents/templates/?fields=content_html')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(GEMINI_API_KEY='test-key', LLM_CALL_LOG=False)
+@patch('services.gemini.prompt_registry.get', return_value=None)
+@patch('services.gemini.get_client')
+class LLMMetricsTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.metrics_dir = os.path.join(self.tmp.name, 'metrics')
+        # A long interval keeps the background publisher out of the way; scrapes write this process's file.
+        self.enterContext(override_settings(LLM_METRICS_DIR=self.metrics_dir, LLM_METRICS_PUBLISH_INTERVAL=60))
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.llm_caches = {'default': {'PATH': os.path.join(self.tmp.name, 'llm.sqlite3')}}
+        self.labels = {'prompt_type': 'GENERATE_DOCUMENT', 'prompt_version': 'none', 'model': 'gemini-2.0-flash'}
+
+    def test_model_call_and_cache_hit_recorded(self, mock_get_client, mock_prompt):
+        """Test that a generation records latency, tokens and outcome, and the replay a cache hit"""
+        response = mock_get_client.return_value.models.generate_content.return_value
+        response.text = '{"html_content": "<p></p>", "form_schema": []}'
+        response.usage_metadata = genai_types.GenerateContentResponseUsageMetadata(prompt_token_count=120, candidates_token_count=30)
+
+        with override_settings(LLM_CACHES=self.llm_caches, GEMINI_MODEL='gemini-2.0-flash'):
+            GeminiService().generate_template("Rent Agreement", "Bihar")
+            GeminiService().generate_template("Rent Agreement", "Bihar")
+
+        self.assertEqual(metrics.llm_requests.value(outcome='ok', **self.labels), 1)
+        self.assertEqual(metrics.llm_requests.value(outcome='cache_hit', **self.labels), 1)
+        self.assertEqual(metrics.llm_duration.count(outcome='ok', **self.labels), 1)
+        self.assertEqual(metrics.llm_tokens.value(direction='input', **self.labels), 120)
+        self.assertEqual(metrics.llm_tokens.value(direction='output', **self.labels), 30)
+
+    def test_errors_counted_by_type(self, mock_get_client, mock_prompt):
+        """Test that failed calls are counted per exception type"""
+        mock_get_client.return_value.models.generate_content.side_effect = ValueError("bad request")
+        with override_settings(LLM_CACHES={}, GEMINI_MODEL='gemini-2.0-flash'):
+            self.assertIsNone(GeminiService().generate_template("Rent Agreement", "Bihar"))
+        self.assertEqual(metrics.llm_errors.value(error='ValueError', **self.labels), 1)
+        self.assertEqual(metrics.llm_requests.value(outcome='error', **self.labels), 1)
+
+    def test_endpoint_is_staff_only(self, mock_get_client, mock_prompt):
+        """Test that /api/metrics/ serves the Prometheus text format to staff only"""
+        metrics.llm_duration.observe(0.3, outcome='ok', **self.labels)
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create_user(phone_number='+919876543210'))
+        self.assertEqual(client.get('/api/metrics/').status_code, status.HTTP_403_FORBIDDEN)
+
+        client.force_authenticate(user=User.objects.create_user(phone_number='+919876543211', is_staff=True))
+        response = client.get('/api/metrics/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn('# TYPE llm_request_duration_seconds histogram', body)
+        self.assertIn('llm_request_duration_seconds_bucket{prompt_type="GENERATE_DOCUMENT",prompt_version="none",'
+                      'model="gemini-2.0-flash",outcome="ok",le="0.5"} 1', body)
+
+    def test_scrape_sums_every_process(self, mock_get_client, mock_prompt):
+        """Test that any worker's scrape includes the values other worker processes wrote"""
+        key = ['GENERATE_DOCUMENT', 'none', 'gemini-2.0-flash', 'ok']
+        other = {
+            'llm_requests_total': [[key, 2]],
+            'llm_request_duration_seconds': [[key, [0, 0, 0, 1, 0, 1] + [0] * 7 + [3.5]]],
+        }
+        os.makedirs(self.metrics_dir)
+        with open(os.path.join(self.metrics_dir, 'other-worker.json'), 'w') as f:
+            json.dump(other, f)
+
+        metrics.record_event('GENERATE_DOCUMENT', None, 'gemini-2.0-flash', 'ok')
+        metrics.llm_duration.observe(0.3, outcome='ok', **self.labels)
+        self.assertEqual(os.listdir(self.metrics_dir), ['other-worker.json'])  # recording does not write
+
+        body = metrics.expose()
+        labels = 'prompt_type="GENERATE_DOCUMENT",prompt_version="none",model="gemini-2.0-flash",outcome="ok"'
+        self.assertIn(f'llm_requests_total{{{labels}}} 3', body)
+        self.assertIn(f'llm_request_duration_seconds_bucket{{{labels},le="0.5"}} 2', body)
+        self.assertIn(f'llm_request_duration_seconds_count{{{labels}}} 3', body)
+        self.assertIn(f'llm_request_duration_seconds_sum{{{labels}}} 3.8', body)
+        self.assertEqual(len(os.listdir(self.metrics_dir)), 2)
+
+    def test_exited_processes_are_folded(self, mock_get_client, mock_prompt):
+        """Test that files of exited workers are merged into one, without changing the totals"""
+        exited = subprocess.Popen([sys.executable, '-c', ''])
+        exited.wait()
+        key = ['GENERATE_DOCUMENT', 'none', 'gemini-2.0-flash', 'ok']
+        os.makedirs(self.metrics_dir)
+        for tag in ('aaaaaaaa', 'bbbbbbbb'):
+            with open(os.path.join(self.metrics_dir, f"{socket.gethostname()}-{exited.pid}-{tag}.json"), 'w') as f:
+                json.dump({'llm_requests_total': [[key, 2]]}, f)
+        metrics.record_event('GENERATE_DOCUMENT', None, 'gemini-2.0-flash', 'ok')
+
+        line = ('llm_requests_total{prompt_type="GENERATE_DOCUMENT",prompt_version="none",'
+                'model="gemini-2.0-flash",outcome="ok"} 5')
+        self.assertIn(line, metrics.expose())
+        self.assertEqual(sorted(os.listdir(self.metrics_dir)), sorted([metrics.EXITED_FILE, f"{metrics._process_id}.json"]))
+        self.assertIn(line, metrics.expose())
+
+
+@override_settings(
+    AI_THROTTLE_BUCKETS={'ai_user': {'capacity': 20, 'refill_per_minute': 1}, 'ai_global': {'capacity': 30, 'refill_per_minute': 1}},
+    AI_THROTTLE_COSTS={'cached': 0, 'fetch': 1, 'generate': 20},
+)
+class AIThrottleTests(TestCase):
+    def setUp(self):
+        clear_local()
+        self.client = APIClient()
+        self.user = User.objects.create_user(phone_number='+919876543210')
+        self.client.force_authenticate(user=self.user)
+        category = DocumentCategory.objects.create(name="Property", slug="property")
+        self.doc_type = DocumentType.objects.create(name="Rent Agreement", slug="rent-agreement", category=category)
+        Template.objects.create(document_type=self.doc_type, state="Goa", content_html="<p></p>")
+
+    def generate(self, state):
+        return self.client.post('/api/documents/templates/generate/', {'document_type_id': self.doc_type.id, 'state': state}, format='json')
+
+    def test_bucket_refills_over_time(self):
+        """Test that a drained bucket reports the wait and admits again once refilled"""
+        bucket = TokenBucket('test', capacity=10, refill_rate=1)
+        now = time.time()
+        with patch('services.throttling.time.time', return_value=now):
+            self.assertEqual(bucket.consume('k', 10), 0)
+            self.assertAlmostEqual(bucket.consume('k', 4), 4.0)
+        with patch('services.throttling.time.time', return_value=now + 4):
+            self.assertEqual(bucket.consume('k', 4), 0)
+
+    def test_cost_above_capacity_is_refused(self):
+        """Test that a request costing more than the bucket holds is refused, not charged a full bucket"""
+        bucket = TokenBucket('test', capacity=10, refill_rate=1)
+        self.assertGreater(bucket.consume('k', 11), 0)
+        self.assertEqual(bucket.consume('k', 10), 0)
+
+    @patch('documents.views.generate_template', return_value=None)
+    def test_refused_by_global_bucket_keeps_user_tokens(self, mock_generate):
+        """Test that a request the global bucket refuses is not charged to the user's bucket"""
+        self.assertEqual(TokenBucket.from_settings('ai_global').consume('all', 30), 0)
+        self.assertEqual(self.generate("Bihar").status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(TokenBucket.from_settings('ai_user').check(f"user:{self.user.pk}", 20), 0)
+        mock_generate.assert_not_called()
+
+    @patch('documents.views.generate_template', return_value=None)
+    def test_generation_costs_more_than_fetch(self, mock_generate):
+        """Test that one generation spends the user's bucket while stored templates stay reachable"""
+        self.assertEqual(self.generate("Bihar").status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        response = self.generate("Kerala")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(mock_generate.call_count, 1)
+
+        with override_settings(AI_THROTTLE_COSTS={'cached': 0, 'fetch': 0, 'generate': 20}):
+            self.assertEqual(self.generate("Goa").status_code, status.HTTP_200_OK)
+
+    @patch('documents.views.generate_template', return_value=None)
+    def test_global_bucket_shared_by_users(self, mock_generate):
+        """Test that the global bucket limits everyone, and refused requests do not drain it"""
+        self.generate("Bihar")
+        for _ in range(3):
+            self.generate("Kerala")  # refused by the user bucket; the global one is not charged
+        other = APIClient()
+        other.force_authenticate(user=User.objects.create_user(phone_number='+919876543211'))
+        response = other.post('/api/documents/templates/generate/', {'document_type_id': self.doc_type.id, 'state': "Assam"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(TokenBucket.from_settings('ai_global').consume('all', 10), 0)
+
+
+def server_error():
+    return genai_errors.ServerError(503, {'error': {'code': 503, 'message': 'down', 'status': 'UNAVAILABLE'}})
+
+
+@override_settings(GEMINI_API_KEY='test-key', LLM_CALL_LOG=False, LLM_RETRY_BASE_DELAY=0, LLM_BREAKER_FAILURES=2)
+@patch('services.gemini.prompt_registry.get', return_value=None)
+@patch('services.gemini.get_client')
+class ResilienceTests(SimpleTestCase):
+    def setUp(self):
+        resilience.gemini.reset()
+        self.addCleanup(resilience.gemini.reset)
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.llm_caches = {'default': {'PATH': os.path.join(self.tmp.name, 'llm.sqlite3')}}
+
+    def generate(self):
+        with override_settings(LLM_CACHES=self.llm_caches):
+            return GeminiService().generate_template("Rent Agreement", "Bihar")
+
+    def test_transient_errors_retried_with_deadline(self, mock_get_client, mock_prompt):
+        """Test that a 503 is retried and every attempt carries a timeout within the call deadline"""
+        generate = mock_get_client.return_value.models.generate_content
+        ok = MagicMock(text='{"html_content": "<p></p>", "form_schema": []}')
+        generate.side_effect = [server_error(), ok]
+
+        with override_settings(GEMINI_TIMEOUT=60, LLM_CALL_DEADLINE=10):
+            self.assertEqual(self.generate()['html_content'], "<p></p>")
+        self.assertEqual(generate.call_count, 2)
+        timeout = generate.call_args.kwargs['config'].http_options.timeout
+        self.assertTrue(0 < timeout <= 10_000)
+        self.assertEqual(metrics.llm_retries.value(prompt_type='GENERATE_DOCUMENT', prompt_version='none', model='gemini-2.0-flash'), 1)
+
+    def test_client_errors_not_retried(self, mock_get_client, mock_prompt):
+        """Test that a non-transient failure is raised at once and does not trip the breaker"""
+        generate = mock_get_client.return_value.models.generate_content
+        generate.side_effect = genai_errors.ClientError(400, {'error': {'code': 400, 'message': 'bad', 'status': 'INVALID_ARGUMENT'}})
+        for _ in range(3):
+            self.assertIsNone(self.generate())
+        self.assertEqual(generate.call_count, 3)
+        self.assertEqual(resilience.gemini.breaker.state, 'closed')
+
+    def test_open_circuit_fails_fast_and_serves_stale(self, mock_get_client, mock_prompt):
+        """Test that repeated upstream failures open the circuit, and a cached older answer is served meanwhile"""
+        generate = mock_get_client.return_value.models.generate_content
+        generate.side_effect = server_error()
+        cache = ResponseCache(self.llm_caches['default']['PATH'])
+        cache.set('GENERATE_DOCUMENT:v3', 'old-key', '{"html_content": "<p>old</p>", "form_schema": []}',
+                  subject="Rent Agreement:Bihar")
+
+        with override_settings(LLM_RETRY_ATTEMPTS=1):
+            first = self.generate()
+            self.generate()
+        self.assertEqual(first['prompt_version'], 3)
+        self.assertTrue(first['stale'])
+        self.assertEqual(resilience.gemini.breaker.state, 'open')
+
+        generate.reset_mock()
+        self.assertEqual(self.generate()['html_content'], "<p>old</p>")
+        generate.assert_not_called()
+
+        with override_settings(LLM_SERVE_STALE=False):
+            self.assertIsNone(self.generate())
+
+    def test_half_open_probe_closes_circuit(self, mock_get_client, mock_prompt):
+        """Test that after the reset period one successful probe closes the circuit"""
+        generate = mock_get_client.return_value.models.generate_content
+        generate.side_effect = server_error()
+        with override_settings(LLM_RETRY_ATTEMPTS=1, LLM_BREAKER_RESET=0):
+            self.generate()
+            self.generate()
+            self.assertEqual(resilience.gemini.breaker.state, 'half_open')
+            generate.side_effect = None
+            generate.return_value.text = '{"html_content": "<p></p>", "form_schema": []}'
+            self.assertFalse(self.generate().get('stale'))
+        self.assertEqual(resilience.gemini.breaker.state, 'closed')
+
+    def test_bulkhead_rejects_when_saturated(self, mock_get_client, mock_prompt):
+        """Test that calls beyond LLM_MAX_CONCURRENCY fail fast instead of queueing"""
+        with override_settings(LLM_MAX_CONCURRENCY=1, LLM_BULKHEAD_WAIT=0):
+            resilience.gemini.reset()
+            resilience.gemini.bulkhead.acquire(0)
+            self.addCleanup(resilience.gemini.bulkhead.release)
+            with self.assertRaises(resilience.BulkheadFull):
+                resilience.gemini.call(lambda timeout: None)
+            self.assertIsNone(self.generate())
+        mock_get_client.return_value.models.generate_content.assert_not_called()
+
+    def test_cancelled_async_call_releases_slot_and_probe(self, mock_get_client, mock_prompt):
+        """Test that a cancelled acall frees its bulkhead slot, and a cancelled half-open probe lets the next call probe"""
+        async def hang(timeout):
+            await asyncio.sleep(10)
+
+        async def cancelled_call():
+            task = asyncio.ensure_future(resilience.gemini.acall(hang))
+            await asyncio.sleep(0)  # the call holds the slot and is waiting on the model
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with override_settings(LLM_MAX_CONCURRENCY=1, LLM_BULKHEAD_WAIT=0, LLM_BREAKER_RESET=0):
+            resilience.gemini.reset()
+            for _ in range(3):
+                asyncio.run(cancelled_call())
+            self.assertEqual(resilience.gemini.call(lambda timeout: 'ok'), 'ok')
+
+            resilience.gemini.breaker.opened_at = time.monotonic()
+            self.assertEqual(resilience.gemini.breaker.state, 'half_open')
+            asyncio.run(cancelled_call())
+            self.assertEqual(resilience.gemini.call(lambda timeout: 'ok'), 'ok')
+        self.assertEqual(resilience.gemini.breaker.state, 'closed')
+
+
+def fake_pdf(html):
+    return b"%PDF-" + html.encode()
+
+
+def broken_pdf(html):
+    raise ValueError("bad markup")
+
+
+class DocumentPipelineTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        user = User.objects.create_user(phone_number='+919876543210')
+        category = DocumentCategory.objects.create(name="Property", slug="property")
+        doc_type = DocumentType.objects.create(name="Rent Agreement", slug="rent-agreement", category=category)
+        template = Template.objects.create(document_type=doc_type, state="Bihar", content_html="<p>{{name}}</p>")
+        self.paid = UserDocument.objects.create(user=user, template=template, form_data={"name": "Asha"}, status=UserDocument.Status.PAID)
+        self.draft = UserDocument.objects.create(user=user, template=template, status=UserDocument.Status.DRAFT)
+
+    def test_paid_documents_become_completed_pdfs(self):
+        """Test the full claim -> render -> convert (process pool) -> store path"""
+        pipeline = DocumentPipeline(workers=2, converter=fake_pdf)
+        self.addCleanup(pipeline.close)
+
+        self.assertEqual(pipeline.run_once(), 1)
+        self.paid.refresh_from_db()
+        self.assertEqual(self.paid.status, UserDocument.Status.COMPLETED)
+        self.assertIn(b"<p>Asha</p>", self.paid.generated_file.read())
+        self.assertEqual(UserDocument.objects.get(pk=self.draft.pk).status, UserDocument.Status.DRAFT)
+        self.assertEqual(set(pipeline.timings.summary()), {'claim', 'render', 'convert', 'store'})
+
+    def test_failures_are_retried_until_attempts_run_out(self):
+        """Test that a failing document goes back to PAID, and is FAILED once max_attempts are used"""
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pipeline = DocumentPipeline(converter=broken_pdf, executor=executor, max_attempts=2)
+            self.assertEqual(pipeline.run_once(), 1)
+            self.assertEqual(UserDocument.objects.get(pk=self.paid.pk).status, UserDocument.Status.PAID)
+            self.assertEqual(pipeline.run_once(), 1)
+            self.assertEqual(pipeline.run_once(), 0)
+
+        self.paid.refresh_from_db()
+        self.assertEqual(self.paid.status, UserDocument.Status.FAILED)
+        self.assertEqual(self.paid.processing_attempts, 2)
+        self.assertIn("bad markup", self.paid.processing_error)
+
+    def test_timeout_counts_conversion_not_queueing(self):
+        """Test that documents queued behind a full pool are not timed out for the wait"""
+        for _ in range(2):
+            UserDocument.objects.create(user=self.paid.user, template=self.paid.template, form_data={"name": "Ravi"},
+                                        status=UserDocument.Status.PAID)
+
+        def slow_pdf(html):
+            time.sleep(0.2)
+            return fake_pdf(html)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pipeline = DocumentPipeline(workers=1, timeout=0.35, converter=slow_pdf, executor=executor)
+            self.assertEqual(pipeline.run_once(), 3)
+        self.assertEqual((pipeline.completed, pipeline.failed), (3, 0))
+
+    def test_abandoned_processing_is_requeued(self):
+        """Test that a document stuck in PROCESSING after a crash is picked up again"""
+        UserDocument.objects.filter(pk=self.paid.pk).update(
+            status=UserDocument.Status.PROCESSING,
+            processing_started_at=timezone.now() - timedelta(hours=1),
+            processing_attempts=1
+        )
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            DocumentPipeline(converter=fake_pdf, executor=executor).run_once()
+
+        self.paid.refresh_from_db()
+        self.assertEqual(self.paid.status, UserDocument.Status.COMPLETED)
+        self.assertEqual(self.paid.processing_attempts, 2)
+
+        UserDocument.objects.filter(pk=self.paid.pk).update(
+            status=UserDocument.Status.PROCESSING,
+            processing_started_at=timezone.now() - timedelta(hours=1),
+            processing_attempts=3
+        )
+        DocumentPipeline(converter=fake_pdf, max_attempts=3).requeue_stale()
+        self.assertEqual(UserDocument.objects.get(pk=self.paid.pk).status, UserDocument.Status.FAILED)
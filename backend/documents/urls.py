@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import DocumentCategoryViewSet, DocumentTypeViewSet, TemplateViewSet
+from .views import DocumentCategoryViewSet, DocumentTypeViewSet, TemplateViewSet, stream_template
 
 router = DefaultRouter()
 router.register(r'categories', DocumentCategoryViewSet)
@@ -8,5 +8,6 @@ router.register(r'types', DocumentTypeViewSet)
 router.register(r'templates', TemplateViewSet)
 
 urlpatterns = [
+    path('templates/generate/stream/', stream_template, name='template-generate-stream'),
     path('', include(router.urls)),
 ]
@@ -0,0 +1,169 @@
+import re
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+
+from services.caching import LRUCache
+
+_validators = LRUCache(maxsize=getattr(settings, 'FORM_VALIDATOR_CACHE_SIZE', 512))
+
+PHONE = re.compile(r'^\+?[\d\s-]{7,20}$')
+TRUE_VALUES = {'true', '1', 'yes', 'on'}
+FALSE_VALUES = {'false', '0', 'no', 'off', ''}
+# Bounds for number/currency fields, so '1e5000' is a field error and not an unserialisable value
+MAX_INTEGER_DIGITS = 20
+MAX_DECIMAL_PLACES = 10
+
+
+class FieldValueError(ValueError):
+    pass
+
+
+def coerce_text(value, field):
+    if isinstance(value, (dict, list)):
+        raise FieldValueError("Enter text.")
+    value = str(value).strip()
+    max_length = field.get('max_length') or field.get('maxLength')
+    if max_length and len(value) > int(max_length):
+        raise FieldValueError(f"Ensure this value has at most {max_length} characters.")
+    return value
+
+
+def coerce_number(value, field):
+    if isinstance(value, bool):
+        raise FieldValueError("Enter a number.")
+    try:
+        number = Decimal(str(value).replace(',', '').strip())
+    except InvalidOperation:
+        raise FieldValueError("Enter a number.")
+    if not number.is_finite():
+        raise FieldValueError("Enter a number.")
+    if number and number.adjusted() >= MAX_INTEGER_DIGITS:
+        raise FieldValueError(f"Ensure there are no more than {MAX_INTEGER_DIGITS} digits before the decimal point.")
+    if -number.as_tuple().exponent > MAX_DECIMAL_PLACES:
+        raise FieldValueError(f"Ensure there are no more than {MAX_DECIMAL_PLACES} decimal places.")
+    if field.get('min') is not None and number < Decimal(str(field['min'])):
+        raise FieldValueError(f"Ensure this value is at least {field['min']}.")
+    if field.get('max') is not None and number > Decimal(str(field['max'])):
+        raise FieldValueError(f"Ensure this value is at most {field['max']}.")
+    # Whole numbers as int; others as their exact decimal string (a float would turn '1234.10' into 1234.1)
+    return int(number) if number == number.to_integral_value() else format(number, 'f')
+
+
+def coerce_date(value, field):
+    try:
+        return date.fromisoformat(str(value).strip()[:10]).isoformat()
+    except ValueError:
+        raise FieldValueError("Enter a valid date (YYYY-MM-DD).")
+
+
+def coerce_email(value, field):
+    value = str(value).strip()
+    try:
+        validate_email(value)
+    except ValidationError:
+        raise FieldValueError("Enter a valid email address.")
+    return value
+
+
+def coerce_phone(value, field):
+    value = str(value).strip()
+    if not PHONE.match(value):
+        raise FieldValueError("Enter a valid phone number.")
+    return value
+
+
+def coerce_boolean(value, field):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise FieldValueError("Enter yes or no.")
+
+
+COERCERS = {
+    'text': coerce_text,
+    'textarea': coerce_text,
+    'number': coerce_number,
+    'currency': coerce_number,
+    'date': coerce_date,
+    'email': coerce_email,
+    'tel': coerce_phone,
+    'phone': coerce_phone,
+    'checkbox': coerce_boolean,
+    'boolean': coerce_boolean,
+}
+
+
+def _option_values(options):
+    return {str(o.get('value', o.get('label')) if isinstance(o, dict) else o) for o in options or []}
+
+
+class CompiledField:
+    __slots__ = ('key', 'label', 'required', 'coerce', 'field', 'choices')
+
+    def __init__(self, field):
+        self.key = field['key']
+        self.label = field.get('label') or self.key
+        self.required = field.get('required', True) is not False
+        self.field = field
+        kind = str(field.get('type') or 'text').lower()
+        self.choices = _option_values(field.get('options') or field.get('choices')) if kind in ('select', 'radio') else None
+        self.coerce = COERCERS.get(kind, coerce_text)
+
+
+class FormValidator:
+    """
+    A Template.form_schema compiled into per-field coercers. validate() returns
+    (cleaned_data, errors): values are coerced to their field type and errors
+    map field keys (or '__all__') to a message.
+    """
+
+    def __init__(self, form_schema):
+        self.fields = tuple(
+            CompiledField(field) for field in form_schema or []
+            if isinstance(field, dict) and field.get('key')
+        )
+        self._keys = frozenset(f.key for f in self.fields)
+
+    def validate(self, data, partial=False):
+        """`partial` (drafts/autosave) skips required checks for absent or empty fields."""
+        if not isinstance(data, dict):
+            return {}, {'__all__': "Expected an object of field values."}
+
+        cleaned, errors = {}, {}
+        for field in self.fields:
+            value = data.get(field.key)
+            if value is None or (isinstance(value, str) and not value.strip()):
+                if field.required and not partial:
+                    errors[field.key] = f"{field.label} is required."
+                continue
+            try:
+                if field.choices is not None:
+                    if str(value) not in field.choices:
+                        raise FieldValueError("Select a valid choice.")
+                    cleaned[field.key] = str(value)
+                else:
+                    cleaned[field.key] = field.coerce(value, field.field)
+            except FieldValueError as e:
+                errors[field.key] = str(e)
+
+        for key in data.keys() - self._keys:
+            errors[key] = "Unknown field."
+        return cleaned, errors
+
+
+def get_validator(template):
+    """Cached FormValidator for a Template; a saved template gets a fresh one."""
+    cache_key = (template.pk, template.updated_at)
+    validator = _validators.get(cache_key)
+    if validator is None:
+        validator = FormValidator(template.form_schema)
+        _validators.set(cache_key, validator)
+    return validator
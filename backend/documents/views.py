@@ -1,27 +1,91 @@
+import json
+import math
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import viewsets, status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from .models import DocumentCategory, DocumentType, Template, UserDocument
-from .serializers import DocumentCategorySerializer, DocumentTypeSerializer, TemplateSerializer, UserDocumentSerializer
-from services.gemini import GeminiService
+from rest_framework.renderers import StaticHTMLRenderer
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from .models import DocumentCategory, DocumentType, Template, TemplateBody, TemplateGenerationJob, UserDocument
+from .serializers import DocumentCategorySerializer, DocumentTypeSerializer, TemplateSerializer, TemplateListSerializer, TemplateGenerationJobSerializer, UserDocumentSerializer
+from .jobs import enqueue_generation, expire_if_stale
+from .cache import cache_template, get_cached_template
+from services.compression import pick_encoding
+from services.singleflight import SingleFlightTimeout
+from services.throttling import AI_THROTTLES, check_ai_throttles, throttle_cost
+from services.versioning import ConditionalGetMixin
+from .generation import find_template, generate_template, template_exists
+from .pagination import TemplateCursorPagination
+from .streaming import stream_generation
 
-class DocumentCategoryViewSet(viewsets.ReadOnlyModelViewSet):
+class DocumentCategoryViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = DocumentCategory.objects.all()
     serializer_class = DocumentCategorySerializer
+    version_models = ('documents.DocumentCategory',)
 
-class DocumentTypeViewSet(viewsets.ReadOnlyModelViewSet):
+class DocumentTypeViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = DocumentType.objects.all()
     serializer_class = DocumentTypeSerializer
     filterset_fields = ['category']
+    version_models = ('documents.DocumentType', 'documents.DocumentCategory')
 
-class TemplateViewSet(viewsets.ModelViewSet):
+class TemplateViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Template.objects.all()
     serializer_class = TemplateSerializer
+    pagination_class = TemplateCursorPagination
+    version_models = ('documents.Template',)
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return TemplateListSerializer
+        return TemplateSerializer
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action in ('list', 'retrieve'):
+            kwargs.setdefault('fields', self.requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            # Load only the columns the projection reads; content_hash is body_id and id is the cursor.
+            fields = self.requested_fields() or TemplateListSerializer.Meta.fields
+            columns = {'id'} | {'body' if f == 'content_hash' else f for f in fields if f in TemplateListSerializer.Meta.fields}
+            queryset = queryset.only(*columns)
+        return queryset
+
+    def get_throttles(self):
+        if self.action == 'generate_or_fetch':
+            return [throttle() for throttle in AI_THROTTLES]
+        return super().get_throttles()
+
+    def throttle_cost(self, request):
+        """A generation is charged in full unless the template is already stored."""
+        doc_type_id = request.data.get('document_type_id')
+        state = request.data.get('state')
+        if not doc_type_id or not state or not str(doc_type_id).isdigit():
+            return throttle_cost('fetch')  # answered with a 400/404
+        if get_cached_template(doc_type_id, state) is not None:
+            return throttle_cost('cached')
+        if template_exists(doc_type_id, state):
+            return throttle_cost('fetch')
+        return throttle_cost('generate')
+
+    def requested_fields(self):
+        fields = self.request.query_params.get('fields', '')
+        return [f.strip() for f in fields.split(',') if f.strip()] or None
     
     @action(detail=False, methods=['post'], url_path='generate')
     def generate_or_fetch(self, request):
         """
         Fetch existing template or Generate new one using AI if not found.
+        Pass "async": true to get a 202 with a generation job to poll instead of
+        waiting for the AI call.
         """
         doc_type_id = request.data.get('document_type_id')
         state = request.data.get('state')
@@ -29,37 +93,159 @@ class TemplateViewSet(viewsets.ModelViewSet):
         if not doc_type_id or not state:
             return Response({'error': 'document_type_id and state are required'}, status=status.HTTP_400_BAD_REQUEST)
             
+        # 0. Hot path: already resolved and serialized
+        if str(doc_type_id).isdigit():
+            payload = get_cached_template(doc_type_id, state)
+            if payload is not None:
+                return Response(payload)
+
         try:
             doc_type = DocumentType.objects.get(id=doc_type_id)
-        except DocumentType.DoesNotExist:
+        except (DocumentType.DoesNotExist, ValueError):
             return Response({'error': 'Invalid Document Type'}, status=status.HTTP_404_NOT_FOUND)
 
-        # 1. Check DB for Verified or Pending template
-        template = Template.objects.filter(
-            document_type=doc_type, 
-            state__iexact=state,
-            is_active=True
-        ).first()
+        # 1. Check DB for Verified or Pending template (one saved from a stale answer is regenerated below)
+        template = find_template(doc_type, state)
 
-        if template:
-            return Response(TemplateSerializer(template).data)
+        if template and not template.needs_regeneration:
+            return Response(cache_template(template))
 
-        # 2. Not Found? Trigger AI Generation
-        ai_service = GeminiService()
-        generated_data = ai_service.generate_template(doc_type.name, state)
-        print(generated_data, 'generated_data')
-        
-        if not generated_data:
+        # 2a. Async mode: hand off to the job pool and let the client poll
+        if is_truthy(request.data.get('async', request.query_params.get('async'))):
+            job = enqueue_generation(doc_type, state, request.user)
+            return Response(self._job_payload(request, job), status=status.HTTP_202_ACCEPTED)
+
+        # 2. Not Found? Trigger AI Generation (coalesced with concurrent requests for the same key)
+        try:
+            new_template = generate_template(doc_type, state)
+        except SingleFlightTimeout:
+            if template:
+                return Response(TemplateSerializer(template).data)
+            return Response({'error': 'Template generation is taking longer than expected. Please try again.'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        if not new_template:
+            if template:
+                return Response(TemplateSerializer(template).data)
             return Response({'error': 'Failed to generate template. Please try again.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # 3. Save as Pending Review
-        new_template = Template.objects.create(
-            document_type=doc_type,
-            state=state,
-            content_html=generated_data.get('html_content', ''),
-            form_schema=generated_data.get('form_schema', []),
-            status=Template.Status.PENDING_REVIEW,
-            is_active=True # Allow immediate use as per requirement
+        # 3. Saved as Pending Review
+        return Response(TemplateSerializer(new_template).data, status=status.HTTP_200_OK if template else status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'], url_path=r'jobs/(?P<job_id>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})')
+    def job_status(self, request, job_id=None):
+        """
+        Status of an async generation job. Includes the template once SUCCEEDED.
+        Only the user who requested the job (or staff) can see it.
+        """
+        jobs = TemplateGenerationJob.objects.select_related('template')
+        if not request.user.is_staff:
+            jobs = jobs.filter(requested_by=request.user)
+        job = get_object_or_404(jobs, pk=job_id)
+        return Response(self._job_payload(request, expire_if_stale(job)))
+
+    @action(detail=False, methods=['get'], url_path=r'bodies/(?P<sha256>[0-9a-f]{64})', renderer_classes=[StaticHTMLRenderer])
+    def body(self, request, sha256=None):
+        """
+        Template HTML by content hash (TemplateSerializer.content_hash), sent in
+        its precompressed encoding. Bodies never change, so the response is
+        cacheable indefinitely.
+        """
+        body = get_object_or_404(TemplateBody, pk=sha256)
+        return body_response(request, body)
+
+    def _job_payload(self, request, job):
+        data = TemplateGenerationJobSerializer(job).data
+        data['status_url'] = request.build_absolute_uri(
+            reverse('template-job-status', kwargs={'job_id': str(job.pk)})
         )
+        return data
+
+
+def body_response(request, body):
+    variants = {'br': body.brotli_data, 'gzip': body.gzip_data}
+    encoding = pick_encoding(request.META.get('HTTP_ACCEPT_ENCODING'), [c for c, data in variants.items() if data])
+
+    # One strong ETag per representation; any of them means the client already has this body.
+    etag = f'"{body.sha256}-{encoding}"' if encoding else f'"{body.sha256}"'
+    cached = {tag.strip().removeprefix('W/').strip('"').split('-')[0] for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')}
+    if body.sha256 in cached:
+        response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = HttpResponse(bytes(variants[encoding]) if encoding else body.html, content_type='text/html; charset=utf-8')
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+
+def is_truthy(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@csrf_exempt  # token-authenticated, like the DRF views
+async def stream_template(request):
+    """
+    Server-Sent Events variant of TemplateViewSet.generate_or_fetch.
+    POST {"document_type_id", "state"} with the usual Bearer token. Emits 'chunk'
+    events with html_content as Gemini writes it, then one 'template' event with
+    the saved template (or 'error').
+
+    Chunks only reach the client as they are written when served over ASGI
+    (config.asgi). Under WSGI (config.wsgi, runserver) Django reads the whole
+    stream first, so every event arrives at the end.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    try:
+        auth = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed:
+        auth = None
+    if auth is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided or are invalid.'}, status=status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        body = json.loads(request.body or b'{}')
+    except ValueError:
+        body = {}
+    doc_type_id = body.get('document_type_id')
+    state = body.get('state')
+    if not doc_type_id or not state:
+        return JsonResponse({'error': 'document_type_id and state are required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    payload = await sync_to_async(get_cached_template)(doc_type_id, state) if str(doc_type_id).isdigit() else None
+    cost = throttle_cost('cached')
+    if payload is None:
+        try:
+            doc_type = await DocumentType.objects.aget(id=doc_type_id)
+        except (DocumentType.DoesNotExist, ValueError):
+            return JsonResponse({'error': 'Invalid Document Type'}, status=status.HTTP_404_NOT_FOUND)
+        template = await sync_to_async(find_template)(doc_type, state)
+        if template and not template.needs_regeneration:
+            payload = await sync_to_async(cache_template)(template)
+        cost = throttle_cost('fetch' if payload is not None else 'generate')
+
+    request.user = auth[0]
+    wait = await sync_to_async(check_ai_throttles)(request, cost)
+    if wait:
+        response = JsonResponse({'detail': 'Request was throttled.'}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+        response['Retry-After'] = str(math.ceil(wait))
+        return response
+
+    async def events():
+        if payload is not None:
+            yield sse_event('template', payload)
+            return
+        async for event, data in stream_generation(doc_type, state):
+            yield sse_event(event, data)
 
-        return Response(TemplateSerializer(new_template).data, status=status.HTTP_201_CREATED)
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # let nginx pass chunks straight through
+    return response
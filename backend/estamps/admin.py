@@ -1,8 +1,15 @@
 from django.contrib import admin
-from .models import EStamp
+from .models import EStamp, EStampVerification
 
 @admin.register(EStamp)
 class EStampAdmin(admin.ModelAdmin):
     list_display = ('certificate_number', 'order', 'issued_date')
     search_fields = ('certificate_number', 'order__order_number', 'grn_number')
     date_hierarchy = 'issued_date'
+
+@admin.register(EStampVerification)
+class EStampVerificationAdmin(admin.ModelAdmin):
+    list_display = ('order', 'status', 'certificate_number', 'grn_number', 'requested_by', 'duration_ms', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('order__order_number', 'certificate_number', 'grn_number', 'batch_id')
+    readonly_fields = ('batch_id', 'expected_data', 'result', 'prompt_version', 'error', 'duration_ms', 'created_at')
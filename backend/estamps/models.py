@@ -1,3 +1,5 @@
+import uuid
+from django.conf import settings
 from django.db import models
 from order_management.models import Order
 
@@ -14,3 +16,32 @@ class EStamp(models.Model):
 
     def __str__(self):
         return self.certificate_number
+
+class EStampVerification(models.Model):
+    """One AI check of an uploaded certificate against an Order's expected details."""
+    class Status(models.TextChoices):
+        MATCHED = 'MATCHED', 'Matched'
+        MISMATCH = 'MISMATCH', 'Mismatch'
+        FAILED = 'FAILED', 'Failed'
+        TIMEOUT = 'TIMEOUT', 'Timed Out'
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='estamp_verifications')
+    estamp = models.ForeignKey(EStamp, on_delete=models.SET_NULL, null=True, blank=True, related_name='verifications')
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    batch_id = models.UUIDField(default=uuid.uuid4, db_index=True)
+    file_name = models.CharField(max_length=255, blank=True)
+
+    status = models.CharField(max_length=20, choices=Status.choices)
+    expected_data = models.JSONField(default=dict)
+    result = models.JSONField(null=True, blank=True, help_text="Raw model response")
+    # Numbers as read from the certificate
+    certificate_number = models.CharField(max_length=100, blank=True)
+    grn_number = models.CharField(max_length=100, blank=True)
+    prompt_version = models.PositiveIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    duration_ms = models.PositiveIntegerField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.order} - {self.status}"
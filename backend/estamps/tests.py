@@ -1,3 +1,301 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import time
+from unittest.mock import patch
 
-# Create your tests here.
+from django.core.files import temp
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from documents.models import Prompt, PromptType
+from masters.models import State
+from order_management.models import Order, OrderParty, ServiceType
+from services import metrics, payloads
+from services.certificates import match_text
+from services.prompts import prompt_registry
+from services.uploads import FileSource
+from services.verification import BatchItem, VerificationService
+from users.models import User
+from .models import EStamp, EStampVerification
+
+
+def fake_verify(self, file_content, expected_data, mime_type="application/pdf"):
+    file_content = FileSource(file_content).read()
+    if file_content == b"slow":
+        time.sleep(1)
+    if file_content == b"broken":
+        return None
+    return {"is_correct": file_content == b"good", "differences": [], "certificate_number": "IN-BR12345678901234A",
+            "grn_number": "GRN1", "prompt_version": 3}
+
+
+CERTIFICATE_TEXT = """INDIA NON JUDICIAL
+Government of Bihar
+e-Stamp
+Certificate No.          : IN-BR 12345678901234 A
+GRN No. : GRN0012345678
+First Party              : Asha Kumari
+Consideration Price (Rs.): 50,000
+(Fifty Thousand only)
+Stamp Duty Amount(Rs.)   : 1,500
+(One Thousand Five Hundred only)"""
+
+
+class CertificatePrecheckTests(TestCase):
+    def test_full_match_is_confirmed_locally(self):
+        """Test that a text layer matching every expected value gives a text-layer result"""
+        result = match_text(CERTIFICATE_TEXT, {
+            "certificate_number": "IN-BR12345678901234A", "grn_number": "GRN0012345678",
+            "first_party": "asha  kumari", "stamp_duty_amount": "1500.00", "consideration_price": "50000",
+            "second_party": None,
+        })
+        self.assertEqual(result["method"], "text-layer")
+        self.assertTrue(result["is_correct"])
+        self.assertEqual(result["grn_number"], "GRN0012345678")
+        self.assertEqual(match_text(CERTIFICATE_TEXT, {"certificate_number": "IN-BR12345678901234A"})["grn_number"],
+                         "GRN0012345678")
+
+    def test_anything_unmatched_defers_to_model(self):
+        """Test that a missing value, a different number or no certificate number returns None"""
+        self.assertIsNone(match_text(CERTIFICATE_TEXT, {"first_party": "Ravi"}))
+        self.assertIsNone(match_text(CERTIFICATE_TEXT, {"certificate_number": "IN-BR99999999999999Z"}))
+        self.assertIsNone(match_text("Stamp Duty 1500", {"stamp_duty_amount": "1500"}))
+
+    def test_amounts_are_read_against_their_own_label(self):
+        """Test that swapped amounts, missing labels and no expected certificate number defer to the model"""
+        certificate = "IN-BR12345678901234A"
+        self.assertIsNone(match_text(CERTIFICATE_TEXT, {
+            "certificate_number": certificate, "stamp_duty_amount": "50000", "consideration_price": "1500",
+        }))
+        self.assertIsNone(match_text(CERTIFICATE_TEXT, {"stamp_duty_amount": "1500", "first_party": "Asha Kumari"}))
+        self.assertIsNone(match_text(CERTIFICATE_TEXT, {"certificate_number": certificate, "second_party": "Ravi"}))
+        self.assertIsNone(match_text(CERTIFICATE_TEXT, {"certificate_number": certificate, "article": "ART-5"}))
+        repeated = CERTIFICATE_TEXT + "\nStamp Duty Amount : 2,000"
+        self.assertIsNone(match_text(repeated, {"certificate_number": certificate, "stamp_duty_amount": "1500"}))
+
+    @override_settings(GEMINI_API_KEY=None, LLM_CACHES={})
+    def test_service_skips_model_on_match(self):
+        """Test that verify_document_data answers from the text layer without a model call"""
+        with patch('services.certificates.extract_text', return_value=[CERTIFICATE_TEXT]):
+            expected = {"certificate_number": "IN-BR12345678901234A", "first_party": "Asha Kumari"}
+            result = VerificationService().verify_document_data(b"%PDF", expected)
+            self.assertEqual(result["certificate_number"], "IN-BR12345678901234A")
+            self.assertIsNone(VerificationService().verify_document_data(b"%PDF", {**expected, "first_party": "Ravi"}))
+
+
+class PayloadReductionTests(SimpleTestCase):
+    def test_relevant_pages(self):
+        """Test that the certificate page is picked over cover and annexure pages"""
+        pages = ["Cover letter", "Annexure A", CERTIFICATE_TEXT, "e-Stamp continuation", ""]
+        self.assertEqual(payloads.relevant_pages(pages, 1), [2])
+        self.assertEqual(payloads.relevant_pages(pages, 2), [2, 3])
+        self.assertEqual(payloads.relevant_pages(["", ""], 2), [])
+
+    def test_reduced_payload_cached_by_hash(self):
+        """Test that a file is reduced once and served from the cache after"""
+        with patch.object(payloads, 'reduce_pdf', return_value=b"%PDF-small") as reduce_pdf:
+            self.assertEqual(payloads.reduce_payload(b"%PDF-big-1", "application/pdf"), (b"%PDF-small", "application/pdf"))
+            self.assertEqual(payloads.reduce_payload(b"%PDF-big-1", "application/pdf"), (b"%PDF-small", "application/pdf"))
+        self.assertEqual(reduce_pdf.call_count, 1)
+
+    def test_unreadable_file_passes_through(self):
+        """Test that parse failures send the original bytes"""
+        with patch.object(payloads, 'reduce_image', side_effect=OSError("not an image")):
+            self.assertEqual(payloads.reduce_payload(b"junk", "image/png"), (b"junk", "image/png"))
+
+
+@override_settings(GEMINI_API_KEY='test-key', VERIFICATION_TEXT_PRECHECK=False)
+@patch('services.verification.get_client')
+class VerificationCacheTests(TestCase):
+    def setUp(self):
+        prompt_registry.invalidate()
+        self.addCleanup(prompt_registry.invalidate)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.llm_caches = {'verification': {'PATH': os.path.join(self.tmp.name, 'verification.sqlite3')}}
+
+    def verify(self, content, expected):
+        with override_settings(LLM_CACHES=self.llm_caches):
+            return VerificationService().verify_document_data(content, expected)
+
+    def test_repeat_check_is_served_from_cache(self, mock_get_client):
+        """Test that the same file and expected data only reach the model once"""
+        generate = mock_get_client.return_value.models.generate_content
+        generate.return_value.text = '{"is_correct": true, "differences": []}'
+
+        first = self.verify(b"%PDF-1", {"a": 1, "b": 2})
+        second = self.verify(b"%PDF-1", {"b": 2, "a": 1})
+        self.assertEqual(generate.call_count, 1)
+        self.assertTrue(second["cached"])
+        self.assertEqual(first["is_correct"], second["is_correct"])
+
+        self.verify(b"%PDF-1", {"a": 1, "b": 3})
+        self.verify(b"%PDF-2", {"a": 1, "b": 2})
+        self.assertEqual(generate.call_count, 3)
+
+    def test_new_prompt_version_misses(self, mock_get_client):
+        """Test that editing the VERIFY_DOCUMENT prompt starts a fresh cache namespace"""
+        generate = mock_get_client.return_value.models.generate_content
+        generate.return_value.text = '{"is_correct": false, "differences": ["amount"]}'
+        self.verify(b"%PDF-1", {"a": 1})
+        Prompt.objects.create(prompt_type=PromptType.VERIFY_DOCUMENT, description="v1", input_format="{expected_json}", output_format="")
+        self.verify(b"%PDF-1", {"a": 1})
+        self.assertEqual(generate.call_count, 2)
+
+
+@override_settings(GEMINI_API_KEY='test-key', VERIFICATION_TEXT_PRECHECK=False, VERIFICATION_PAYLOAD_REDUCTION=False, LLM_CACHES={})
+@patch('services.verification.get_client')
+class LargeFileTests(TestCase):
+    def setUp(self):
+        prompt_registry.invalidate()
+        self.addCleanup(prompt_registry.invalidate)
+        handle = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
+        handle.write(b"%PDF-" + b"x" * 4096)
+        handle.close()
+        self.path = handle.name
+        self.addCleanup(os.unlink, self.path)
+
+    def test_file_source_hashes_paths_and_bytes_alike(self, mock_get_client):
+        """Test that a file on disk hashes the same as its bytes, without reading it whole"""
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(FileSource(self.path).sha256, FileSource(data).sha256)
+        self.assertEqual(FileSource(self.path).size, len(data))
+
+    def test_large_file_goes_through_files_api(self, mock_get_client):
+        """Test that files over VERIFICATION_INLINE_MAX_BYTES are uploaded, referenced and then deleted"""
+        client = mock_get_client.return_value
+        client.models.generate_content.return_value.text = '{"is_correct": true, "differences": []}'
+        client.files.upload.return_value.uri = "https://files.example/abc"
+        client.files.upload.return_value.mime_type = "application/pdf"
+        client.files.upload.return_value.name = "files/abc"
+
+        with override_settings(VERIFICATION_INLINE_MAX_BYTES=1024):
+            result = VerificationService().verify_document_data(self.path, {"a": 1})
+        self.assertTrue(result["is_correct"])
+        self.assertEqual(client.files.upload.call_args.kwargs['file'], self.path)
+        part = client.models.generate_content.call_args.kwargs['contents'][0]
+        self.assertEqual(part.file_data.file_uri, "https://files.example/abc")
+        client.files.delete.assert_called_once_with(name="files/abc")
+
+    def test_upload_is_not_timed(self, mock_get_client):
+        """Test that model latency starts at the model request, after the Files API upload"""
+        client = mock_get_client.return_value
+        client.models.generate_content.return_value.text = '{"is_correct": true, "differences": []}'
+        client.files.upload.side_effect = lambda **kwargs: time.sleep(0.3) or client.files.upload.return_value
+        client.files.upload.return_value.uri = "https://files.example/abc"
+        client.files.upload.return_value.mime_type = "application/pdf"
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+        with override_settings(VERIFICATION_INLINE_MAX_BYTES=1024, LLM_CALL_LOG=False):
+            VerificationService().verify_document_data(self.path, {"a": 1})
+        (entry,) = metrics.llm_duration.snapshot().values()
+        self.assertEqual(sum(entry[:-1]), 1)
+        self.assertLess(entry[-1], 0.3)
+
+    def test_small_file_stays_inline(self, mock_get_client):
+        """Test that files under the limit are still sent as inline bytes"""
+        client = mock_get_client.return_value
+        client.models.generate_content.return_value.text = '{"is_correct": true, "differences": []}'
+        VerificationService().verify_document_data(self.path, {"a": 1})
+        client.files.upload.assert_not_called()
+        part = client.models.generate_content.call_args.kwargs['contents'][0]
+        self.assertTrue(part.inline_data.data.startswith(b"%PDF-"))
+
+
+@override_settings(GEMINI_API_KEY='test-key')
+@patch.object(VerificationService, 'verify_document_data', fake_verify)
+class VerifyBatchTests(SimpleTestCase):
+    def test_results_stream_as_they_finish(self):
+        """Test that fast items come back before a slow one, and a stuck item times out"""
+        items = [BatchItem("slow", b"slow", {}), BatchItem("good", b"good", {}), BatchItem("broken", b"broken", {})]
+        results = list(VerificationService().verify_batch(items, timeout=0.3))
+
+        self.assertEqual([r.key for r in results][-1], "slow")
+        by_key = {r.key: r for r in results}
+        self.assertTrue(by_key["slow"].timed_out)
+        self.assertTrue(by_key["good"].result["is_correct"])
+        self.assertEqual(by_key["broken"].error, "verification failed")
+
+
+@override_settings(GEMINI_API_KEY='test-key')
+@patch.object(VerificationService, 'verify_document_data', fake_verify)
+class BatchVerificationEndpointTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.vendor = User.objects.create_user(phone_number='+919800000001', role=User.Role.VENDOR)
+        customer = User.objects.create_user(phone_number='+919800000002')
+        state = State.objects.create(name="BIHAR", code="BR")
+        self.order = Order.objects.create(user=customer, vendor=self.vendor, service_type=ServiceType.ESTAMP, state=state, stamp_amount=100)
+        OrderParty.objects.create(order=self.order, party_type=OrderParty.PartyType.FIRST_PARTY, name="Asha", address="Patna")
+        self.other = Order.objects.create(user=customer, service_type=ServiceType.ESTAMP, state=state)
+        self.client.force_authenticate(user=self.vendor)
+
+    def post(self, manifest, **files):
+        data = {'manifest': json.dumps(manifest)}
+        data.update({name: SimpleUploadedFile(f"{name}.pdf", content, content_type='application/pdf') for name, content in files.items()})
+        return self.client.post('/api/estamps/verifications/batch/', data, format='multipart')
+
+    def test_batch_streams_ndjson_and_persists(self):
+        """Test that each certificate yields an NDJSON line and an EStampVerification"""
+        estamp = EStamp.objects.create(order=self.order, certificate_number="IN-BR12345678901234A", issued_date="2025-01-01T00:00:00Z", file="x.pdf")
+        response = self.post(
+            [{"file": "a", "order": self.order.order_number}, {"file": "b", "order": self.order.order_number, "expected_data": {"x": 1}}],
+            a=b"good", b=b"bad"
+        )
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+        self.assertEqual(sorted((line['index'], line['status']) for line in lines), [(0, 'MATCHED'), (1, 'MISMATCH')])
+        verifications = EStampVerification.objects.filter(batch_id=lines[0]['batch_id'])
+        self.assertEqual(verifications.count(), 2)
+        first = verifications.get(pk=next(line['verification_id'] for line in lines if line['index'] == 0))
+        self.assertEqual(first.estamp, estamp)
+        self.assertEqual(first.expected_data['first_party'], "Asha")
+        self.assertEqual(first.prompt_version, 3)
+
+    def test_results_saved_after_client_disconnects(self):
+        """Test that results the client never read are still saved as EStampVerifications"""
+        manifest = [{"file": name, "order": self.order.order_number} for name in ("a", "b", "c")]
+        response = self.post(manifest, a=b"good", b=b"bad", c=b"slow")
+        lines = iter(response.streaming_content)
+        next(lines)
+        response.close()  # what the server does when the connection drops
+        self.assertEqual(EStampVerification.objects.count(), 3)
+
+    def test_rejects_foreign_orders_and_missing_files(self):
+        """Test that the manifest is validated before anything is verified"""
+        response = self.post([{"file": "a", "order": self.other.order_number}, {"file": "zz", "order": self.order.order_number}], a=b"good")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data['manifest']), {0, 1})
+        self.assertFalse(EStampVerification.objects.exists())
+
+    def test_oversized_upload_is_refused(self):
+        """Test that a file over FILE_UPLOAD_MAX_SIZE is rejected while it is being received"""
+        with override_settings(FILE_UPLOAD_MAX_SIZE=1024):
+            response = self.post([{"file": "a", "order": self.order.order_number}], a=b"x" * 4096)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(EStampVerification.objects.exists())
+
+    def test_uploads_are_spooled_and_hashed(self):
+        """Test that batch items get the spooled upload, already hashed, rather than its bytes"""
+        seen = []
+
+        def capture(service, file_content, expected_data, mime_type="application/pdf"):
+            seen.append((file_content.temporary_file_path(), file_content.sha256))
+            return fake_verify(service, file_content, expected_data, mime_type)
+
+        with patch.object(VerificationService, 'verify_document_data', capture), \
+                patch.object(temp, 'NamedTemporaryFile', wraps=temp.NamedTemporaryFile) as temporary:
+            response = self.post([{"file": "a", "order": self.order.order_number}], a=b"good")
+            b''.join(response.streaming_content)
+        self.assertEqual(seen[0][1], FileSource(b"good").sha256)
+        self.assertEqual(temporary.call_count, 1)  # one temporary file per upload
+
+    def test_clients_cannot_verify(self):
+        """Test that only vendors and staff can use the batch endpoint"""
+        self.client.force_authenticate(user=self.order.user)
+        self.assertEqual(self.post([{"file": "a", "order": self.order.order_number}], a=b"good").status_code, 403)
@@ -1,9 +1,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import EStampViewSet
+from .views import EStampViewSet, EStampVerificationViewSet
 
 router = DefaultRouter()
 router.register(r'certificates', EStampViewSet, basename='estamp')
+router.register(r'verifications', EStampVerificationViewSet, basename='estamp-verification')
 
 urlpatterns = [
     path('', include(router.urls)),
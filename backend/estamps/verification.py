@@ -0,0 +1,66 @@
+import mimetypes
+
+from order_management.models import OrderParty
+from .models import EStamp, EStampVerification
+
+
+def expected_data_for(order):
+    """Details a certificate for this order should carry, when the vendor sends none."""
+    parties = {party.party_type: party.name for party in order.parties.all()}
+    return {
+        'state': order.state.name if order.state else None,
+        'article': order.article.code if order.article else None,
+        'stamp_duty_amount': str(order.stamp_amount),
+        'consideration_price': str(order.consideration_price),
+        'first_party': parties.get(OrderParty.PartyType.FIRST_PARTY),
+        'second_party': parties.get(OrderParty.PartyType.SECOND_PARTY),
+        'purpose': order.document_reason or None,
+    }
+
+
+def guess_mime_type(upload):
+    if upload.content_type and upload.content_type != 'application/octet-stream':
+        return upload.content_type
+    return mimetypes.guess_type(upload.name or '')[0] or 'application/pdf'
+
+
+def upload_source(upload):
+    """
+    What a BatchItem should carry for an upload: the spooled file itself (read
+    from disk by path, so items sharing it do not share a file position), or
+    its bytes when it was kept in memory.
+    """
+    if hasattr(upload, 'temporary_file_path'):
+        return upload
+    upload.seek(0)
+    return upload.read()
+
+
+def outcome_status(outcome):
+    if outcome.timed_out:
+        return EStampVerification.Status.TIMEOUT
+    if outcome.error or outcome.result is None:
+        return EStampVerification.Status.FAILED
+    if outcome.result.get('is_correct') is True:
+        return EStampVerification.Status.MATCHED
+    return EStampVerification.Status.MISMATCH
+
+
+def record_verification(outcome, order, expected_data, batch_id, user=None, file_name=''):
+    """Persists a services.verification.BatchResult against the order (and its EStamp, if issued)."""
+    result = outcome.result or {}
+    return EStampVerification.objects.create(
+        order=order,
+        estamp=EStamp.objects.filter(order=order).first(),
+        requested_by=user,
+        batch_id=batch_id,
+        file_name=file_name[:255],
+        status=outcome_status(outcome),
+        expected_data=expected_data,
+        result=outcome.result,
+        certificate_number=str(result.get('certificate_number') or '')[:100],
+        grn_number=str(result.get('grn_number') or '')[:100],
+        prompt_version=result.get('prompt_version'),
+        error=outcome.error or '',
+        duration_ms=int(outcome.elapsed * 1000),
+    )
@@ -1,6 +1,17 @@
-from rest_framework import viewsets, permissions, serializers
-from .models import EStamp
+import json
+import uuid
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework import viewsets, permissions, serializers, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from .models import EStamp, EStampVerification
+from .verification import expected_data_for, guess_mime_type, record_verification, upload_source
 from order_management.models import Order
+from services.throttling import AI_THROTTLES, throttle_cost
+from services.verification import BatchItem, VerificationService
+from users.models import User
 
 class EStampSerializer(serializers.ModelSerializer):
     class Meta:
@@ -17,3 +28,135 @@ class EStampViewSet(viewsets.ReadOnlyModelViewSet):
 
     def get_queryset(self):
         return EStamp.objects.filter(order__user=self.request.user)
+
+class IsVendorOrStaff(permissions.BasePermission):
+    def has_permission(self, request, view):
+        user = request.user
+        return bool(user and user.is_authenticated and (user.is_staff or user.role == User.Role.VENDOR))
+
+class EStampVerificationSerializer(serializers.ModelSerializer):
+    order_number = serializers.CharField(source='order.order_number', read_only=True)
+
+    class Meta:
+        model = EStampVerification
+        fields = ['id', 'batch_id', 'order', 'order_number', 'estamp', 'file_name', 'status', 'certificate_number',
+                  'grn_number', 'expected_data', 'result', 'prompt_version', 'error', 'duration_ms', 'created_at']
+
+class EStampVerificationViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Certificate verifications. Vendors see those for orders assigned to them.
+    Filter a batch with ?batch_id=.
+    """
+    serializer_class = EStampVerificationSerializer
+    permission_classes = [IsVendorOrStaff]
+
+    def get_queryset(self):
+        queryset = EStampVerification.objects.select_related('order').order_by('-created_at')
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(order__vendor=self.request.user)
+        batch_id = self.request.query_params.get('batch_id')
+        if batch_id:
+            queryset = queryset.filter(batch_id=batch_id)
+        return queryset
+
+    def get_throttles(self):
+        if self.action == 'batch':
+            return [throttle() for throttle in AI_THROTTLES]
+        return super().get_throttles()
+
+    def throttle_cost(self, request):
+        """Charged per certificate in the manifest; a malformed or oversized one (answered with 400) costs one."""
+        try:
+            manifest = json.loads(request.data.get('manifest') or '[]')
+        except (TypeError, ValueError):
+            manifest = []
+        count = len(manifest) if isinstance(manifest, list) else 0
+        if count > getattr(settings, 'VERIFICATION_BATCH_MAX_ITEMS', 50):
+            count = 1
+        return throttle_cost('verify') * max(1, count)
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Verifies many certificates at once. Multipart body: `manifest`, a JSON list of
+        {"file": <file field name>, "order": <order_number>, "expected_data": {...}}
+        (expected_data defaults to the order's details), plus the files themselves.
+        Responds with NDJSON, one line per certificate as soon as it is checked;
+        each result is also saved as an EStampVerification, including those the
+        client disconnected before reading.
+        """
+        try:
+            manifest = json.loads(request.data.get('manifest') or '[]')
+        except (TypeError, ValueError):
+            return Response({'manifest': 'Must be a JSON list.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(manifest, list) or not manifest:
+            return Response({'manifest': 'Must be a non-empty JSON list.'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = getattr(settings, 'VERIFICATION_BATCH_MAX_ITEMS', 50)
+        if len(manifest) > limit:
+            return Response({'manifest': f'At most {limit} items per batch.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        orders = Order.objects.select_related('state', 'article').prefetch_related('parties')
+        if not request.user.is_staff:
+            orders = orders.filter(vendor=request.user)
+        numbers = [entry.get('order') for entry in manifest if isinstance(entry, dict)]
+        orders = {order.order_number: order for order in orders.filter(order_number__in=numbers)}
+
+        errors, entries = {}, []
+        for index, entry in enumerate(manifest):
+            if not isinstance(entry, dict):
+                errors[index] = 'Must be an object.'
+                continue
+            upload = request.FILES.get(entry.get('file') or '')
+            order = orders.get(entry.get('order'))
+            expected = entry.get('expected_data')
+            if upload is None:
+                errors[index] = f"No uploaded file named {entry.get('file')!r}."
+            elif order is None:
+                errors[index] = f"Unknown order {entry.get('order')!r}."
+            elif expected is not None and not isinstance(expected, dict):
+                errors[index] = 'expected_data must be an object.'
+            else:
+                entries.append((index, upload, order, expected or expected_data_for(order)))
+        if errors:
+            return Response({'manifest': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        batch_id = uuid.uuid4()
+        by_index = {index: (upload, order, expected) for index, upload, order, expected in entries}
+        items = [
+            BatchItem(key=index, file_content=upload_source(upload), expected_data=expected, mime_type=guess_mime_type(upload))
+            for index, upload, order, expected in entries
+        ]
+        service = VerificationService()
+        user = request.user
+
+        def record(outcome):
+            upload, order, expected = by_index[outcome.key]
+            return order, record_verification(outcome, order, expected, batch_id, user, upload.name or '')
+
+        def lines():
+            outcomes = service.verify_batch(items)
+            try:
+                for outcome in outcomes:
+                    order, verification = record(outcome)
+                    yield json.dumps({
+                        'index': outcome.key,
+                        'batch_id': str(batch_id),
+                        'verification_id': verification.pk,
+                        'order': order.order_number,
+                        'status': verification.status,
+                        'is_correct': (outcome.result or {}).get('is_correct'),
+                        'differences': (outcome.result or {}).get('differences', []),
+                        'certificate_number': verification.certificate_number,
+                        'grn_number': verification.grn_number,
+                        'method': (outcome.result or {}).get('method'),
+                        'error': verification.error or None,
+                    }) + '\n'
+            finally:
+                # The client may have disconnected; the model calls still run (and are billed), so keep their results.
+                for outcome in outcomes:
+                    record(outcome)
+
+        response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+        response['X-Accel-Buffering'] = 'no'  # let nginx pass lines through as they come
+        response['X-Batch-Id'] = str(batch_id)
+        return response
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import State, Article
+from .models import State, Article, DutyRule
 
 @admin.register(State)
 class StateAdmin(admin.ModelAdmin):
@@ -13,3 +13,10 @@ class ArticleAdmin(admin.ModelAdmin):
     search_fields = ('title', 'code')
     list_filter = ('stamp_for', 'is_all_states', 'states')
     filter_horizontal = ('states',)
+
+@admin.register(DutyRule)
+class DutyRuleAdmin(admin.ModelAdmin):
+    list_display = ('article', 'state', 'percentage', 'fixed_amount', 'minimum_duty', 'maximum_duty', 'rounding', 'is_active')
+    search_fields = ('article__code', 'article__title', 'state__name', 'state__code')
+    list_filter = ('is_active', 'rounding', 'state')
+    autocomplete_fields = ('article', 'state')
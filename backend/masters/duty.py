@@ -0,0 +1,229 @@
+import bisect
+import threading
+from dataclasses import dataclass
+from decimal import ROUND_CEILING, ROUND_HALF_UP, Decimal, InvalidOperation
+
+from services.versioning import get_versions
+from .models import Article, DutyRule
+
+# The compiled table is rebuilt when any of these change (in any process).
+VERSION_MODELS = ('masters.DutyRule', 'masters.Article')
+
+ZERO = Decimal('0')
+PAISA = Decimal('0.01')
+HUNDRED = Decimal('100')
+INFINITY = Decimal('Infinity')
+# Largest amount accepted from input: Order.consideration_price is DecimalField(max_digits=15, decimal_places=2)
+MAX_AMOUNT = Decimal('9999999999999.99')
+
+ROUNDING = {
+    DutyRule.Rounding.PAISE: (PAISA, ROUND_HALF_UP),
+    DutyRule.Rounding.NEAREST_RUPEE: (Decimal('1'), ROUND_HALF_UP),
+    DutyRule.Rounding.UP_RUPEE: (Decimal('1'), ROUND_CEILING),
+    DutyRule.Rounding.UP_TEN: (Decimal('10'), ROUND_CEILING),
+    DutyRule.Rounding.UP_HUNDRED: (Decimal('100'), ROUND_CEILING),
+}
+
+
+class DutyRuleMissing(Exception):
+    """No rule prices this article in this state (or the article is not offered there)."""
+
+
+def parse_amount(value, what='amount'):
+    """A non-negative, finite Decimal no larger than MAX_AMOUNT from user input; ValueError otherwise."""
+    try:
+        amount = Decimal(str(value).replace(',', '').strip())
+    except (InvalidOperation, TypeError):
+        raise ValueError(f"{what} must be a number")
+    if not amount.is_finite() or amount < 0:
+        raise ValueError(f"{what} must be a non-negative number")
+    if amount > MAX_AMOUNT:
+        raise ValueError(f"{what} must be at most {MAX_AMOUNT}")
+    return amount
+
+
+def _optional(value, what):
+    return None if value in (None, '') else parse_amount(value, what)
+
+
+@dataclass(frozen=True)
+class CompiledRule:
+    """
+    A duty rule reduced to Decimal constants. Slabs become parallel tuples
+    (lower bound, upper bound, rate, duty accumulated below the band), so a
+    value is priced with one bisect instead of a walk over the bands.
+    """
+
+    fixed: Decimal
+    rate: Decimal
+    lowers: tuple
+    uppers: tuple
+    band_rates: tuple
+    band_base: tuple
+    minimum: Decimal | None
+    maximum: Decimal | None
+    quantum: Decimal
+    rounding: str
+    source: str
+
+    def duty(self, value):
+        duty = self.fixed + value * self.rate
+        if self.uppers:
+            band = min(bisect.bisect_left(self.uppers, value), len(self.uppers) - 1)
+            duty += self.band_base[band] + (value - self.lowers[band]) * self.band_rates[band]
+        # Round first: the minimum and maximum are absolute, and rounding up must not pass the cap.
+        duty = (duty / self.quantum).to_integral_value(rounding=self.rounding) * self.quantum
+        if self.minimum is not None and duty < self.minimum:
+            duty = self.minimum
+        if self.maximum is not None and duty > self.maximum:
+            duty = self.maximum
+        return duty.quantize(PAISA)
+
+    def duties(self, values):
+        duty = self.duty
+        return [duty(value) for value in values]
+
+
+def compile_slabs(slabs):
+    """(lowers, uppers, rates, base) for marginal bands; ValueError on a malformed list."""
+    if not slabs:
+        return (), (), (), ()
+    if not isinstance(slabs, list):
+        raise ValueError("slabs must be a list of {upto, percentage} objects")
+    lowers, uppers, rates, base = [], [], [], []
+    lower, accumulated = ZERO, ZERO
+    for index, slab in enumerate(slabs):
+        if not isinstance(slab, dict):
+            raise ValueError(f"slab {index + 1} must be an object")
+        upto = slab.get('upto')
+        upper = INFINITY if upto is None else parse_amount(upto, f"slab {index + 1} upto")
+        if upper <= lower:
+            raise ValueError("slab limits must increase")
+        if upper == INFINITY and index != len(slabs) - 1:
+            raise ValueError("only the last slab may be open-ended")
+        rate = parse_amount(slab.get('percentage', 0), f"slab {index + 1} percentage") / HUNDRED
+        lowers.append(lower)
+        uppers.append(upper)
+        rates.append(rate)
+        base.append(accumulated)
+        if upper != INFINITY:
+            accumulated += (upper - lower) * rate
+        lower = upper
+    if uppers[-1] != INFINITY:
+        # Nothing more is charged above the last limit.
+        lowers.append(lower)
+        uppers.append(INFINITY)
+        rates.append(ZERO)
+        base.append(accumulated)
+    return tuple(lowers), tuple(uppers), tuple(rates), tuple(base)
+
+
+def compile_rule(rule):
+    """CompiledRule for a DutyRule (ValueError when its numbers or slabs are invalid)."""
+    lowers, uppers, rates, base = compile_slabs(rule.slabs)
+    quantum, rounding = ROUNDING.get(rule.rounding, ROUNDING[DutyRule.Rounding.UP_RUPEE])
+    minimum = _optional(rule.minimum_duty, "minimum duty")
+    maximum = _optional(rule.maximum_duty, "maximum duty")
+    if minimum is not None and maximum is not None and minimum > maximum:
+        raise ValueError("minimum duty is above maximum duty")
+    return CompiledRule(
+        fixed=_optional(rule.fixed_amount, "fixed amount") or ZERO,
+        rate=(_optional(rule.percentage, "percentage") or ZERO) / HUNDRED,
+        lowers=lowers, uppers=uppers, band_rates=rates, band_base=base,
+        minimum=minimum, maximum=maximum, quantum=quantum, rounding=rounding,
+        source=f"rule:{rule.pk}" if rule.pk else 'rule',
+    )
+
+
+def compile_article(percentage, fixed):
+    """The Article's own base_duty_percentage / fixed_duty_amount, used when no DutyRule applies."""
+    quantum, rounding = ROUNDING[DutyRule.Rounding.UP_RUPEE]
+    return CompiledRule(
+        fixed=fixed or ZERO, rate=(percentage or ZERO) / HUNDRED,
+        lowers=(), uppers=(), band_rates=(), band_base=(),
+        minimum=None, maximum=None, quantum=quantum, rounding=rounding, source='article',
+    )
+
+
+class DutyTable:
+    """
+    Every active rule compiled and keyed by (state_id, article_id), with
+    state None for all-India defaults. Lookup order: the state's own rule,
+    then (if the article is offered in that state) the all-India rule, then
+    the Article's base percentage / fixed amount.
+    """
+
+    def __init__(self, versions):
+        self.versions = versions
+        self.rules = {}
+        self.articles = {}  # article_id -> (is_all_states, state ids, compiled article fields or None)
+
+        for rule in DutyRule.objects.filter(is_active=True):
+            try:
+                self.rules[(rule.state_id, rule.article_id)] = compile_rule(rule)
+            except ValueError as e:
+                print(f"Skipping invalid duty rule {rule.pk}: {e}")
+
+        states = {}
+        for article_id, state_id in Article.states.through.objects.values_list('article_id', 'state_id'):
+            states.setdefault(article_id, set()).add(state_id)
+        for pk, all_states, percentage, fixed in Article.objects.values_list(
+                'pk', 'is_all_states', 'base_duty_percentage', 'fixed_duty_amount'):
+            own = compile_article(percentage, fixed) if percentage is not None or fixed is not None else None
+            self.articles[pk] = (all_states, frozenset(states.get(pk, ())), own)
+
+    def rule_for(self, state_id, article_id):
+        try:
+            state_id = int(state_id) if state_id not in (None, '') else None
+            article_id = int(article_id)
+        except (TypeError, ValueError):
+            raise DutyRuleMissing("state_id and article_id must be ids.")
+        rule = self.rules.get((state_id, article_id))
+        if rule is not None:
+            return rule
+        if article_id not in self.articles:
+            raise DutyRuleMissing(f"Unknown article {article_id}.")
+        all_states, states, own = self.articles[article_id]
+        if not all_states and state_id not in states:
+            raise DutyRuleMissing("This article is not available in the selected state.")
+        rule = self.rules.get((None, article_id)) or own
+        if rule is None:
+            raise DutyRuleMissing("No stamp duty rule is configured for this article and state.")
+        return rule
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def get_duty_table():
+    """
+    The compiled table, rebuilt on first use and whenever DutyRule or Article
+    data changes (signals bump their versions, so every process notices on its
+    next quote). Costs one version lookup per call otherwise.
+    """
+    global _table
+    versions = get_versions(VERSION_MODELS)
+    table = _table
+    if table is None or table.versions != versions:
+        with _table_lock:
+            table = _table
+            if table is None or table.versions != versions:
+                table = _table = DutyTable(versions)
+    return table
+
+
+def clear_duty_table():
+    global _table
+    _table = None
+
+
+def quote(state_id, article_id, consideration):
+    """Stamp duty (Decimal, 2 places) for one consideration value."""
+    return get_duty_table().rule_for(state_id, article_id).duty(parse_amount(consideration, 'consideration'))
+
+
+def quote_many(state_id, article_id, considerations):
+    """Stamp duty for many consideration values under one rule, in input order."""
+    rule = get_duty_table().rule_for(state_id, article_id)
+    return rule.duties([parse_amount(value, 'consideration') for value in considerations])
@@ -1,3 +1,4 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 
 class State(models.Model):
@@ -33,3 +34,49 @@ class Article(models.Model):
 
     def __str__(self):
         return f"{self.code} - {self.title}"
+
+class DutyRule(models.Model):
+    """
+    How stamp duty is computed for an Article in a State (or in every state
+    when `state` is empty; a state-specific rule wins). Duty on a consideration
+    value V is fixed_amount + percentage% of V + the slab duty, rounded, then
+    clamped to [minimum_duty, maximum_duty]. Slabs are marginal bands, e.g.
+    [{"upto": 100000, "percentage": "1"}, {"upto": null, "percentage": "2"}]
+    charges 1% on the first lakh and 2% on the rest.
+    """
+    class Rounding(models.TextChoices):
+        PAISE = 'PAISE', 'Nearest paisa'
+        NEAREST_RUPEE = 'NEAREST_RUPEE', 'Nearest rupee'
+        UP_RUPEE = 'UP_RUPEE', 'Up to the next rupee'
+        UP_TEN = 'UP_TEN', 'Up to the next 10 rupees'
+        UP_HUNDRED = 'UP_HUNDRED', 'Up to the next 100 rupees'
+
+    state = models.ForeignKey(State, on_delete=models.CASCADE, null=True, blank=True, related_name='duty_rules',
+                              help_text="Leave empty for the all-India default")
+    article = models.ForeignKey(Article, on_delete=models.CASCADE, related_name='duty_rules')
+
+    percentage = models.DecimalField(max_digits=7, decimal_places=4, null=True, blank=True, help_text="% of consideration")
+    fixed_amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    slabs = models.JSONField(default=list, blank=True, help_text='Marginal bands: [{"upto": amount or null, "percentage": rate}]')
+    minimum_duty = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    maximum_duty = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    rounding = models.CharField(max_length=20, choices=Rounding.choices, default=Rounding.UP_RUPEE)
+
+    is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['state', 'article'], name='unique_duty_rule_per_state_article'),
+            models.UniqueConstraint(fields=['article'], condition=models.Q(state__isnull=True), name='unique_default_duty_rule_per_article'),
+        ]
+
+    def clean(self):
+        from .duty import compile_rule
+        try:
+            compile_rule(self)
+        except ValueError as e:
+            raise ValidationError({'slabs': str(e)})
+
+    def __str__(self):
+        return f"{self.article.code} @ {self.state.code if self.state else 'ALL'}"
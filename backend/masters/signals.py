@@ -0,0 +1,27 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from services.versioning import bump
+from .models import Article, DutyRule, State
+from .utils import clear_state_codes
+
+
+@receiver(post_save, sender=State)
+@receiver(post_delete, sender=State)
+def reset_state_codes(sender, **kwargs):
+    clear_state_codes()
+    bump('masters.State')
+
+
+@receiver(post_save, sender=Article)
+@receiver(post_delete, sender=Article)
+@receiver(m2m_changed, sender=Article.states.through)
+def bump_article_version(sender, **kwargs):
+    bump('masters.Article')
+
+
+@receiver(post_save, sender=DutyRule)
+@receiver(post_delete, sender=DutyRule)
+def bump_duty_rule_version(sender, **kwargs):
+    # Every process's compiled duty table checks this version (masters.duty)
+    bump('masters.DutyRule')
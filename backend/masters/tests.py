@@ -1,3 +1,175 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
 from django.test import TestCase
+from rest_framework.test import APIClient
+from services import versioning
+from .duty import DutyRuleMissing, clear_duty_table, quote, quote_many
+from .models import Article, DutyRule
+from .models import State
+from .utils import clear_state_codes, normalize_state_key
+
+
+class StateKeyTests(TestCase):
+    def setUp(self):
+        clear_state_codes()
+        State.objects.create(name="BIHAR", code="BR")
+        State.objects.create(name="JAMMU AND KASHMIR", code="JK")
+
+    def test_known_states_map_to_code(self):
+        """Test that names, codes and spelling variants resolve to the State code"""
+        self.assertEqual(normalize_state_key("Bihar"), "BR")
+        self.assertEqual(normalize_state_key("  bihar "), "BR")
+        self.assertEqual(normalize_state_key("br"), "BR")
+        self.assertEqual(normalize_state_key("Jammu & Kashmir"), "JK")
+
+    def test_unknown_state_uses_slug(self):
+        """Test that free text outside masters gets a stable slug key"""
+        self.assertEqual(normalize_state_key("All India"), "ALL-INDIA")
+        self.assertEqual(normalize_state_key(normalize_state_key("All India")), "ALL-INDIA")
+
+    def test_new_state_resets_lookup(self):
+        """Test that adding a State is picked up without a restart"""
+        self.assertEqual(normalize_state_key("Goa"), "GOA")
+        State.objects.create(name="GOA", code="GA")
+        self.assertEqual(normalize_state_key("Goa"), "GA")
+
+
+    def test_state_edit_in_another_process_is_picked_up(self):
+        """Test that a State edit elsewhere (a version bump, no local signal) resets the lookup"""
+        self.assertEqual(normalize_state_key("Goa"), "GOA")
+        State.objects.bulk_create([State(name="GOA", code="GA")])  # no signals in this process
+        self.assertEqual(normalize_state_key("Goa"), "GOA")
+
+        caches['shared'].set('catalog-version:masters.state', 1, None)  # bumped by the other process
+        versioning.clear_local()  # CATALOG_VERSION_LOCAL_TTL elapsed
+        self.assertEqual(normalize_state_key("Goa"), "GA")
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        versioning.clear_local()
+        self.addCleanup(versioning.clear_local)
+        self.client = APIClient()
+        self.state = State.objects.create(name="BIHAR", code="BR")
+
+    def test_unchanged_list_returns_304_without_querying(self):
+        """Test that a matching If-None-Match is answered from the version stamp alone"""
+        response = self.client.get('/api/masters/states/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):  # versions come from this process's short-lived copy
+            response = self.client.get('/api/masters/states/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get('/api/masters/states/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_write_changes_etag(self):
+        """Test that saving a State or an Article's states invalidates the ETags"""
+        etag = self.client.get('/api/masters/states/')['ETag']
+        State.objects.create(name="GOA", code="GA")
+        response = self.client.get('/api/masters/states/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 2)
+
+        article = Article.objects.create(code="ART-5", title="Agreement")
+        etag = self.client.get('/api/masters/articles/')['ETag']
+        article.states.add(self.state)
+        self.assertEqual(self.client.get('/api/masters/articles/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_other_process_change_seen_after_local_ttl(self):
+        """Test that a version bumped by another worker is picked up once the local copy expires"""
+        etag = self.client.get('/api/masters/states/')['ETag']
+        caches['shared'].set('catalog-version:masters.state', 1, None)  # a write in another process
+        self.assertEqual(self.client.get('/api/masters/states/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        versioning.clear_local()  # CATALOG_VERSION_LOCAL_TTL elapsed
+        self.assertEqual(self.client.get('/api/masters/states/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_depends_on_query(self):
+        """Test that different query strings get different ETags"""
+        first = self.client.get('/api/masters/articles/')['ETag']
+        second = self.client.get('/api/masters/articles/?state_id=%d' % self.state.pk)['ETag']
+        self.assertNotEqual(first, second)
+
+
+class DutyEngineTests(TestCase):
+    def setUp(self):
+        clear_duty_table()
+        self.addCleanup(clear_duty_table)
+        self.bihar = State.objects.create(name="BIHAR", code="BR")
+        self.goa = State.objects.create(name="GOA", code="GA")
+        self.kerala = State.objects.create(name="KERALA", code="KL")
+        self.sale = Article.objects.create(code="ART-23", title="Conveyance", is_all_states=True, base_duty_percentage=Decimal("5.00"))
+        self.affidavit = Article.objects.create(code="ART-4", title="Affidavit", fixed_duty_amount=Decimal("10.00"))
+        self.affidavit.states.add(self.bihar)
+
+    def test_article_fields_are_the_fallback(self):
+        """Test that without a DutyRule the Article's own percentage or fixed amount is used"""
+        self.assertEqual(quote(self.goa.pk, self.sale.pk, "1000.10"), Decimal("51.00"))
+        self.assertEqual(quote(self.bihar.pk, self.affidavit.pk, 0), Decimal("10.00"))
+        with self.assertRaises(DutyRuleMissing):
+            quote(self.goa.pk, self.affidavit.pk, 100)  # not offered in Goa
+
+    def test_state_rule_with_slabs_caps_and_rounding(self):
+        """Test that slabs are marginal, rounding applies before the caps, all in exact decimals"""
+        DutyRule.objects.create(
+            state=self.bihar, article=self.sale, fixed_amount=Decimal("100"),
+            slabs=[{"upto": 100000, "percentage": "1"}, {"upto": None, "percentage": "2"}],
+            minimum_duty=Decimal("500"), maximum_duty=Decimal("10000"), rounding=DutyRule.Rounding.UP_TEN,
+        )
+        self.assertEqual(
+            quote_many(self.bihar.pk, self.sale.pk, [0, 50000, "100000", "150000.01", 10 ** 7]),
+            [Decimal("500.00"), Decimal("600.00"), Decimal("1100.00"), Decimal("2110.00"), Decimal("10000.00")],
+        )
+        # Other states keep the article default
+        self.assertEqual(quote(self.goa.pk, self.sale.pk, 100000), Decimal("5000.00"))
+
+    def test_rounding_never_passes_the_cap(self):
+        """Test that rounding up is done before the maximum, so the cap is never exceeded"""
+        DutyRule.objects.create(
+            state=self.bihar, article=self.sale, percentage=Decimal("5"),
+            maximum_duty=Decimal("25050"), rounding=DutyRule.Rounding.UP_HUNDRED,
+        )
+        self.assertEqual(quote(self.bihar.pk, self.sale.pk, 10 ** 6), Decimal("25050.00"))
+        self.assertEqual(quote(self.bihar.pk, self.sale.pk, 100010), Decimal("5100.00"))
+
+    def test_all_india_rule_and_invalidation(self):
+        """Test that an all-India rule overrides the article fields and edits are picked up at once"""
+        rule = DutyRule.objects.create(article=self.sale, percentage=Decimal("3"), rounding=DutyRule.Rounding.PAISE)
+        self.assertEqual(quote(self.kerala.pk, self.sale.pk, "333.33"), Decimal("10.00"))
+        rule.percentage = Decimal("4")
+        rule.save()
+        self.assertEqual(quote(self.kerala.pk, self.sale.pk, "333.33"), Decimal("13.33"))
+        rule.delete()
+        self.assertEqual(quote(self.kerala.pk, self.sale.pk, "333.33"), Decimal("17.00"))
+
+    def test_cached_table_costs_no_rule_queries(self):
+        """Test that repeat quotes are served from the compiled table"""
+        quote(self.goa.pk, self.sale.pk, 100)
+        with self.assertNumQueries(1):  # the version lookup in the shared cache
+            self.assertEqual(len(quote_many(self.goa.pk, self.sale.pk, range(5000))), 5000)
+
+    def test_bulk_quote_endpoint(self):
+        """Test that the bulk quote API prices values in order and rejects bad input"""
+        client = APIClient()
+        client.force_authenticate(user=get_user_model().objects.create_user(phone_number='+919876543210'))
+        response = client.post('/api/masters/duty/quote/', {'state_id': self.goa.pk, 'article_id': self.sale.pk, 'values': [100, "2,000"]}, format='json')
+        self.assertEqual(response.data, {'duties': ["5.00", "100.00"]})
+
+        for value in (-1, "1e30"):
+            response = client.post('/api/masters/duty/quote/', {'state_id': self.goa.pk, 'article_id': self.sale.pk, 'values': [value]}, format='json')
+            self.assertEqual(response.status_code, 400)
+        response = client.post('/api/masters/duty/quote/', {'state_id': self.goa.pk, 'article_id': self.affidavit.pk, 'values': [1]}, format='json')
+        self.assertEqual(response.status_code, 400)
 
-# Create your tests here.
+    def test_invalid_slabs_rejected_by_clean(self):
+        """Test that the admin form refuses slabs that do not increase"""
+        rule = DutyRule(article=self.sale, slabs=[{"upto": 100, "percentage": 1}, {"upto": 50, "percentage": 2}])
+        with self.assertRaises(ValidationError):
+            rule.clean()
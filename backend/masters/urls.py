@@ -1,11 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import StateViewSet, ArticleViewSet
+from .views import StateViewSet, ArticleViewSet, DutyQuoteView
 
 router = DefaultRouter()
 router.register(r'states', StateViewSet, basename='state')
 router.register(r'articles', ArticleViewSet, basename='article')
 
 urlpatterns = [
+    path('duty/quote/', DutyQuoteView.as_view(), name='duty-quote'),
     path('', include(router.urls)),
 ]
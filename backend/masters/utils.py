@@ -0,0 +1,44 @@
+import re
+
+from services.caching import LRUCache
+from services.versioning import get_versions
+from .models import State
+
+# Rebuilt when the masters.State version changes, which every State save or
+# delete bumps (masters.signals), so all processes see an edit within
+# CATALOG_VERSION_LOCAL_TTL seconds.
+VERSION_MODELS = ('masters.State',)
+
+_state_codes = LRUCache(maxsize=1)
+
+
+def _clean(value):
+    return re.sub(r'[^A-Z0-9]+', ' ', str(value).upper().replace('&', ' AND ')).strip()
+
+
+def state_codes():
+    """Maps cleaned state names and codes to State.code."""
+    versions = get_versions(VERSION_MODELS, local=True)
+    entry = _state_codes.get('codes')
+    if entry is None or entry[0] != versions:
+        codes = {}
+        for name, code in State.objects.values_list('name', 'code'):
+            codes[_clean(name)] = code.upper()
+            codes[_clean(code)] = code.upper()
+        entry = (versions, codes)
+        _state_codes.set('codes', entry)
+    return entry[1]
+
+
+def clear_state_codes():
+    _state_codes.clear()
+
+
+def normalize_state_key(value):
+    """
+    Canonical key for a free-text state: the masters.State code when the text names
+    a known state ('Bihar', 'bihar ', 'BR' -> 'BR'), otherwise an upper-cased slug
+    ('All India' -> 'ALL-INDIA').
+    """
+    cleaned = _clean(value)
+    return state_codes().get(cleaned) or cleaned.replace(' ', '-')
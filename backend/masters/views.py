@@ -1,18 +1,25 @@
-from rest_framework import viewsets, permissions
+from django.conf import settings
+from rest_framework import viewsets, permissions, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .duty import DutyRuleMissing, quote_many
 from .models import State, Article
 from .serializers import StateSerializer, ArticleSerializer
 from django.db.models import Q
+from services.versioning import ConditionalGetMixin
 
-class StateViewSet(viewsets.ReadOnlyModelViewSet):
+class StateViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = State.objects.filter(is_enabled=True)
     serializer_class = StateSerializer
     permission_classes = [permissions.AllowAny]
+    version_models = ('masters.State',)
 
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 
-class ArticleViewSet(viewsets.ReadOnlyModelViewSet):
+class ArticleViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = ArticleSerializer
     permission_classes = [permissions.AllowAny]
+    version_models = ('masters.Article', 'masters.State')
 
     @extend_schema(
         parameters=[
@@ -32,3 +39,26 @@ class ArticleViewSet(viewsets.ReadOnlyModelViewSet):
             queryset = queryset.filter(Q(is_all_states=True) | Q(states__id=state_id)).distinct()
             
         return queryset
+
+
+class DutyQuoteView(APIView):
+    """
+    Prices many consideration values for one (state, article) in a single call.
+    POST {"state_id", "article_id", "values": [...]} -> {"duties": [...]}, as
+    decimal strings in input order.
+    """
+
+    def post(self, request):
+        values = request.data.get('values')
+        limit = getattr(settings, 'DUTY_QUOTE_MAX_VALUES', 10000)
+        if not isinstance(values, list) or not values:
+            return Response({'values': 'Must be a non-empty list.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(values) > limit:
+            return Response({'values': f'At most {limit} values per call.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            duties = quote_many(request.data.get('state_id'), request.data.get('article_id'), values)
+        except DutyRuleMissing as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError as e:
+            return Response({'values': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'duties': [str(duty) for duty in duties]})
@@ -0,0 +1,30 @@
+from decimal import Decimal
+
+from django.conf import settings
+
+from masters.duty import quote
+from .models import DeliveryType
+
+
+def _money(value):
+    return Decimal(str(value)).quantize(Decimal('0.01'))
+
+
+def calculate_fees(state_id, article_id, consideration_price, delivery_type=DeliveryType.DIGITAL):
+    """
+    Fee breakdown for an order, as Decimals: stamp duty from the duty engine
+    (zero when no article is stamped), the service fee, and shipping for
+    physical delivery. Raises masters.duty.DutyRuleMissing or ValueError.
+    """
+    stamp_duty = quote(state_id, article_id, consideration_price or 0) if article_id else _money(0)
+    service_fee = _money(getattr(settings, 'ORDER_SERVICE_FEE', 50))
+    if delivery_type in (DeliveryType.PHYSICAL, DeliveryType.BOTH):
+        shipping_fee = _money(getattr(settings, 'ORDER_SHIPPING_FEE', 100))
+    else:
+        shipping_fee = _money(0)
+    return {
+        'stamp_duty': stamp_duty,
+        'service_fee': service_fee,
+        'shipping_fee': shipping_fee,
+        'total': stamp_duty + service_fee + shipping_fee,
+    }
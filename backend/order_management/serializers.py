@@ -1,5 +1,7 @@
 from rest_framework import serializers
+from masters.duty import DutyRuleMissing
 from masters.models import State, Article
+from .fees import calculate_fees
 from .models import Order, OrderParty, ShippingAddress, DeliveryType
 
 class StateSerializer(serializers.ModelSerializer):
@@ -38,7 +40,8 @@ class OrderSerializer(serializers.ModelSerializer):
             'stamp_amount', 'service_fee', 'shipping_fee', 'total_amount',
             'parties', 'shipping_address', 'created_at'
         ]
-        read_only_fields = ['order_number', 'status', 'total_amount', 'user', 'vendor']
+        # Fees always come from the duty engine (order_management.fees), never from the client
+        read_only_fields = ['order_number', 'status', 'stamp_amount', 'service_fee', 'shipping_fee', 'total_amount', 'user', 'vendor']
 
     def validate(self, data):
         delivery_type = data.get('delivery_type', DeliveryType.DIGITAL)
@@ -61,24 +64,22 @@ class OrderSerializer(serializers.ModelSerializer):
         parties_data = validated_data.pop('parties')
         shipping_data = validated_data.pop('shipping_address', None)
         
-        # Calculate fees (Basic logic for now)
-        # TODO: Move to a calculation service
-        validated_data['service_fee'] = 50  # Example fixed fee
-        if validated_data.get('delivery_type') in [DeliveryType.PHYSICAL, DeliveryType.BOTH]:
-            validated_data['shipping_fee'] = 100
-        else:
-            validated_data['shipping_fee'] = 0
-            
-        # Basic Stamp Duty Calc (Just passing through for now, typically user inputs or calc logic)
-        # Assuming frontend sends stamp_amount or we calc from consideration_price * article.rate
-        # For MVP, let's trust the input or set defaults. 
-        # Ideally, we should recalculate here.
-        
-        validated_data['total_amount'] = (
-            validated_data.get('stamp_amount', 0) + 
-            validated_data['service_fee'] + 
-            validated_data['shipping_fee']
-        )
+        state, article = validated_data.get('state'), validated_data.get('article')
+        try:
+            fees = calculate_fees(
+                state.pk if state else None,
+                article.pk if article else None,
+                validated_data.get('consideration_price', 0),
+                validated_data.get('delivery_type', DeliveryType.DIGITAL),
+            )
+        except DutyRuleMissing as e:
+            raise serializers.ValidationError({'article': str(e)})
+        except ValueError as e:
+            raise serializers.ValidationError({'consideration_price': str(e)})
+        validated_data['stamp_amount'] = fees['stamp_duty']
+        validated_data['service_fee'] = fees['service_fee']
+        validated_data['shipping_fee'] = fees['shipping_fee']
+        validated_data['total_amount'] = fees['total']
         
         order = Order.objects.create(**validated_data)
 
@@ -1,3 +1,59 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from masters.duty import clear_duty_table
+from masters.models import Article, DutyRule, State
+from .models import Order
+
+
+class OrderFeeTests(TestCase):
+    def setUp(self):
+        clear_duty_table()
+        self.addCleanup(clear_duty_table)
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(phone_number='+919876543210')
+        self.client.force_authenticate(user=self.user)
+        self.state = State.objects.create(name="BIHAR", code="BR")
+        self.article = Article.objects.create(code="ART-5", title="Agreement", is_all_states=True)
+        DutyRule.objects.create(state=self.state, article=self.article, percentage=Decimal("0.5"), minimum_duty=Decimal("100"))
+
+    def order_payload(self, **overrides):
+        payload = {
+            'service_type': 'ESTAMP', 'state': self.state.pk, 'article': self.article.pk,
+            'consideration_price': "250000.00", 'delivery_type': 'PHYSICAL',
+            'shipping_address': {'receiver_name': "Asha", 'contact_number': "9800000000", 'address_line': "Boring Road",
+                                 'pincode': "800001", 'city': "Patna", 'state': "Bihar"},
+            'parties': [{'party_type': 'FIRST_PARTY', 'name': "Asha", 'address': "Patna"}],
+        }
+        payload.update(overrides)
+        return payload
+
+    def test_calculate_fees_uses_duty_engine(self):
+        """Test that the fee quote comes from the DutyRule instead of a fixed amount"""
+        response = self.client.post('/api/orders/orders/calculate_fees/', {
+            'state_id': self.state.pk, 'article_id': self.article.pk, 'consideration_price': "250000", 'delivery_type': 'PHYSICAL',
+        }, format='json')
+        self.assertEqual(response.data, {'stamp_duty': "1250.00", 'service_fee': "50.00", 'shipping_fee': "100.00", 'total': "1400.00"})
+
+        response = self.client.post('/api/orders/orders/calculate_fees/', {
+            'state_id': self.state.pk, 'article_id': self.article.pk, 'consideration_price': "1e30",
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_order_ignores_client_stamp_amount(self):
+        """Test that order creation recomputes stamp duty and totals server-side"""
+        response = self.client.post('/api/orders/orders/', self.order_payload(stamp_amount="1.00", total_amount="1.00"), format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        order = Order.objects.get(pk=response.data['id'])
+        self.assertEqual(order.stamp_amount, Decimal("1250.00"))
+        self.assertEqual(order.total_amount, Decimal("1400.00"))
 
-# Create your tests here.
+    def test_unpriced_article_is_rejected(self):
+        """Test that an order for an article without a duty rule is refused rather than priced at zero"""
+        other = Article.objects.create(code="ART-6", title="Bond", is_all_states=True)
+        response = self.client.post('/api/orders/orders/', self.order_payload(article=other.pk), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
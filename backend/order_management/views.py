@@ -1,7 +1,9 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from masters.duty import DutyRuleMissing
 from masters.models import State, Article
+from .fees import calculate_fees
 from .models import Order
 from .serializers import StateSerializer, ArticleSerializer, OrderSerializer
 
@@ -30,20 +32,20 @@ class OrderViewSet(viewsets.ModelViewSet):
     def calculate_fees(self, request):
         """
         Helper endpoint to calculate stamp duty and fees before order creation.
+        Uses the same duty engine as order creation, so the quote is what will be charged.
         """
         amount = request.data.get('consideration_price', 0)
         article_id = request.data.get('article_id')
         state_id = request.data.get('state_id')
         delivery_type = request.data.get('delivery_type', 'DIGITAL')
-        
-        # TODO: Implement actual state-wise logic
-        stamp_duty = 100 # Dummy
-        service_fee = 50
-        shipping_fee = 100 if delivery_type != 'DIGITAL' else 0
-        
-        return Response({
-            'stamp_duty': stamp_duty,
-            'service_fee': service_fee,
-            'shipping_fee': shipping_fee,
-            'total': stamp_duty + service_fee + shipping_fee
-        })
+
+        if not article_id or not state_id:
+            return Response({'error': 'state_id and article_id are required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            fees = calculate_fees(state_id, article_id, amount, delivery_type)
+        except DutyRuleMissing as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError as e:
+            return Response({'consideration_price': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({key: str(value) for key, value in fees.items()})
@@ -0,0 +1,149 @@
+import re
+import unicodedata
+from decimal import Decimal, InvalidOperation
+
+from .uploads import as_stream
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # optional: pip install pypdf
+    PdfReader = None
+
+# SHCIL e-stamp certificate numbers, e.g. IN-DL12345678901234X; text layers often split them with spaces
+SHCIL_CERTIFICATE = re.compile(r'\bIN-?\s?([A-Z]{2})\s?(\d{14})\s?([A-Z])\b')
+# GRN / e-GRAS / e-Gram receipt numbers are printed after a label; the formats differ by state.
+GRN = re.compile(r'\bGRN\s*(?:NO|NUMBER)?\.?\s*[:\-]?\s*([A-Z0-9][A-Z0-9/-]{5,30})\b')
+NUMBER = re.compile(r'\d[\d,]*(?:\.\d+)?')
+
+# Printed labels for the expected_data fields the text layer can confirm, matched
+# at the start of a line and followed by an optional "(Rs.)", "." and ":"/"-".
+LABELS = {
+    'certificate_number': r'CERTIFICATE\s*NO',
+    'grn_number': r'GRN\s*(?:NO|NUMBER)?',
+    'stamp_duty_amount': r'STAMP\s*DUTY\s*AMOUNT',
+    'consideration_price': r'CONSIDERATION\s*PRICE',
+    'first_party': r'FIRST\s*PARTY',
+    'second_party': r'SECOND\s*PARTY',
+    'purpose': r'PURPOSE\s*OF\s*STAMP\s*DUTY\s*PAID',
+    'state': r'GOVERNMENT\s*OF',
+}
+LABELLED_LINE = {
+    key: re.compile(rf'^\s*{label}\b\s*(?:\(\s*RS\.?\s*\))?\s*\.?\s*[:\-]?\s*(\S.*?)\s*$')
+    for key, label in LABELS.items()
+}
+NUMBER_FIELDS = ('certificate_number', 'grn_number')
+AMOUNT_FIELDS = ('stamp_duty_amount', 'consideration_price')
+
+
+def extract_text(file_content, mime_type="application/pdf", max_pages=None):
+    """
+    The PDF's text layer, one string per page. `file_content` is bytes or a
+    binary stream. Empty for images, scans without a text layer, unreadable
+    files, or when pypdf is not installed.
+    """
+    if PdfReader is None or mime_type != "application/pdf":
+        return []
+    try:
+        reader = PdfReader(as_stream(file_content))
+        pages = reader.pages if max_pages is None else reader.pages[:max_pages]
+        return [page.extract_text() or '' for page in pages]
+    except Exception as e:
+        print(f"Text extraction failed: {e}")
+        return []
+
+
+def normalize(text):
+    """Uppercase, ASCII-folded, punctuation turned to spaces, whitespace collapsed."""
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode().upper()
+    return ' '.join(re.sub(r'[^A-Z0-9.]+', ' ', text).split())
+
+
+def compact(value):
+    return re.sub(r'[^A-Z0-9]', '', str(value).upper())
+
+
+def _as_decimal(value):
+    try:
+        return Decimal(str(value).replace(',', ''))
+    except InvalidOperation:
+        return None
+
+
+def labelled_values(text):
+    """{field: [values]} for every LABELS line in the text, in order of appearance."""
+    found = {}
+    for line in text.upper().splitlines():
+        for key, pattern in LABELLED_LINE.items():
+            match = pattern.match(line)
+            if match:
+                found.setdefault(key, []).append(match.group(1))
+    return found
+
+
+def labelled_value(key, values):
+    """The one value printed against a field's label, comparable to expected_data; None when absent or ambiguous."""
+    if key in NUMBER_FIELDS:
+        parsed = {compact(value) for value in values}
+    elif key in AMOUNT_FIELDS:
+        numbers = [NUMBER.search(value) for value in values]
+        if not all(numbers):
+            return None
+        parsed = {_as_decimal(number.group()) for number in numbers}
+    else:
+        parsed = {normalize(value) for value in values}
+    parsed.discard(None)
+    parsed.discard('')
+    return parsed.pop() if len(parsed) == 1 else None
+
+
+def expected_value(key, value):
+    if key in NUMBER_FIELDS:
+        return compact(value)
+    if key in AMOUNT_FIELDS:
+        return _as_decimal(value)
+    return normalize(value)
+
+
+def match_text(text, expected_data):
+    """
+    Checks expected_data against a certificate's text. Returns a result in the
+    same shape as the model's ({is_correct, differences, certificate_number,
+    grn_number}) when every expected value equals the value printed against
+    its own label and the expected certificate number is the certificate's
+    own, well-formed one; otherwise None, meaning "ask the model". Mismatches
+    are never decided here: a missing or repeated label may just be a layout
+    the extractor read differently.
+    """
+    if not expected_data.get('certificate_number'):
+        return None
+    labelled = labelled_values(text)
+    for key, value in expected_data.items():
+        if value in (None, ''):
+            continue
+        if key not in LABELS or isinstance(value, (dict, list)):
+            return None
+        printed = labelled_value(key, labelled.get(key, ()))
+        if printed is None or printed != expected_value(key, value):
+            return None
+
+    # Equal after compact(); it must also read as an SHCIL number before it is trusted.
+    if not SHCIL_CERTIFICATE.search(labelled['certificate_number'][0]):
+        return None
+
+    grn = labelled.get('grn_number')
+    return {
+        'is_correct': True,
+        'differences': [],
+        'certificate_number': expected_data['certificate_number'],
+        'grn_number': expected_data.get('grn_number') or (grn[0] if grn and len(set(grn)) == 1 else None),
+        'method': 'text-layer',
+    }
+
+
+def preverify(file_content, expected_data, mime_type="application/pdf"):
+    """match_text() over the PDF's text layer, or None when there is nothing to match."""
+    pages = extract_text(file_content, mime_type)
+    text = '\n'.join(pages)
+    if not text.strip():
+        return None
+    return match_text(text, expected_data)
@@ -0,0 +1,49 @@
+import gzip
+
+try:
+    import brotli
+except ImportError:  # optional: pip install brotli
+    brotli = None
+
+
+def gzip_bytes(data):
+    # mtime=0 keeps the output (and so any cached copy) identical for identical input
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def brotli_bytes(data):
+    """Brotli at maximum quality, or None when the brotli package is not installed."""
+    if brotli is None:
+        return None
+    return brotli.compress(data, quality=11)
+
+
+def parse_accept_encoding(header):
+    """{coding: q} from an Accept-Encoding header."""
+    codings = {}
+    for item in (header or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding.strip().lower()] = q
+    return codings
+
+
+def pick_encoding(header, available):
+    """
+    The first coding in `available` (in preference order) that the client
+    accepts, or None for identity.
+    """
+    accepted = parse_accept_encoding(header)
+    for coding in available:
+        if accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return None
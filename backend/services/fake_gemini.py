@@ -0,0 +1,216 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROUTE = re.compile(r'^/(?P<version>[^/]+)/models/(?P<model>[^:/]+):(?P<method>generateContent|streamGenerateContent)$')
+
+CANNED_TEMPLATE = {
+    "html_content": "<h1>Sample Agreement</h1><p>This agreement is made between {{first_party_name}} and {{second_party_name}}.</p>",
+    "form_schema": [
+        {"key": "first_party_name", "label": "First Party Name", "type": "text", "placeholder": "Full name"},
+        {"key": "second_party_name", "label": "Second Party Name", "type": "text", "placeholder": "Full name"},
+    ],
+}
+
+CANNED_VERIFICATION = {
+    "is_correct": True,
+    "differences": [],
+    "certificate_number": "IN-DL00000000000000X",
+    "grn_number": "0000000000",
+}
+
+
+def request_key(model, body):
+    """Replay key: the model plus the canonical JSON request body."""
+    canonical = json.dumps({'model': model, 'body': body}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def response_body(text, model, prompt_tokens=0):
+    return {
+        "candidates": [{
+            "content": {"parts": [{"text": text}], "role": "model"},
+            "finishReason": "STOP",
+            "index": 0,
+        }],
+        "usageMetadata": {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": max(1, len(text) // 4),
+            "totalTokenCount": prompt_tokens + max(1, len(text) // 4),
+        },
+        "modelVersion": model,
+    }
+
+
+class Cassette:
+    """JSON-lines file of recorded (request key -> upstream response body) pairs."""
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry['key']] = entry['response']
+        except FileNotFoundError:
+            pass
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def record(self, key, model, request, response):
+        with self._lock:
+            self._entries[key] = response
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'key': key, 'model': model, 'request': request, 'response': response}) + '\n')
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FakeGeminiServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the Gemini generateContent / streamGenerateContent
+    endpoints, for load tests that must not spend API quota.
+
+    Responses come from the cassette when the request was recorded, otherwise
+    from canned template/verification JSON. With `upstream` set, cassette misses
+    are forwarded to the real API and recorded. `latency` +/- `jitter` seconds
+    are added per call and `error_rate` of calls fail with a 503.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, jitter=0.0, error_rate=0.0,
+                 cassette=None, upstream=None, stream_chunks=8):
+        super().__init__(address, FakeGeminiHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.cassette = Cassette(cassette) if cassette else None
+        self.upstream = upstream.rstrip('/') if upstream else None
+        self.stream_chunks = stream_chunks
+        self.stats = {'requests': 0, 'replayed': 0, 'recorded': 0, 'canned': 0, 'errors': 0}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def delay(self):
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def start_in_thread(self):
+        thread = threading.Thread(target=self.serve_forever, name='fake-gemini', daemon=True)
+        thread.start()
+        return thread
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    server: FakeGeminiServer
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        path = self.path.partition('?')[0]
+        match = ROUTE.match(path)
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        if not match:
+            return self._send_json(404, {"error": {"code": 404, "message": f"Unknown route {path}", "status": "NOT_FOUND"}})
+
+        server = self.server
+        server.count('requests')
+        model, method = match['model'], match['method']
+        delay = server.delay()
+        streaming = method == 'streamGenerateContent'
+        # Unary calls wait the full latency; streams get a short time-to-first-chunk and spread the rest.
+        time.sleep(delay * 0.1 if streaming else delay)
+
+        if server.error_rate and random.random() < server.error_rate:
+            server.count('errors')
+            return self._send_json(503, {"error": {"code": 503, "message": "Injected failure", "status": "UNAVAILABLE"}})
+
+        key = request_key(model, body)
+        response = server.cassette.get(key) if server.cassette is not None else None
+        if response is not None:
+            server.count('replayed')
+        elif server.upstream:
+            status, response = self._forward(match['version'], model, body)
+            if status != 200:
+                return self._send_json(status, response)
+            if server.cassette is not None:
+                server.cassette.record(key, model, body, response)
+            server.count('recorded')
+        else:
+            server.count('canned')
+            response = response_body(json.dumps(self._canned(body)), model, prompt_tokens=len(json.dumps(body)) // 4)
+
+        if streaming:
+            return self._send_stream(response, delay * 0.9)
+        return self._send_json(200, response)
+
+    def _canned(self, body):
+        parts = [part for content in body.get('contents', []) for part in content.get('parts', [])]
+        if any('inlineData' in part or 'inline_data' in part or 'fileData' in part for part in parts):
+            return CANNED_VERIFICATION
+        return CANNED_TEMPLATE
+
+    def _forward(self, version, model, body):
+        # Always record the unary response, even for stream calls, so either method can replay it.
+        request = urllib.request.Request(
+            f"{self.server.upstream}/{version}/models/{model}:generateContent",
+            data=json.dumps(body).encode('utf-8'),
+            headers={'Content-Type': 'application/json', 'x-goog-api-key': self.headers.get('x-goog-api-key', '')},
+            method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=300) as upstream:
+                return upstream.status, json.loads(upstream.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read() or b'{}')
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, response, spread):
+        text = ''.join(part.get('text', '') for part in response['candidates'][0]['content']['parts'])
+        size = max(1, -(-len(text) // self.server.stream_chunks))
+        chunks = [text[i:i + size] for i in range(0, len(text), size)] or ['']
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i, chunk in enumerate(chunks):
+            event = response_body(chunk, response.get('modelVersion', ''))
+            if i == len(chunks) - 1:
+                event['usageMetadata'] = response.get('usageMetadata', event['usageMetadata'])
+            else:
+                event['candidates'][0].pop('finishReason')
+            data = f"data: {json.dumps(event)}\r\n\r\n".encode('utf-8')
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+            if i < len(chunks) - 1:
+                time.sleep(spread / len(chunks))
+        self.wfile.write(b"0\r\n\r\n")
@@ -1,9 +1,30 @@
 import os
 import json
-from google import genai
+from dataclasses import dataclass
+
+from asgiref.sync import sync_to_async
 from google.genai import types
 from django.conf import settings
-from documents.models import Prompt, PromptType
+from documents.models import PromptType
+from .gemini_client import get_async_client, get_client
+from .llm_cache import get_response_cache, make_key, namespace_for
+from .metrics import record_event, track_call
+from .resilience import gemini, is_upstream_failure, stale_response, with_timeout
+from .prompts import prompt_registry
+
+@dataclass
+class TemplateRequest:
+    model: str
+    contents: str
+    config: types.GenerateContentConfig
+    prompt_version: int | None
+    namespace: str
+    cache_key: str
+    subject: str
+    # Set by stream_template() when it served a stale cached answer (and that answer's prompt version)
+    stale: bool = False
+    stale_version: int | None = None
+
 
 class GeminiService:
     def __init__(self):
@@ -12,61 +33,156 @@ class GeminiService:
         if not self.api_key:
             print("Warning: GEMINI_API_KEY not found in settings.")
         else:
-            # Configure the client with the API key
+            # Shared, pooled client (see services.gemini_client)
              try:
-                self.client = genai.Client(api_key=self.api_key)
+                self.client = get_client()
              except Exception as e:
                 print(f"Error configuring Gemini client: {e}")
 
-    def generate_template(self, document_type, state):
-        """
-        Generates a legal document template (HTML + JSON Schema) using Gemini.
-        Uses the active 'GENERATE_DOCUMENT' prompt from DB if available.
-        """
-        if not self.api_key:
-            return None
-
-        # Fetch Active Prompt from DB
-        try:
-            prompt_obj = Prompt.objects.get(
-                prompt_type=PromptType.GENERATE_DOCUMENT, 
-                is_active=True
-            )
+    def template_request(self, document_type, state):
+        """Resolves the prompt, model config and response-cache key for a template generation."""
+        # Active prompt from the registry (cached, pre-parsed; DB only on a miss)
+        prompt = prompt_registry.get(PromptType.GENERATE_DOCUMENT)
+        if prompt:
             # Use specific system_instruction if available, else fallback (empty string)
-            system_instruction = prompt_obj.system_instruction
+            system_instruction = prompt.system_instruction
             
             # Construct User Prompt (Inputs + Output Format)
             # We treat input_format + output_format as the "User Message"
-            user_content = prompt_obj.construct_prompt(document_type=document_type, state=state)
-            
-            print("System Instruction:", system_instruction)
-            print("User Content:", user_content)
-
-        except Prompt.DoesNotExist:
+            user_content = prompt.render(document_type=document_type, state=state)
+            prompt_version = prompt.version
+        else:
             print("Warning: Active prompt for GENERATE_DOCUMENT not found. Using fallback.")
             # Fallback
             system_instruction = "You are an expert lawyer for Indian Law. Prioritize accuracy."
             user_content = f"Create a '{document_type}' template for '{state}'. Return JSON with html_content and form_schema."
+            prompt_version = None
+
+        # Configure the model
+        config = types.GenerateContentConfig(
+            system_instruction=system_instruction,
+            temperature=0.0,
+            response_mime_type="application/json"
+        )
+        model = getattr(settings, 'GEMINI_MODEL', 'gemini-2.0-flash')
+
+        # temperature=0.0: identical requests give identical answers, so they can be replayed from the cache
+        return TemplateRequest(
+            model=model,
+            contents=user_content,
+            config=config,
+            prompt_version=prompt_version,
+            namespace=namespace_for(PromptType.GENERATE_DOCUMENT, prompt_version),
+            cache_key=make_key(model, system_instruction, user_content, config.model_dump(mode='json', exclude_none=True)),
+            subject=f"{document_type}:{state}",
+        )
+
+    def generate_template(self, document_type, state):
+        """
+        Generates a legal document template (HTML + JSON Schema) using Gemini.
+        Uses the active 'GENERATE_DOCUMENT' prompt from DB if available.
+        The returned dict carries the 'prompt_version' it was generated with.
+        While Gemini is failing (or the circuit is open) the newest cached
+        answer for the same document type and state is returned instead,
+        under any prompt version, with 'stale': True.
+        """
+        if not self.api_key:
+            return None
 
         try:
-            # Configure the model
-            config = types.GenerateContentConfig(
-                system_instruction=system_instruction,
-                temperature=0.0,
-                response_mime_type="application/json"
-            )
+            req = self.template_request(document_type, state)
+            cache = get_response_cache()
+            result_text = cache.get(req.namespace, req.cache_key) if cache else None
 
-            response = self.client.models.generate_content(
-                model='gemini-2.0-flash', 
-                contents=user_content,
-                config=config
-            )
-            
-            result_text = response.text
-            print("AI Response:", result_text)
-            
-            return json.loads(result_text)
+            if result_text is None:
+                try:
+                    with track_call(PromptType.GENERATE_DOCUMENT, req.prompt_version, req.model, subject=req.subject) as call:
+                        response = gemini.call(
+                            lambda timeout: self.client.models.generate_content(
+                                model=req.model,
+                                contents=req.contents,
+                                config=with_timeout(req.config, timeout)
+                            ),
+                            call
+                        )
+                        call.response(response)
+                        result_text = response.text
+                        result = json.loads(result_text)
+                except Exception as e:
+                    stale = stale_response(cache, req.subject, f"{PromptType.GENERATE_DOCUMENT}:") if is_upstream_failure(e) else None
+                    if stale is None:
+                        raise
+                    print(f"Gemini unavailable ({e}); serving stale template for {req.subject}")
+                    record_event(PromptType.GENERATE_DOCUMENT, stale[1], req.model, 'stale', subject=req.subject)
+                    result = json.loads(stale[0])
+                    result.update(prompt_version=stale[1], stale=True)
+                    return result
+                if cache:
+                    cache.set(req.namespace, req.cache_key, result_text, subject=req.subject)
+            else:
+                record_event(PromptType.GENERATE_DOCUMENT, req.prompt_version, req.model, 'cache_hit', subject=req.subject)
+                result = json.loads(result_text)
+
+            result['prompt_version'] = req.prompt_version
+            return result
             
         except Exception as e:
             print(f"Gemini Generation Error: {e}")
             return None
+
+    async def stream_template(self, req):
+        """
+        Async variant of generate_template for a TemplateRequest (see
+        template_request): yields the raw JSON text as the model produces it.
+        Cached responses are yielded in one piece, as is a stale one when the
+        stream cannot be opened because Gemini is failing (req.stale is then
+        set). Errors are raised to the caller.
+        """
+        cache = get_response_cache()
+        cached = await sync_to_async(cache.get)(req.namespace, req.cache_key) if cache else None
+        if cached is not None:
+            record_event(PromptType.GENERATE_DOCUMENT, req.prompt_version, req.model, 'cache_hit', subject=req.subject, stream=True)
+            yield cached.decode('utf-8')
+            return
+
+        client = get_async_client()  # bound to this event loop (see services.gemini_client)
+        parts = []
+        with track_call(PromptType.GENERATE_DOCUMENT, req.prompt_version, req.model, subject=req.subject, stream=True) as call:
+            try:
+                # Retries only cover opening the stream; once text has been yielded a failure is final.
+                stream = await gemini.acall(
+                    lambda timeout: client.models.generate_content_stream(
+                        model=req.model,
+                        contents=req.contents,
+                        config=with_timeout(req.config, timeout)
+                    ),
+                    call
+                )
+            except Exception as e:
+                stale = await sync_to_async(stale_response)(cache, req.subject, f"{PromptType.GENERATE_DOCUMENT}:") if is_upstream_failure(e) else None
+                if stale is None:
+                    raise
+                print(f"Gemini unavailable ({e}); serving stale template for {req.subject}")
+                call.fail(e)
+                record_event(PromptType.GENERATE_DOCUMENT, stale[1], req.model, 'stale', subject=req.subject, stream=True)
+                req.stale, req.stale_version = True, stale[1]
+                yield stale[0].decode('utf-8')
+                return
+
+            error = None
+            try:
+                async for chunk in stream:
+                    call.response(chunk)
+                    if chunk.text:
+                        parts.append(chunk.text)
+                        yield chunk.text
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                gemini.finish(error if isinstance(error, Exception) else None)
+
+            result_text = ''.join(parts)
+            json.loads(result_text)  # only cache complete, valid responses
+        if cache:
+            await sync_to_async(cache.set)(req.namespace, req.cache_key, result_text, subject=req.subject)
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import threading
+import weakref
+
+import httpx
+from google import genai
+from google.genai import types
+from django.conf import settings
+
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> AsyncClient
+
+
+def _reset_after_fork():
+    # The child must not reuse the parent's sockets (gunicorn --preload); it
+    # builds its own pool on first use. The parent's client is left untouched.
+    global _client, _client_pid, _lock, _async_clients
+    _client = None
+    _client_pid = None
+    _lock = threading.Lock()
+    _async_clients = weakref.WeakKeyDictionary()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _http_options():
+    pool_size = getattr(settings, 'GEMINI_POOL_SIZE', 10)
+    limits = httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=getattr(settings, 'GEMINI_KEEPALIVE_EXPIRY', 60),
+    )
+    options = {
+        'timeout': int(getattr(settings, 'GEMINI_TIMEOUT', 60) * 1000),  # SDK expects milliseconds
+        'client_args': {'limits': limits},
+        'async_client_args': {'limits': limits},
+    }
+    base_url = getattr(settings, 'GEMINI_BASE_URL', None)
+    if base_url:
+        options['base_url'] = base_url
+    return types.HttpOptions(**options)
+
+
+def get_client():
+    """
+    Process-wide Gemini client with a keep-alive connection pool, created on
+    first use. Returns None when no API key is configured.
+    """
+    global _client, _client_pid
+    api_key = getattr(settings, 'GEMINI_API_KEY', None)
+    if not api_key:
+        return None
+
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+
+    with _lock:
+        if _client is None or _client_pid != pid:
+            _client = genai.Client(api_key=api_key, http_options=_http_options())
+            _client_pid = pid
+    return _client
+
+
+def get_async_client():
+    """
+    Async Gemini client (the SDK's `client.aio`) for the running event loop,
+    or None without an API key. An async connection pool only works on the
+    loop that opened it: under ASGI there is one loop per process, so this is
+    pooled like get_client(); under WSGI every async view runs in a new loop
+    and gets a client of its own, dropped with the loop.
+    """
+    api_key = getattr(settings, 'GEMINI_API_KEY', None)
+    if not api_key:
+        return None
+
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            client = _async_clients[loop] = genai.Client(api_key=api_key, http_options=_http_options()).aio
+    return client
+
+
+def reset_client():
+    """Drops the shared clients so the next call picks up new settings."""
+    global _client, _client_pid
+    with _lock:
+        _client = None
+        _client_pid = None
+        _async_clients.clear()
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    subject TEXT,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+CREATE INDEX IF NOT EXISTS responses_subject ON responses (subject, created_at);
+"""
+
+
+def make_key(*parts):
+    """SHA-256 over the canonical JSON of the request parts (model, prompt, config...)."""
+    canonical = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent, content-addressed cache for deterministic model responses,
+    stored in SQLite so it survives restarts and is shared by every process on
+    the host. Entries live in namespaces (e.g. 'GENERATE_DOCUMENT:v12' per
+    prompt version) and the least recently used ones are evicted once the
+    stored values exceed `max_bytes`.
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, namespace, key):
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT value FROM responses WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE responses SET last_used = ? WHERE namespace = ? AND key = ?", (time.time(), namespace, key)
+        )
+        return row[0]
+
+    def set(self, namespace, key, value, subject=None):
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (namespace, key, subject, value, size, created_at, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (namespace, key, subject, value, len(value), now, now)
+        )
+        self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Trim to 90% so we do not evict on every subsequent write.
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        doomed = []
+        for namespace, key, size in conn.execute("SELECT namespace, key, size FROM responses ORDER BY last_used"):
+            doomed.append((namespace, key))
+            freed += size
+            if freed >= target:
+                break
+        conn.executemany("DELETE FROM responses WHERE namespace = ? AND key = ?", doomed)
+
+    def latest(self, subject, namespace_prefix=''):
+        """(namespace, value) of the newest entry for `subject` in any matching namespace, or None."""
+        return self._conn().execute(
+            "SELECT namespace, value FROM responses WHERE subject = ? AND substr(namespace, 1, ?) = ? "
+            "ORDER BY created_at DESC LIMIT 1",
+            (subject, len(namespace_prefix), namespace_prefix)
+        ).fetchone()
+
+    def delete_namespace(self, namespace):
+        self._conn().execute("DELETE FROM responses WHERE namespace = ?", (namespace,))
+
+    def stats(self):
+        count, size = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {'entries': count, 'bytes': size, 'max_bytes': self.max_bytes}
+
+    def clear(self):
+        self._conn().execute("DELETE FROM responses")
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_response_cache(name='default'):
+    """
+    The ResponseCache configured under settings.LLM_CACHES[name], or None when
+    caching is disabled.
+    """
+    config = getattr(settings, 'LLM_CACHES', {}).get(name)
+    if not config or not config.get('ENABLED', True):
+        return None
+    path = str(config['PATH'])
+    cache = _caches.get((name, path))
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.setdefault((name, path), ResponseCache(path, config.get('MAX_BYTES', 256 * 1024 * 1024)))
+    return cache
+
+
+def namespace_for(prompt_type, prompt_version):
+    return f"{prompt_type}:v{prompt_version or 'fallback'}"
@@ -0,0 +1,480 @@
+import asyncio
+import atexit
+import bisect
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework import permissions
+from rest_framework.views import APIView
+
+call_log = logging.getLogger('llm.calls')
+
+# Seconds; model calls range from sub-second cache-warm answers to minute-long generations
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_label_value(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels[name]) for name in self.labels), 0)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(total, values):
+        for key, value in values.items():
+            total[key] = total.get(key, 0) + value
+
+    def expose(self, values=None):
+        """Exposition lines for `values` (a merged snapshot), this process's own by default."""
+        values = self.snapshot() if values is None else values
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense; quantiles are computed by the scraper."""
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            entry[index] += 1
+            entry[-1] += value
+
+    def count(self, **labels):
+        entry = self._values.get(tuple(str(labels[name]) for name in self.labels))
+        return sum(entry[:-1]) if entry else 0
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {key: list(entry) for key, entry in self._values.items()}
+
+    @staticmethod
+    def merge(total, values):
+        for key, entry in values.items():
+            if key in total:
+                total[key] = [a + b for a, b in zip(total[key], entry)]
+            else:
+                total[key] = list(entry)
+
+    def expose(self, values=None):
+        """Exposition lines for `values` (a merged snapshot), this process's own by default."""
+        values = self.snapshot() if values is None else values
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, entry in sorted(values.items()):
+            running = 0
+            for bound, count in zip(self.buckets + ('+Inf',), entry[:-1]):
+                running += count
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, [('le', bound)])} {running}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {entry[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {running}")
+        return lines
+
+
+CALL_LABELS = ('prompt_type', 'prompt_version', 'model')
+
+llm_requests = Counter(
+    'llm_requests_total', 'LLM requests by outcome (ok, error, cancelled, cache_hit, text_layer, stale).', CALL_LABELS + ('outcome',)
+)
+llm_duration = Histogram(
+    'llm_request_duration_seconds', 'Wall time of model calls, including retries.', CALL_LABELS + ('outcome',)
+)
+llm_tokens = Counter(
+    'llm_tokens_total', 'Tokens reported in response usage metadata.', CALL_LABELS + ('direction',)
+)
+llm_retries = Counter('llm_retries_total', 'Model call attempts after the first.', CALL_LABELS)
+llm_errors = Counter('llm_errors_total', 'Failed model calls by exception type.', CALL_LABELS + ('error',))
+
+REGISTRY = [llm_requests, llm_duration, llm_tokens, llm_retries, llm_errors]
+MERGE = {metric.name: metric.merge for metric in REGISTRY}
+
+# Every process writes its values to a file of its own in LLM_METRICS_DIR and a
+# scrape sums the files, so any worker answers for all of them (the same scheme
+# as prometheus_client's multiprocess mode). Recording only marks the values
+# changed; a background thread writes them at most once per
+# LLM_METRICS_PUBLISH_INTERVAL seconds, and a scrape writes its own process's
+# first. Files of exited processes are folded into EXITED_FILE so counters
+# never go backwards and the directory holds one file per live worker.
+EXITED_FILE = 'exited.json'
+LOCK_FILE = 'collect.lock'
+LOCK_TIMEOUT = 10  # seconds; a crashed scrape blocks folding at most this long
+LOCK_ATTEMPTS = 50
+LOCK_POLL = 0.01
+
+_process_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+_publish_lock = threading.Lock()
+_dirty = threading.Event()
+_publisher = None
+
+
+def _reset_after_fork():
+    # A forked worker (gunicorn --preload) writes its own file and starts from
+    # zero; what the parent recorded stays in the parent's file. The parent's
+    # publisher thread does not exist in the child.
+    global _process_id, _publish_lock, _dirty, _publisher
+    _process_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    _publish_lock = threading.Lock()
+    _dirty = threading.Event()
+    _publisher = None
+    for metric in REGISTRY:
+        metric._lock = threading.Lock()
+        metric._values = {}
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _directory():
+    directory = getattr(settings, 'LLM_METRICS_DIR', None)
+    return str(directory) if directory else None
+
+
+def _process_file(directory):
+    return os.path.join(directory, f"{_process_id}.json")
+
+
+def _read(path):
+    """{metric name: {label values: value}} from a metrics file."""
+    with open(path) as f:
+        snapshot = json.load(f)
+    return {name: {tuple(key): value for key, value in entries} for name, entries in snapshot.items()}
+
+
+def _write(path, values):
+    # Replaced atomically, so readers never see half a file.
+    snapshot = {name: [[list(key), value] for key, value in entries.items()] for name, entries in values.items()}
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(snapshot, f, separators=(',', ':'))
+    os.replace(f"{path}.tmp", path)
+
+
+def write_snapshot():
+    """Writes this process's values to its file now. Failures are printed, never raised."""
+    directory = _directory()
+    if directory is None:
+        return
+    try:
+        with _publish_lock:
+            os.makedirs(directory, exist_ok=True)
+            _write(_process_file(directory), {metric.name: metric.snapshot() for metric in REGISTRY})
+    except OSError as e:
+        print(f"Could not publish metrics to {directory}: {e}")
+
+
+def _publish_forever():
+    while True:
+        _dirty.wait()
+        time.sleep(getattr(settings, 'LLM_METRICS_PUBLISH_INTERVAL', 1))
+        _dirty.clear()
+        write_snapshot()
+
+
+def publish():
+    """
+    Marks this process's values changed. The file is written by a background
+    thread (batching everything recorded in the meantime), so model calls and
+    cache hits never wait on the disk. Without LLM_METRICS_DIR metrics stay per
+    process and nothing is written.
+    """
+    global _publisher
+    if _directory() is None:
+        return
+    _dirty.set()
+    if _publisher is None:
+        with _publish_lock:
+            if _publisher is None:
+                _publisher = threading.Thread(target=_publish_forever, name='metrics-publisher', daemon=True)
+                _publisher.start()
+
+
+@atexit.register
+def _publish_at_exit():
+    if _dirty.is_set():
+        write_snapshot()
+
+
+def _has_exited(name):
+    """True for the file of a process on this host that is no longer running."""
+    parts = name[:-len('.json')].rsplit('-', 2)
+    if os.name != 'posix' or len(parts) != 3 or parts[0] != socket.gethostname() or not parts[1].isdigit():
+        return False
+    pid = int(parts[1])
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass  # running, as another user
+    return False
+
+
+def _fold_exited(directory, names):
+    """Merges the files of exited processes into EXITED_FILE and removes them; returns the names left."""
+    exited = [name for name in names if _has_exited(name)]
+    if not exited:
+        return names
+    path = os.path.join(directory, EXITED_FILE)
+    totals = _read(path) if EXITED_FILE in names else {}
+    folded = []
+    for name in exited:
+        try:
+            values = _read(os.path.join(directory, name))
+        except (OSError, ValueError) as e:
+            print(f"Not folding metrics file {name}: {e}")
+            continue
+        for metric, entries in values.items():
+            MERGE[metric](totals.setdefault(metric, {}), entries)
+        folded.append(name)
+    if not folded:
+        return names
+    _write(path, totals)
+    for name in folded:
+        os.remove(os.path.join(directory, name))
+    return sorted(set(names) - set(folded) | {EXITED_FILE})
+
+
+@contextmanager
+def _collect_lock(directory):
+    """
+    Serialises scrapes over the directory (a lock file, so across processes):
+    one scrape folding files while another reads them could count a process
+    twice. Yields False when the lock could not be had; the scrape then reads
+    without folding.
+    """
+    path = os.path.join(directory, LOCK_FILE)
+    for _ in range(LOCK_ATTEMPTS):
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > LOCK_TIMEOUT:
+                    os.remove(path)  # left by a crashed scrape
+                    continue
+            except OSError:
+                pass
+            time.sleep(LOCK_POLL)
+    else:
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        os.remove(path)
+
+
+def collect():
+    """{metric name: {label values: value}} summed over every process's file (just this process without LLM_METRICS_DIR)."""
+    directory = _directory()
+    if directory is None:
+        return {metric.name: metric.snapshot() for metric in REGISTRY}
+    write_snapshot()
+    totals = {metric.name: {} for metric in REGISTRY}
+    try:
+        with _collect_lock(directory) as locked:
+            names = sorted(name for name in os.listdir(directory) if name.endswith('.json'))
+            if locked:
+                names = _fold_exited(directory, names)
+            for name in names:
+                try:
+                    values = _read(os.path.join(directory, name))
+                except (OSError, ValueError) as e:
+                    print(f"Skipping metrics file {name}: {e}")
+                    continue
+                for metric in REGISTRY:
+                    metric.merge(totals[metric.name], values.get(metric.name, {}))
+    except (OSError, ValueError) as e:
+        print(f"Could not read metrics from {directory}: {e}")
+    return totals
+
+
+def expose():
+    """Every metric, summed over all worker processes, in the Prometheus text exposition format."""
+    totals = collect()
+    return '\n'.join(line for metric in REGISTRY for line in metric.expose(totals[metric.name])) + '\n'
+
+
+def reset():
+    """Clears this process's values and removes its file."""
+    _dirty.clear()
+    for metric in REGISTRY:
+        metric.reset()
+    directory = _directory()
+    if directory is not None:
+        try:
+            os.remove(_process_file(directory))
+        except FileNotFoundError:
+            pass
+
+
+def usage_tokens(usage):
+    """{direction: count} from a response's usage_metadata (missing fields are skipped)."""
+    if usage is None:
+        return {}
+    fields = {
+        'input': 'prompt_token_count',
+        'output': 'candidates_token_count',
+        'thinking': 'thoughts_token_count',
+        'cached': 'cached_content_token_count',
+    }
+    tokens = {}
+    for direction, field in fields.items():
+        value = getattr(usage, field, None)
+        if isinstance(value, int):
+            tokens[direction] = value
+    return tokens
+
+
+def _log(event):
+    if getattr(settings, 'LLM_CALL_LOG', True):
+        call_log.info(json.dumps(event, default=str, separators=(',', ':')))
+
+
+def record_event(prompt_type, prompt_version, model, outcome, **fields):
+    """An answer that did not need the model (cache_hit, text_layer): counted and logged, not timed."""
+    labels = {'prompt_type': prompt_type, 'prompt_version': prompt_version or 'none', 'model': model}
+    llm_requests.inc(outcome=outcome, **labels)
+    publish()
+    _log({'event': 'llm_call', 'outcome': outcome, **labels, **fields})
+
+
+class CallTracker:
+    """
+    One model call, from track_call(). Feed it the response (or every stream
+    chunk) with response(), and count extra attempts with retry(); duration,
+    tokens and outcome are recorded when the `with` block exits. An exception
+    leaving the block marks the call as an error and is re-raised.
+    """
+
+    def __init__(self, prompt_type, prompt_version, model, **fields):
+        self.labels = {'prompt_type': prompt_type, 'prompt_version': prompt_version or 'none', 'model': model}
+        self.fields = fields
+        self.usage = None
+        self.retries = 0
+        self.outcome = 'ok'
+        self.error = None
+
+    def response(self, response):
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is not None:
+            self.usage = usage  # streams report the running total; the last chunk wins
+
+    def retry(self):
+        self.retries += 1
+        llm_retries.inc(**self.labels)
+
+    def start(self):
+        """Restarts the clock at the model request, so preparation (e.g. a file upload) is not timed."""
+        self.started = time.perf_counter()
+
+    def fail(self, error):
+        """Marks the call failed without an exception (e.g. an unparseable answer)."""
+        self.outcome = 'error'
+        self.error = error if isinstance(error, str) else type(error).__name__
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        if exc_type in (GeneratorExit, asyncio.CancelledError):
+            self.outcome = 'cancelled'  # the client went away mid-stream
+        elif exc_type is not None:
+            self.fail(exc)
+        tokens = usage_tokens(self.usage)
+
+        llm_requests.inc(outcome=self.outcome, **self.labels)
+        llm_duration.observe(elapsed, outcome=self.outcome, **self.labels)
+        for direction, count in tokens.items():
+            llm_tokens.inc(count, direction=direction, **self.labels)
+        if self.error:
+            llm_errors.inc(error=self.error, **self.labels)
+        publish()
+
+        _log({
+            'event': 'llm_call', 'outcome': self.outcome, **self.labels,
+            'duration_ms': round(elapsed * 1000, 1), 'tokens': tokens,
+            'retries': self.retries, 'error': self.error, **self.fields,
+        })
+        return False
+
+
+def track_call(prompt_type, prompt_version, model, **fields):
+    """
+    Instruments one model call:
+
+        with track_call(PromptType.VERIFY_DOCUMENT, version, model) as call:
+            response = client.models.generate_content(...)
+            call.response(response)
+
+    Call call.start() right before the model request when the block does other
+    work first. Each process writes its values to LLM_METRICS_DIR, so a scrape
+    of any worker covers all of them. `fields` are added to the structured log
+    line only.
+    """
+    return CallTracker(prompt_type, prompt_version, model, **fields)
+
+
+class MetricsView(APIView):
+    """Prometheus scrape target for the LLM metrics of every worker process (staff only)."""
+
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,106 @@
+import hashlib
+import io
+import re
+
+from django.conf import settings
+
+from .caching import LRUCache
+from .certificates import GRN, SHCIL_CERTIFICATE
+from .uploads import as_stream, stream_size
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # optional: pip install pypdf
+    PdfReader = PdfWriter = None
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional: pip install Pillow
+    Image = ImageOps = None
+
+KEYWORDS = re.compile(r'E-?STAMP|STAMP DUTY|CERTIFICATE|NON.?JUDICIAL')
+
+# Reduced payloads by (sha256, mime type). Only entries that actually shrank are kept.
+_reduced = LRUCache(maxsize=getattr(settings, 'VERIFICATION_PAYLOAD_CACHE_SIZE', 32))
+
+
+def relevant_pages(pages, limit):
+    """
+    Indexes (in document order) of up to `limit` pages that look like the
+    certificate: a certificate number counts most, then a GRN, then stamp
+    keywords. Empty when no page has a text layer match.
+    """
+    scored = []
+    for index, text in enumerate(pages):
+        upper = (text or '').upper()
+        score = 4 * bool(SHCIL_CERTIFICATE.search(upper)) + 2 * bool(GRN.search(upper)) + bool(KEYWORDS.search(upper))
+        if score:
+            scored.append((-score, index))
+    return sorted(index for _, index in sorted(scored)[:limit])
+
+
+def reduce_pdf(data):
+    """Keeps only the certificate page(s); scans without text keep the leading pages."""
+    if PdfReader is None:
+        return data
+    limit = getattr(settings, 'VERIFICATION_MAX_PAGES', 2)
+    stream = as_stream(data)
+    reader = PdfReader(stream)
+    if len(reader.pages) <= limit:
+        return data
+    keep = relevant_pages([page.extract_text() or '' for page in reader.pages], limit) or list(range(limit))
+    writer = PdfWriter()
+    for index in keep:
+        writer.add_page(reader.pages[index])
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue() if out.tell() < stream_size(stream) else data
+
+
+def reduce_image(data, mime_type):
+    """Downscales to VERIFICATION_IMAGE_MAX_SIDE and re-encodes as JPEG when that is smaller."""
+    if Image is None:
+        return data, mime_type
+    max_side = getattr(settings, 'VERIFICATION_IMAGE_MAX_SIDE', 1600)
+    stream = as_stream(data)
+    image = ImageOps.exif_transpose(Image.open(stream))
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        flat = Image.new('RGB', image.size, 'white')
+        flat.paste(image, mask=image.getchannel('A'))
+        image = flat
+    elif image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    out = io.BytesIO()
+    image.save(out, 'JPEG', quality=getattr(settings, 'VERIFICATION_IMAGE_QUALITY', 85), optimize=True)
+    if out.tell() < stream_size(stream):
+        return out.getvalue(), 'image/jpeg'
+    return data, mime_type
+
+
+def reduce_payload(data, mime_type, digest=None):
+    """
+    The smallest payload that still shows the certificate, as (data, mime type):
+    relevant PDF pages only, or a downscaled image. `data` is bytes or a binary
+    stream (pass its sha256 as `digest`); the original object comes back when
+    the optional libraries are missing or the file cannot be parsed.
+    """
+    key = (digest or hashlib.sha256(data).hexdigest(), mime_type)
+    cached = _reduced.get(key)
+    if cached is not None:
+        return cached
+
+    reduced = (data, mime_type)
+    try:
+        if mime_type == 'application/pdf':
+            reduced = (reduce_pdf(data), mime_type)
+        elif mime_type.startswith('image/'):
+            reduced = reduce_image(data, mime_type)
+    except Exception as e:
+        print(f"Payload reduction failed, sending original: {e}")
+
+    if reduced[0] is not data:
+        _reduced.set(key, reduced)
+    return reduced
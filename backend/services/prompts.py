@@ -0,0 +1,90 @@
+import string
+
+from documents.models import Prompt
+from .caching import LRUCache
+from .versioning import get_versions
+
+_NO_PROMPT = object()
+
+# Bumped on every Prompt save or delete (documents.signals), in any process
+VERSION_MODELS = ('documents.Prompt',)
+
+
+class CompiledPrompt:
+    """
+    An active Prompt with its user message pre-parsed into literal segments and
+    placeholder slots, so rendering is a join instead of a fresh str.format parse.
+    `version` is the simple_history id of the prompt revision it was built from.
+    """
+
+    def __init__(self, prompt_type, system_instruction, template, version=None):
+        self.prompt_type = prompt_type
+        self.system_instruction = system_instruction
+        self.template = template
+        self.version = version
+        self.fields = ()
+        self._parts = None
+        try:
+            parsed = list(string.Formatter().parse(template))
+        except ValueError:
+            return  # unbalanced braces: leave it to str.format to raise as before
+
+        if any(spec or conversion or (name and not name.isidentifier()) for _, name, spec, conversion in parsed):
+            return  # attribute/index access or format specs: not worth a fast path
+
+        self._parts = [(literal, name) for literal, name, _, _ in parsed]
+        self.fields = tuple(dict.fromkeys(name for _, name in self._parts if name))
+
+    def render(self, **kwargs):
+        if self._parts is None:
+            return self.template.format(**kwargs)
+        out = []
+        for literal, name in self._parts:
+            out.append(literal)
+            if name is not None:
+                out.append(str(kwargs[name]))
+        return ''.join(out)
+
+
+class PromptRegistry:
+    """
+    Per-process cache of compiled active prompts. Each entry remembers the
+    documents.Prompt version it was built from; a Prompt save or delete
+    (including simple_history reverts, which save) bumps that version, so
+    every process reloads within CATALOG_VERSION_LOCAL_TTL seconds.
+    """
+
+    def __init__(self):
+        self._cache = LRUCache(maxsize=64)
+
+    def get(self, prompt_type):
+        """CompiledPrompt for the active prompt of this type, or None."""
+        versions = get_versions(VERSION_MODELS, local=True)
+        entry = self._cache.get(prompt_type)
+        if entry is None or entry[0] != versions:
+            entry = (versions, self._load(prompt_type))
+            self._cache.set(prompt_type, entry)
+        compiled = entry[1]
+        return None if compiled is _NO_PROMPT else compiled
+
+    def _load(self, prompt_type):
+        try:
+            prompt = Prompt.objects.get(prompt_type=prompt_type, is_active=True)
+        except Prompt.DoesNotExist:
+            return _NO_PROMPT
+        latest = prompt.history.order_by('-history_id').values_list('history_id', flat=True).first()
+        return CompiledPrompt(
+            prompt_type,
+            prompt.system_instruction,
+            f"{prompt.input_format}\n{prompt.output_format}",
+            version=latest
+        )
+
+    def invalidate(self, prompt_type=None):
+        if prompt_type is None:
+            self._cache.clear()
+        else:
+            self._cache.delete(prompt_type)
+
+
+prompt_registry = PromptRegistry()
@@ -0,0 +1,265 @@
+import asyncio
+import random
+import threading
+import time
+
+import httpx
+from django.conf import settings
+from google.genai import errors, types
+
+# Status codes worth another attempt: rate limited, request timeout, and any 5xx
+RETRYABLE_CLIENT_CODES = {408, 429}
+
+
+class LLMUnavailable(Exception):
+    """The model was not called because the upstream is unhealthy or this process is saturated."""
+
+
+class CircuitOpen(LLMUnavailable):
+    pass
+
+
+class BulkheadFull(LLMUnavailable):
+    pass
+
+
+class DeadlineExceeded(LLMUnavailable):
+    pass
+
+
+def is_transient(error):
+    """Failures another attempt may fix: timeouts, dropped connections, 429/408 and 5xx answers."""
+    if isinstance(error, errors.ServerError):
+        return True
+    if isinstance(error, errors.ClientError):
+        return error.code in RETRYABLE_CLIENT_CODES
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError, TimeoutError, ConnectionError))
+
+
+def is_upstream_failure(error):
+    """True when serving a stale answer is better than failing (the upstream, not the request, is at fault)."""
+    return isinstance(error, LLMUnavailable) or is_transient(error)
+
+
+def backoff(attempt):
+    """Full-jitter exponential backoff: uniform in [0, min(max, base * 2**attempt)] seconds."""
+    base = getattr(settings, 'LLM_RETRY_BASE_DELAY', 0.5)
+    cap = getattr(settings, 'LLM_RETRY_MAX_DELAY', 8)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def with_timeout(config, timeout_ms):
+    """A copy of a GenerateContentConfig carrying a per-request timeout (the original, used in cache keys, is left alone)."""
+    return config.model_copy(update={'http_options': types.HttpOptions(timeout=timeout_ms)})
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after LLM_BREAKER_FAILURES consecutive transient failures;
+    open calls fail at once with CircuitOpen. After LLM_BREAKER_RESET seconds
+    one probe call is let through (half-open): success closes the breaker,
+    failure opens it for another period.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= getattr(settings, 'LLM_BREAKER_RESET', 30):
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == self.OPEN or (state == self.HALF_OPEN and self._probing):
+                raise CircuitOpen(f"{self.name} circuit is open")
+            if state == self.HALF_OPEN:
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= getattr(settings, 'LLM_BREAKER_FAILURES', 5):
+                if self.opened_at is None or self._probing:
+                    print(f"Circuit {self.name} opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self):
+        """A probe that ended without a verdict (e.g. a non-transient error) lets the next call probe."""
+        with self._lock:
+            self._probing = False
+
+
+class Bulkhead:
+    """At most LLM_MAX_CONCURRENCY model calls in flight per process; others wait up to LLM_BULKHEAD_WAIT seconds."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.limit = getattr(settings, 'LLM_MAX_CONCURRENCY', 8)
+        self._semaphore = threading.BoundedSemaphore(self.limit)
+
+    def acquire(self, timeout):
+        if not self._semaphore.acquire(timeout=max(0.0, timeout)):
+            raise BulkheadFull(f"{self.limit} model calls already in flight")
+
+    async def aacquire(self, timeout):
+        # Polls so the event loop is never blocked on the thread semaphore.
+        give_up = time.monotonic() + max(0.0, timeout)
+        while not self._semaphore.acquire(blocking=False):
+            if time.monotonic() >= give_up:
+                raise BulkheadFull(f"{self.limit} model calls already in flight")
+            await asyncio.sleep(0.05)
+
+    def release(self):
+        self._semaphore.release()
+
+
+class Upstream:
+    """
+    Deadline, retries, bulkhead and circuit breaker around one model API.
+
+    call(fn) runs fn(timeout_ms), where fn makes a single request with that
+    per-attempt timeout. Transient failures are retried with jittered backoff
+    while the overall LLM_CALL_DEADLINE allows; the last error is raised.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.breaker = CircuitBreaker(name)
+        self.bulkhead = Bulkhead()
+
+    def reset(self):
+        self.breaker.reset()
+        self.bulkhead.reset()
+
+    def _attempt_timeout(self, give_up):
+        remaining = give_up - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"{self.name} call deadline exceeded")
+        return int(min(getattr(settings, 'GEMINI_TIMEOUT', 60), remaining) * 1000)
+
+    def _retry_delay(self, error, attempt, give_up):
+        """Seconds to wait before the next attempt, or None to give up and raise `error`."""
+        if not is_transient(error) or attempt + 1 >= getattr(settings, 'LLM_RETRY_ATTEMPTS', 3):
+            return None
+        delay = backoff(attempt)
+        return delay if time.monotonic() + delay < give_up else None
+
+    def _settle(self, error):
+        if is_transient(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.release_probe()
+
+    def call(self, fn, tracker=None):
+        give_up = time.monotonic() + getattr(settings, 'LLM_CALL_DEADLINE', 90)
+        self.breaker.before_call()
+        try:
+            self.bulkhead.acquire(getattr(settings, 'LLM_BULKHEAD_WAIT', 5))
+        except BulkheadFull:
+            self.breaker.release_probe()
+            raise
+        try:
+            attempt = 0
+            while True:
+                try:
+                    result = fn(self._attempt_timeout(give_up))
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt, give_up)
+                    if delay is None:
+                        self._settle(e)
+                        raise
+                    print(f"{self.name} call failed ({e}); retrying in {delay:.2f}s")
+                    time.sleep(delay)
+                    attempt += 1
+                    if tracker is not None:
+                        tracker.retry()
+                    continue
+                self.breaker.record_success()
+                return result
+        finally:
+            self.bulkhead.release()
+
+    async def acall(self, fn, tracker=None):
+        """
+        Async call(): `fn(timeout_ms)` is a coroutine function. The bulkhead
+        slot is held until finish() is called, so a stream can keep it while
+        it is being read.
+        """
+        give_up = time.monotonic() + getattr(settings, 'LLM_CALL_DEADLINE', 90)
+        self.breaker.before_call()
+        acquired = False
+        try:
+            await self.bulkhead.aacquire(getattr(settings, 'LLM_BULKHEAD_WAIT', 5))
+            acquired = True
+            attempt = 0
+            while True:
+                try:
+                    return await fn(self._attempt_timeout(give_up))
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt, give_up)
+                    if delay is None:
+                        self._settle(e)
+                        raise
+                    print(f"{self.name} call failed ({e}); retrying in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    if tracker is not None:
+                        tracker.retry()
+        except BaseException:
+            # Including CancelledError (the client went away while the stream opened
+            # or during backoff): the slot and a half-open probe must not leak.
+            if acquired:
+                self.bulkhead.release()
+            self.breaker.release_probe()
+            raise
+
+    def finish(self, error=None):
+        """Ends an acall(): frees the bulkhead slot and reports the stream's outcome to the breaker."""
+        self.bulkhead.release()
+        if error is None:
+            self.breaker.record_success()
+        else:
+            self._settle(error)
+
+
+# One per process for the Gemini API, shared by generation and verification.
+gemini = Upstream('gemini')
+
+
+def stale_response(cache, subject, namespace_prefix):
+    """
+    (value, prompt_version) of the newest cached response for `subject` under
+    any prompt version, or None. Only used while the upstream is failing.
+    """
+    if cache is None or not subject or not getattr(settings, 'LLM_SERVE_STALE', True):
+        return None
+    found = cache.latest(subject, namespace_prefix)
+    if found is None:
+        return None
+    namespace, value = found
+    version = namespace.rpartition(':v')[2]
+    return value, int(version) if version.isdigit() else None
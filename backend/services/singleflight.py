@@ -0,0 +1,114 @@
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class SingleFlightTimeout(Exception):
+    pass
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key so the work runs only once.
+
+    Threads in the same process wait on the leader's result directly. Other
+    processes are kept out by a lease stored in the shared cache; while the
+    lease is held they poll `lookup` until the leader's result becomes visible
+    (e.g. the row it inserted).
+    """
+
+    def __init__(self, namespace, lease_timeout=None, wait_timeout=None, poll_interval=0.5, cache_alias=None):
+        self.namespace = namespace
+        self.lease_timeout = lease_timeout or getattr(settings, 'SINGLEFLIGHT_LEASE_TIMEOUT', 120)
+        self.wait_timeout = wait_timeout or getattr(settings, 'SINGLEFLIGHT_WAIT_TIMEOUT', 90)
+        self.poll_interval = poll_interval
+        self.cache_alias = cache_alias or getattr(settings, 'SINGLEFLIGHT_CACHE_ALIAS', 'shared')
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def do(self, key, fn, lookup=None):
+        """
+        Runs `fn()` once per key and returns its result to every concurrent caller.
+        `lookup()` is checked before running `fn` and while waiting on another
+        process; a non-None value short-circuits the call.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_exclusive(key, fn, lookup)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _lease_key(self, key):
+        return f"singleflight:{self.namespace}:{key}"
+
+    def acquire(self, key):
+        """
+        Takes the cross-process lease for `key` without waiting, for callers that
+        run the work themselves (e.g. streaming). Returns a token for release(),
+        or None if someone else holds the lease.
+        """
+        token = uuid.uuid4().hex
+        if self.cache.add(self._lease_key(key), token, self.lease_timeout):
+            return token
+        return None
+
+    def release(self, key, token):
+        lease_key = self._lease_key(key)
+        if self.cache.get(lease_key) == token:
+            self.cache.delete(lease_key)
+
+    def _run_exclusive(self, key, fn, lookup):
+        deadline = time.monotonic() + self.wait_timeout
+
+        while True:
+            token = self.acquire(key)
+            if token:
+                try:
+                    # Another process may have finished between our last poll and the lease.
+                    if lookup is not None:
+                        found = lookup()
+                        if found is not None:
+                            return found
+                    return fn()
+                finally:
+                    self.release(key, token)
+
+            if lookup is not None:
+                found = lookup()
+                if found is not None:
+                    return found
+
+            if time.monotonic() >= deadline:
+                raise SingleFlightTimeout(f"Timed out waiting for '{key}' in '{self.namespace}'")
+            time.sleep(self.poll_interval)
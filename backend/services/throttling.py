@@ -0,0 +1,193 @@
+import math
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+# A bucket's read-modify-write is guarded by a short lease in the shared cache.
+LOCK_TIMEOUT = 2  # seconds; a crashed holder blocks the bucket at most this long
+LOCK_ATTEMPTS = 20
+LOCK_POLL = 0.005
+
+
+class TokenBucket:
+    """
+    Token bucket kept in a Django cache so every worker process shares it.
+    Holds up to `capacity` tokens and refills at `refill_rate` tokens per
+    second; a request of weight `cost` is admitted when that many tokens are
+    left. State is (tokens, timestamp) and refill is computed on read, so idle
+    buckets cost nothing and simply expire.
+    """
+
+    def __init__(self, name, capacity, refill_rate, cache_alias=None):
+        self.name = name
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.cache_alias = cache_alias or getattr(settings, 'AI_THROTTLE_CACHE_ALIAS', 'shared')
+
+    @classmethod
+    def from_settings(cls, scope):
+        config = getattr(settings, 'AI_THROTTLE_BUCKETS', {})[scope]
+        return cls(scope, config['capacity'], config['refill_per_minute'] / 60)
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _state_key(self, key):
+        return f"throttle:{self.name}:{key}"
+
+    def _tokens(self, state, now):
+        if state is None:
+            return self.capacity
+        return min(self.capacity, state[0] + max(0.0, now - state[1]) * self.refill_rate)
+
+    def _wait_for(self, tokens, cost):
+        if cost > self.capacity:
+            # Can never be admitted; capacity must cover the largest request.
+            return self.capacity / self.refill_rate
+        return max(0.0, (cost - tokens) / self.refill_rate)
+
+    def check(self, key, cost=1):
+        """Seconds until `cost` tokens are available for `key` (0 when they are now); nothing is taken."""
+        return self._wait_for(self._tokens(self.cache.get(self._state_key(key)), time.time()), cost)
+
+    def consume(self, key, cost=1):
+        """
+        Takes `cost` tokens from the bucket for `key`. Returns 0 when admitted,
+        otherwise the seconds until enough tokens will have refilled (nothing is
+        taken). Costs above capacity are always refused.
+        """
+        return self._update(key, cost)
+
+    def refund(self, key, cost):
+        """Gives back tokens taken by consume() for a request that was refused elsewhere."""
+        self._update(key, -cost)
+
+    def _update(self, key, cost):
+        state_key = self._state_key(key)
+        lock_key = f"{state_key}:lock"
+        token = uuid.uuid4().hex
+        locked = False
+        for _ in range(LOCK_ATTEMPTS):
+            if self.cache.add(lock_key, token, LOCK_TIMEOUT):
+                locked = True
+                break
+            time.sleep(LOCK_POLL)
+        # Without the lock (heavy contention) we still decide; at worst a few requests race.
+
+        try:
+            now = time.time()
+            tokens = self._tokens(self.cache.get(state_key), now)
+            wait = self._wait_for(tokens, cost)
+            if wait:
+                return wait
+            tokens = min(self.capacity, tokens - cost)
+            full_after = math.ceil((self.capacity - tokens) / self.refill_rate)
+            self.cache.set(state_key, (tokens, now), full_after + 60)
+            return 0
+        finally:
+            if locked and self.cache.get(lock_key) == token:
+                self.cache.delete(lock_key)
+
+
+def throttle_cost(kind):
+    """Weight of one request of `kind` ('cached', 'fetch', 'generate', 'verify') from AI_THROTTLE_COSTS."""
+    return getattr(settings, 'AI_THROTTLE_COSTS', {}).get(kind, 1)
+
+
+def user_ident(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    return f"ip:{BaseThrottle().get_ident(request)}"
+
+
+def admit(request, cost):
+    """
+    Charges `cost` to every AI_THROTTLES bucket, or to none of them. All buckets
+    are checked first and only charged when each admits; if one refuses at
+    charge time (a concurrent request got there first), the buckets already
+    charged are refunded. Returns 0 when admitted, else the longest wait.
+    """
+    charges = []
+    for throttle_class in AI_THROTTLES:
+        throttle = throttle_class()
+        charges.append((TokenBucket.from_settings(throttle.scope), throttle.get_bucket_key(request)))
+
+    wait = max(bucket.check(key, cost) for bucket, key in charges)
+    if wait:
+        return wait
+    for index, (bucket, key) in enumerate(charges):
+        wait = bucket.consume(key, cost)
+        if wait:
+            for charged, charged_key in charges[:index]:
+                charged.refund(charged_key, cost)
+            return wait
+    return 0
+
+
+class AIThrottle(BaseThrottle):
+    """
+    Cost-aware token-bucket throttle for endpoints that may call the model.
+    The view's `throttle_cost(request)` gives the weight of the request (a
+    generation costs more than serving a stored template); views without it
+    are charged 1, and a cost of 0 skips the buckets entirely. The first
+    AIThrottle DRF asks decides for all of AI_THROTTLES (see admit()), so a
+    request refused by one bucket is not charged to the others. A rejected
+    request gets 429 with Retry-After.
+    """
+
+    scope = None
+
+    def get_bucket_key(self, request):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        self._wait = 0
+        # DRF asks every throttle; admission is decided once per request.
+        if getattr(request, '_ai_throttle_decided', False):
+            return True
+        request._ai_throttle_decided = True
+        cost_for = getattr(view, 'throttle_cost', None)
+        cost = cost_for(request) if cost_for is not None else 1
+        if not cost:
+            return True
+        self._wait = admit(request, cost)
+        return not self._wait
+
+    def wait(self):
+        return self._wait
+
+
+class AIUserThrottle(AIThrottle):
+    """Per user (per IP when anonymous)."""
+
+    scope = 'ai_user'
+
+    def get_bucket_key(self, request):
+        return user_ident(request)
+
+
+class AIGlobalThrottle(AIThrottle):
+    """One bucket for the whole deployment, protecting the shared model quota."""
+
+    scope = 'ai_global'
+
+    def get_bucket_key(self, request):
+        return 'all'
+
+
+AI_THROTTLES = [AIUserThrottle, AIGlobalThrottle]
+
+
+def check_ai_throttles(request, cost):
+    """
+    The same checks outside DRF (e.g. plain async views). Returns None when
+    admitted, else the seconds to put in Retry-After.
+    """
+    if not cost:
+        return None
+    return admit(request, cost) or None
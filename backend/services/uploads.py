@@ -0,0 +1,149 @@
+import hashlib
+import io
+import os
+
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, TemporaryFileUploadHandler
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def as_stream(data):
+    """A readable binary stream over bytes, or the stream itself."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return io.BytesIO(data)
+    return data
+
+
+def stream_size(stream):
+    position = stream.tell()
+    size = stream.seek(0, io.SEEK_END)
+    stream.seek(position)
+    return size
+
+
+class HashedTemporaryUploadedFile(TemporaryUploadedFile):
+    """A TemporaryUploadedFile that also knows its SHA-256 (hex), computed while it was received."""
+
+    sha256 = None
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """
+    Spools every upload to a temporary file (never to memory) and hashes it on
+    the way in. Requests whose Content-Length exceeds FILE_UPLOAD_MAX_REQUEST_SIZE
+    are refused before any data is read, and a file growing past
+    FILE_UPLOAD_MAX_SIZE stops the upload at that chunk. Both answer 400.
+    Saving the result to a FileField moves the temporary file instead of copying it.
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        limit = getattr(settings, 'FILE_UPLOAD_MAX_REQUEST_SIZE', None)
+        if limit and content_length and content_length > limit:
+            raise RequestDataTooBig(f"Upload of {content_length} bytes exceeds the {limit} byte limit.")
+
+    def new_file(self, *args, **kwargs):
+        # Skips TemporaryFileUploadHandler.new_file, which would create a temporary file of its own.
+        FileUploadHandler.new_file(self, *args, **kwargs)
+        self.file = HashedTemporaryUploadedFile(
+            self.file_name, self.content_type, 0, self.charset, self.content_type_extra
+        )
+        self.hasher = hashlib.sha256()
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        limit = getattr(settings, 'FILE_UPLOAD_MAX_SIZE', None)
+        if limit and self.received > limit:
+            self.upload_interrupted()
+            raise RequestDataTooBig(f"{self.file_name} exceeds the {limit} byte per-file limit.")
+        self.hasher.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.hasher.hexdigest()
+        return file
+
+
+class FileSource:
+    """
+    A file to verify, given as bytes, a filesystem path or a (uploaded) file
+    object. Hashing, sizing and reading go through open(), so on-disk inputs
+    are streamed in chunks rather than loaded whole.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self._sha256 = getattr(source, 'sha256', None)
+
+    @property
+    def path(self):
+        if isinstance(self.source, (str, os.PathLike)):
+            return os.fspath(self.source)
+        if hasattr(self.source, 'temporary_file_path'):
+            return self.source.temporary_file_path()
+        return None
+
+    def is_bytes(self):
+        return isinstance(self.source, (bytes, bytearray, memoryview))
+
+    def open(self):
+        """A fresh binary stream positioned at the start; the caller closes it."""
+        if self.is_bytes():
+            return io.BytesIO(self.source)
+        if self.path:
+            return open(self.path, 'rb')
+        self.source.seek(0)
+        return NonClosing(self.source)
+
+    @property
+    def size(self):
+        if self.is_bytes():
+            return len(self.source)
+        if self.path:
+            return os.path.getsize(self.path)
+        return getattr(self.source, 'size', None) or len(self.read())
+
+    @property
+    def sha256(self):
+        if self._sha256 is None:
+            hasher = hashlib.sha256()
+            if self.is_bytes():
+                hasher.update(self.source)
+            else:
+                with self.open() as stream:
+                    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                        hasher.update(chunk)
+            self._sha256 = hasher.hexdigest()
+        return self._sha256
+
+    def read(self):
+        if self.is_bytes():
+            return bytes(self.source)
+        with self.open() as stream:
+            return stream.read()
+
+
+class NonClosing(io.BufferedIOBase):
+    """Wraps a caller-owned file object so `with source.open()` does not close it."""
+
+    def __init__(self, file):
+        self._file = file
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
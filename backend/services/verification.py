@@ -1,10 +1,65 @@
 import json
 import base64
-from google import genai
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any
 from google.genai import types
 from django.conf import settings
+from django.db import close_old_connections
+
+from documents.models import PromptType
+from .certificates import preverify
+from .payloads import reduce_payload
+from .gemini_client import get_client
+from .llm_cache import get_response_cache, make_key, namespace_for
+from .metrics import record_event, track_call
+from .prompts import prompt_registry
+from .resilience import gemini, is_upstream_failure, stale_response
+from .uploads import FileSource
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    # Shared by all batches, so concurrent requests together stay within the limit.
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'VERIFICATION_BATCH_WORKERS', 4),
+                    thread_name_prefix='verification'
+                )
+    return _executor
+
+
+@dataclass
+class BatchItem:
+    key: Any
+    file_content: Any  # bytes, a path or a (temporary) uploaded file
+    expected_data: dict
+    mime_type: str = "application/pdf"
+
+
+@dataclass
+class BatchResult:
+    key: Any
+    result: dict | None
+    error: str | None
+    elapsed: float
+
+    @property
+    def timed_out(self):
+        return self.error == 'timeout'
+
+
+def verification_key(file_sha256, expected_data, model):
+    """Cache key for one check; the prompt version is the cache namespace."""
+    return make_key('verify', file_sha256, expected_data, model)
 
-from documents.models import Prompt, PromptType
 
 class VerificationService:
     def __init__(self):
@@ -13,51 +68,171 @@ class VerificationService:
             print("Warning: GEMINI_API_KEY not found in settings.")
         else:
              try:
-                self.client = genai.Client(api_key=self.api_key)
+                self.client = get_client()
              except Exception as e:
                 print(f"Error configuring Gemini client: {e}")
 
     def verify_document_data(self, file_content, expected_data: dict, mime_type="application/pdf"):
         """
         Verifies E-Stamp details against expected data using DB Prompt.
+        Model answers are cached per (file hash, expected_data) under the prompt
+        version, so a repeat check returns the stored result ('cached': True).
+        Text-layer PDFs whose numbers and values all match are confirmed locally
+        (result 'method' is 'text-layer'); everything else goes to the model.
+        `file_content` may be bytes, a path or an uploaded file; files are hashed
+        and parsed as streams, and ones over VERIFICATION_INLINE_MAX_BYTES are
+        sent through the Files API instead of inline.
+        While Gemini is failing, a result cached for the same check under an
+        older prompt version is returned with 'stale': True.
         """
-        if not self.api_key:
-            return None
-
         expected_json = json.dumps(expected_data, indent=2)
+        model = getattr(settings, 'GEMINI_MODEL', 'gemini-2.0-flash')
 
-        try:
-            prompt_obj = Prompt.objects.get(
-                prompt_type=PromptType.VERIFY_DOCUMENT,
-                is_active=True
-            )
-            system_instruction = prompt_obj.system_instruction
-            user_content = prompt_obj.construct_prompt(expected_json=expected_json)
-        except Prompt.DoesNotExist:
+        prompt = prompt_registry.get(PromptType.VERIFY_DOCUMENT)
+        if prompt:
+            system_instruction = prompt.system_instruction
+            user_content = prompt.render(expected_json=expected_json)
+            prompt_version = prompt.version
+        else:
             print("Warning: VERIFY_DOCUMENT prompt not found. Using fallback.")
             system_instruction = "You are a Legal Document Verification Agent."
             user_content = f"Check if this EXPECTED DATA matches the document:\n{expected_json}\nReturn JSON with is_correct, differences, certificate_number, grn_number."
+            prompt_version = None
+
+        cache = get_response_cache('verification')
+        namespace = namespace_for(PromptType.VERIFY_DOCUMENT, prompt_version)
+        source = FileSource(file_content)
+        cache_key = verification_key(source.sha256, expected_data, model)
+        cached = cache.get(namespace, cache_key) if cache else None
+        if cached is not None:
+            record_event(PromptType.VERIFY_DOCUMENT, prompt_version, model, 'cache_hit')
+            result = json.loads(cached)
+            result.update(prompt_version=prompt_version, method='model', cached=True)
+            return result
+
+        if getattr(settings, 'VERIFICATION_TEXT_PRECHECK', True):
+            with source.open() as stream:
+                result = preverify(stream, expected_data, mime_type)
+            if result is not None:
+                record_event(PromptType.VERIFY_DOCUMENT, None, model, 'text_layer')
+                result['prompt_version'] = None
+                return result
 
+        if not self.api_key:
+            return None
+
+        uploaded = None
         try:
-            response = self.client.models.generate_content(
-                model='gemini-2.0-flash',
-                contents=[
-                    types.Part.from_bytes(data=file_content, mime_type=mime_type),
-                    user_content
-                ],
-                config=types.GenerateContentConfig(
-                    system_instruction=system_instruction,
-                    response_mime_type="application/json",
-                    temperature=0.0
+            with track_call(PromptType.VERIFY_DOCUMENT, prompt_version, model, mime_type=mime_type) as call:
+                part, uploaded = self._document_part(source, mime_type)
+                call.start()  # latency is the model's, not the upload's
+                response = gemini.call(
+                    lambda timeout: self.client.models.generate_content(
+                        model=model,
+                        contents=[part, user_content],
+                        config=types.GenerateContentConfig(
+                            system_instruction=system_instruction,
+                            response_mime_type="application/json",
+                            temperature=0.0,
+                            http_options=types.HttpOptions(timeout=timeout)
+                        )
+                    ),
+                    call
                 )
-            )
+                call.response(response)
+
+                result_text = response.text
+                if result_text.startswith("```json"):
+                    result_text = result_text.replace("```json", "").replace("```", "")
 
-            result_text = response.text
-            if result_text.startswith("```json"):
-                result_text = result_text.replace("```json", "").replace("```", "")
-            
-            return json.loads(result_text)
+                result = json.loads(result_text)
+            if cache:
+                # subject: the same check under any prompt version
+                cache.set(namespace, cache_key, result_text, subject=cache_key)
+            result['prompt_version'] = prompt_version
+            result['method'] = 'model'
+            return result
 
         except Exception as e:
             print(f"Verification Error: {e}")
-            return None
+            stale = stale_response(cache, cache_key, f"{PromptType.VERIFY_DOCUMENT}:") if is_upstream_failure(e) else None
+            if stale is None:
+                return None
+            record_event(PromptType.VERIFY_DOCUMENT, stale[1], model, 'stale')
+            result = json.loads(stale[0])
+            result.update(prompt_version=stale[1], method='model', stale=True)
+            return result
+        finally:
+            if uploaded is not None:
+                try:
+                    self.client.files.delete(name=uploaded.name)
+                except Exception as e:
+                    print(f"Could not delete uploaded file {uploaded.name}: {e}")
+
+    def _document_part(self, source, mime_type):
+        """
+        The document as a request part, plus the Files API upload to delete
+        afterwards (or None). Reduced payloads and small files go inline; larger
+        ones are uploaded from disk so they are never held in memory whole.
+        """
+        if getattr(settings, 'VERIFICATION_PAYLOAD_REDUCTION', True):
+            with source.open() as stream:
+                data, reduced_mime = reduce_payload(stream, mime_type, digest=source.sha256)
+            if data is not stream:
+                return types.Part.from_bytes(data=data, mime_type=reduced_mime), None
+
+        if source.size <= getattr(settings, 'VERIFICATION_INLINE_MAX_BYTES', 8 * 1024 * 1024):
+            return types.Part.from_bytes(data=source.read(), mime_type=mime_type), None
+
+        with source.open() as stream:
+            uploaded = self.client.files.upload(
+                file=source.path or stream,
+                config=types.UploadFileConfig(mime_type=mime_type)
+            )
+        return types.Part.from_uri(file_uri=uploaded.uri, mime_type=uploaded.mime_type or mime_type), uploaded
+
+    def verify_batch(self, items, timeout=None):
+        """
+        Verifies many BatchItems on the shared verification pool and yields a
+        BatchResult for each as soon as it finishes (not in input order).
+        `timeout` is counted from when an item starts running, so items queued
+        behind a full pool are not penalised. A timed-out call is abandoned;
+        its thread ends when the client's own HTTP timeout fires.
+        """
+        timeout = timeout or getattr(settings, 'VERIFICATION_ITEM_TIMEOUT', 90)
+        started = {}
+
+        def run(item):
+            started[id(item)] = time.monotonic()
+            try:
+                return self.verify_document_data(item.file_content, item.expected_data, mime_type=item.mime_type)
+            finally:
+                close_old_connections()
+
+        executor = get_executor()
+        futures = {executor.submit(run, item): item for item in items}
+        pending = set(futures)
+        while pending:
+            now = time.monotonic()
+            running = [started[id(futures[f])] + timeout for f in pending if id(futures[f]) in started]
+            wait_for = max(0.0, min(running) - now) if running else 0.5
+            done, pending = wait(pending, timeout=min(wait_for, 0.5), return_when=FIRST_COMPLETED)
+
+            now = time.monotonic()
+            for future in done:
+                item = futures[future]
+                elapsed = now - started.get(id(item), now)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    yield BatchResult(item.key, None, str(e), elapsed)
+                    continue
+                yield BatchResult(item.key, result, None if result is not None else 'verification failed', elapsed)
+
+            for future in list(pending):
+                item = futures[future]
+                began = started.get(id(item))
+                if began is not None and now - began >= timeout:
+                    pending.discard(future)
+                    future.cancel()
+                    yield BatchResult(item.key, None, 'timeout', now - began)
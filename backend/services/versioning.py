@@ -0,0 +1,115 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+from .caching import LRUCache
+
+# Versions as this process last saw them, for checks that may lag other
+# processes' writes by up to the TTL (conditional GETs).
+_local = LRUCache(maxsize=256, ttl=getattr(settings, 'CATALOG_VERSION_LOCAL_TTL', 2))
+
+
+def _cache():
+    return caches[getattr(settings, 'CATALOG_VERSION_CACHE_ALIAS', 'shared')]
+
+
+def _key(label):
+    return f"catalog-version:{label.lower()}"
+
+
+def bump(*labels):
+    """Marks the models (app_label.Model) as changed. Call after any write that skips signals."""
+    now = time.time_ns()
+    _cache().set_many({_key(label): now for label in labels}, None)
+    for label in labels:
+        _local.set(_key(label), now)
+
+
+def get_versions(labels, local=False):
+    """
+    {label: version} in one cache round trip. A version is the time_ns of the
+    model's last change; a model with no recorded change gets one now, so a
+    cold or flushed cache only costs clients one full response.
+
+    With local=True versions are taken from this process's copy while it is
+    younger than CATALOG_VERSION_LOCAL_TTL seconds, so no round trip at all;
+    bump() in this process updates the copy at once.
+    """
+    keys = {_key(label): label for label in labels}
+    found = {}
+    if local:
+        for key in keys:
+            version = _local.get(key)
+            if version is not None:
+                found[key] = version
+    pending = [key for key in keys if key not in found]
+    if pending:
+        cache = _cache()
+        fetched = cache.get_many(pending)
+        missing = {key: time.time_ns() for key in pending if key not in fetched}
+        if missing:
+            for key, version in missing.items():
+                cache.add(key, version, None)
+            fetched.update(cache.get_many(missing))
+        for key, version in fetched.items():
+            _local.set(key, version)
+        found.update(fetched)
+    return {label: found[key] for key, label in keys.items()}
+
+
+def clear_local():
+    _local.clear()
+
+
+def _etag_matches(header, etag):
+    if header.strip() == '*':
+        return True
+    tags = {tag.strip().removeprefix('W/') for tag in header.split(',')}
+    return etag in tags
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified for list and retrieve on read-mostly viewsets, from the
+    change versions of `version_models` rather than from the response body.
+    A matching If-None-Match (or, without one, If-Modified-Since) returns 304
+    before the queryset is touched, usually without a cache round trip (see
+    get_versions(local=True)). Every model whose data appears in the
+    payload must be listed, and writes to them must call bump() (the app
+    signals do this for save/delete).
+    """
+
+    version_models = ()
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._conditional(request, super().retrieve, *args, **kwargs)
+
+    def _conditional(self, request, handler, *args, **kwargs):
+        versions = get_versions(self.version_models, local=True)
+        seed = '|'.join([request.get_full_path(), request.accepted_media_type or '']
+                        + [f"{label}={versions[label]}" for label in self.version_models])
+        etag = f'"{hashlib.sha256(seed.encode()).hexdigest()[:32]}"'
+        last_modified = max(versions.values()) // 1_000_000_000
+
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            not_modified = _etag_matches(if_none_match, etag)
+        else:
+            since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+            not_modified = since is not None and last_modified <= since
+
+        response = Response(status=status.HTTP_304_NOT_MODIFIED) if not_modified else handler(request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            response['Cache-Control'] = 'private, no-cache'
+            response['Vary'] = 'Accept, Authorization'
+        return response